@@ -4,19 +4,28 @@ import matplotlib.pyplot as plt
 import mahotas as mh
 from scipy import misc
 import GenSIP.functions as fun
+import GenSIP.bigscans.pyramid as pyramid
 from GenSIP.kuwahara import Kuwahara
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2TkAgg
 from matplotlib.figure import Figure
 import numpy as np
+import os
 
 
 def GUIfy(image):
     """
-    This method takes an image of a foil (a numpy ndarray, not a pathname),and starts 
+    This method takes an image of a foil (a numpy ndarray, or the path to an image
+    or a map in any of the formats of GenSIP.mapwriter, or the montage_pyramid
+    folder of a montage, which opens at screen size),and starts 
     up a GUI that allows the user to adjust the settings on various functions in 
     order to see their effects on the foil. The most developed of the sub-GUIs is 
     the regionalThresh GUI. 
     """
+    if type(image)==str and os.path.isdir(image):
+        pyr = pyramid.openPyramid(image)
+        image = pyr.read(pyr.levelFor(1024))
+    elif type(image)==str:
+        image = fun.loadImg(image)
     def makeOdd(n):
         #global past
         n = int(n)
@@ -0,0 +1,79 @@
+"""
+Benchmark of the cold-start cost of GenSIP: the time to import each of the main
+modules in a fresh interpreter, and which of the slow optional modules
+(matplotlib, mahotas, scipy and the analysis backends) the import pulls in.
+nexus only loads a backend the first time analyzeImage uses it (see
+nexus.METHODS), and matplotlib is only loaded when a plot is made, so none of
+them should show up after importing GenSIP.nexus.
+
+Run from the directory containing the GenSIP and standards folders:
+    python -m GenSIP.benchmarks.bench_import
+"""
+import subprocess
+import sys
+
+# Modules that are slow to import, and only needed by some of the work
+HEAVY = ['matplotlib', 'mahotas', 'scipy', 'GenSIP.cleantests',
+         'GenSIP.bigscans', 'GenSIP.histomethod']
+
+# Runs in the fresh interpreter: imports the module and prints the time it took
+# and the heavy modules that were loaded.
+_SCRIPT = """
+import sys, time
+import numpy, cv2
+t = time.time()
+import {module}
+t = time.time()-t
+heavy = [h for h in {heavy!r} if h in sys.modules]
+print repr((t, heavy))
+"""
+
+###################################################################################
+
+###################################################################################
+
+def coldImport(module, repeats=5):
+    """
+    Imports module in 'repeats' fresh interpreters, and returns the best import
+    time in seconds and the list of heavy modules (see HEAVY) it loaded. numpy
+    and cv2 are imported first, since every part of GenSIP needs them anyway.
+    """
+    times = []
+    heavy = []
+    for i in range(repeats):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       _SCRIPT.format(module=module, heavy=HEAVY)])
+        t, heavy = eval(out.strip().split('\n')[-1])
+        times.append(t)
+    return min(times), heavy
+
+###################################################################################
+
+###################################################################################
+
+def benchImports(modules=('GenSIP.nexus','GenSIP.functions','GenSIP.measure',
+                          'GenSIP.bigscans.bigfoils','GenSIP.histomethod.mainanalysis'),
+                 repeats=5):
+    """
+    Returns a dictionary of the cold import time (in seconds) and the heavy
+    modules loaded, keyed by module name:
+        {module:{'seconds':<best time>,'heavy':<list of heavy modules>}}
+    """
+    results = {}
+    for module in modules:
+        t, heavy = coldImport(module, repeats)
+        results[module] = {'seconds':t, 'heavy':heavy}
+    return results
+
+###################################################################################
+
+###################################################################################
+
+if __name__=='__main__':
+    results = benchImports()
+    print "Cold import times (best of 5, after numpy and cv2)"
+    print "  {0:34s} {1:>8s}   {2}".format('module', 'time (s)', 'heavy modules loaded')
+    for module in sorted(results, key=lambda m: results[m]['seconds']):
+        r = results[module]
+        print "  {0:34s} {1:8.3f}   {2}".format(module, r['seconds'],
+                                                 ', '.join(r['heavy']) or '-')
@@ -0,0 +1,61 @@
+"""
+Benchmark of the summed-area table Kuwahara filter against the original 
+convolution version (KuwaharaConv) over the window sizes 5 to 33. 
+
+Run from the directory containing the GenSIP and standards folders:
+    python -m GenSIP.benchmarks.bench_kuwahara
+"""
+import os
+import numpy as np
+from time import time
+
+import GenSIP.functions as fun
+import GenSIP.kuwahara as K
+
+###################################################################################
+
+###################################################################################
+
+def benchKuwahara(img, winsizes=range(5,34,4), repeats=3):
+    """
+    Times Kuwahara and KuwaharaConv on img for every window size in winsizes
+    and returns a dictionary of the results, keyed by window size:
+        {winsize:{'conv':<seconds>,'sat':<seconds>,'speedup':<ratio>,
+                  '% identical':<percent of pixels that match>}}
+    The times are the best of 'repeats' runs.
+    """
+    results = {}
+    for w in winsizes:
+        convTimes = []
+        satTimes = []
+        for i in range(repeats):
+            t1 = time()
+            conv = K.KuwaharaConv(img, w)
+            convTimes.append(time()-t1)
+            t1 = time()
+            sat = K.Kuwahara(img, w)
+            satTimes.append(time()-t1)
+        results[w] = {'conv':min(convTimes),
+                      'sat':min(satTimes),
+                      'speedup':min(convTimes)/max(min(satTimes),1e-9),
+                      '% identical':100*float(np.sum(conv==sat))/conv.size}
+    return results
+    
+###################################################################################
+
+###################################################################################
+
+if __name__=='__main__':
+    stdDir = 'standards/all_stds'
+    names = sorted([f for f in os.listdir(stdDir) if f.endswith('.tif')])
+    # PosterPreProc filters the tiles at rsize=.1, so bench at that scale too.
+    img = fun.loadImg(os.path.join(stdDir, names[0]))
+    small = img[::10,::10].copy()
+    for label, im in (('rsize .1', small), ('full size', img)):
+        print "Kuwahara on " + names[0] + " (" + label + ", " + str(im.shape) + ")"
+        print "  winsize   conv (s)    sat (s)   speedup   % identical"
+        results = benchKuwahara(im, repeats=1 if label=='full size' else 3)
+        for w in sorted(results):
+            r = results[w]
+            print "  {0:7d} {1:10.4f} {2:10.4f} {3:9.1f} {4:13.3f}".format(
+                w, r['conv'], r['sat'], r['speedup'], r['% identical'])
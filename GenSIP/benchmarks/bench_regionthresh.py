@@ -0,0 +1,68 @@
+"""
+Benchmark of the fused region thresholding kernel (regionthresh.regionThreshold)
+against the per-region version it replaced (regionthresh.regionThresholdLoop),
+with the regions and thresholds of regionalThresh and bigRegionalThresh, on a
+4096x4096 tile.
+
+Run from the directory containing the GenSIP and standards folders:
+    python -m GenSIP.benchmarks.bench_regionthresh
+"""
+import os
+import numpy as np
+from time import time
+
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+import GenSIP.regionthresh as RT
+
+###################################################################################
+
+###################################################################################
+
+def benchRegionThresh(img, poster, regions, threshType=0L, repeats=5):
+    """
+    Times regionThresholdLoop, regionThreshold, and regionThreshold writing to 
+    an 'out' buffer on img and returns a dictionary of the results:
+        {'loop':<seconds>,'fused':<seconds>,'fused, out=':<seconds>,
+         'speedup':<ratio>,'identical':<True or False>}
+    The times are the best of 'repeats' runs.
+    """
+    out = np.empty(img.shape, dtype=np.uint8)
+    times = {'loop':[],'fused':[],'fused, out=':[]}
+    for i in range(repeats):
+        t1 = time()
+        loop = RT.regionThresholdLoop(img, poster, regions, threshType)
+        times['loop'].append(time()-t1)
+        t1 = time()
+        fused = RT.regionThreshold(img, poster, regions, threshType)
+        times['fused'].append(time()-t1)
+        t1 = time()
+        RT.regionThreshold(img, poster, regions, threshType, out=out)
+        times['fused, out='].append(time()-t1)
+    results = dict([(k, min(times[k])) for k in times])
+    results['speedup'] = results['loop']/max(results['fused, out='],1e-9)
+    results['identical'] = np.array_equal(loop, fused) and np.array_equal(loop, out)
+    return results
+
+###################################################################################
+
+###################################################################################
+
+if __name__=='__main__':
+    stdDir = 'standards/all_stds'
+    names = sorted([f for f in os.listdir(stdDir) if f.endswith('.tif')])
+    # Tile a standard image up to 4096x4096
+    img = fun.loadImg(os.path.join(stdDir, names[0]))
+    reps = (4096//img.shape[0]+1, 4096//img.shape[1]+1)
+    tile = np.tile(img, reps)[:4096,:4096].copy()
+    cases = [('regionalThresh (cleantests dirt)', fun.makePoster(tile),
+              {50:(8,5), 85:(28,5), 150:(55,3), 255:(60,3)}),
+             ('bigRegionalThresh (bigfoils mo)', images.bigPosterfy(images.bigPostPreProc(tile)),
+              {50:(150,5), 85:(180,5), 150:(210,3), 200:(240,3), 255:(253,3)})]
+    print "Region thresholding on a " + str(tile.shape) + " tile of " + names[0]
+    print "  {0:34s} {1:>9s} {2:>9s} {3:>12s} {4:>8s} {5:>10s}".format(
+        'case', 'loop (s)', 'fused (s)', 'out= (s)', 'speedup', 'identical')
+    for label, poster, regions in cases:
+        r = benchRegionThresh(tile, poster, regions)
+        print "  {0:34s} {1:9.4f} {2:9.4f} {3:12.4f} {4:8.1f} {5:>10s}".format(
+            label, r['loop'], r['fused'], r['fused, out='], r['speedup'], str(r['identical']))
@@ -1,6 +1,6 @@
 import numpy as np
 import GenSIP.functions as fun
-import GenSIP.bigscans.bigfoils as bf
+import GenSIP.bigscans.tilestore as ts
 
 from matplotlib import pyplot as plt
 import os
@@ -33,6 +33,14 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
                 constant at their start value (below). 
             - Pstart, Dstart, Mstart, Ptstart: The values at which to start the 
                 threshold domain. 
+            - storeDir: folder of the preprocessed tile store (see 
+                GenSIP.bigscans.tilestore). Default is the "TileStore" folder in
+                the output folder. The tiles are decoded and posterized once 
+                into the store, and every threshold point reads from it.
+            - gaussBlur: Size of the Gaussian blur of the Mo, highEx and Pt
+                regions. Default set to 3.
+            - Other key-word arguments are passed on to bigPostPreProc when the
+                store is built (KuSize, Gaus1, Gaus2, rsize, ExcludeDirt, ...)
             
             
     For Mo analysis:
@@ -53,6 +61,11 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
     hEstart=kwargs.get("hEstart",230)
     Ptstart=kwargs.get("Ptstart",240)
     res=kwargs.get("res",4)
+    storeDir=kwargs.get("storeDir",None) # Folder of the preprocessed tile store
+    gaussBlur=kwargs.get("gaussBlur",3) # Blur of the Mo, highEx and Pt regions
+    posterKw = dict([(k,v) for k,v in kwargs.items() if k not in 
+                     ("foilname","quarter","domain","step","RUN","Pstart","Dstart",
+                      "Mstart","hEstart","Ptstart","res","storeDir","gaussBlur")])
 
     t1 = time()
     # Create arrays for the plot:
@@ -127,9 +140,6 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
     outFolder = 'Output/Output_'+foilname+"_"+Quarter
     if not os.path.exists(outFolder):
         os.makedirs(outFolder)
-    if not os.path.exists(outFolder+'/Plots/'+'Threshold_'+MoDirt):
-        os.makedirs(outFolder+'/Plots/'+'Threshold_'+MoDirt)
-    
     
     allowableMo = ("Mo","Moly","moly","molybdenum","Molybdenum","M","m")
     allowableDirt = ("Dirt","dirt","D","d")
@@ -137,6 +147,9 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
     # Create a Dictionary to store the data:
     datestring = fun.getDateString()
     datestring.replace(':','.')
+    # The plots are saved to a folder with the date in its name
+    if not os.path.exists(outFolder+'/Plots/'+'Threshold_'+MoDirt+"_"+datestring):
+        os.makedirs(outFolder+'/Plots/'+'Threshold_'+MoDirt+"_"+datestring)
     host = os.path.splitext(gethostname())[0]
     Version = fun.getGenSIPVersion()
     
@@ -157,10 +170,15 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
     y3 = np.zeros((numpoints))
     
     if MoDirt in allowableMo:
+        # Decode and posterize the tiles once. Every point reads from the store.
+        if storeDir is None:
+            storeDir = outFolder+'/TileStore'
+        store = ts.openTileStore(panFolder, maskFolder, storeDir, gaussBlur,
+                                 verbose=True, **posterKw)
         for i in range(numpoints):
             t1=time()
             ret = BIGanalyzeMoly(panSubs,panFolder, maskFolder, P=P[i],D=D[i],\
-            M=M[i],HE=hE[i],Pt=Pt[i],I=str(i),MoDirt=MoDirt,res=res)
+            M=M[i],HE=hE[i],Pt=Pt[i],I=str(i),MoDirt=MoDirt,res=res,store=store)
             totFoilArea = ret[0]
             totPtArea = ret[1]
             #PerPtLoss = (Ptbef-Ptaft)/Ptbef
@@ -313,29 +331,32 @@ def threshPrec(panFolder,maskFolder, MoDirt="Mo",**kwargs):
 
 ###################################################################################
 
-def BIGanalyzeMoly(panSubs,panFolder,maskFolder, P=150,D=180,M=210,HE=253,Pt=240,I='',MoDirt='Mo',res=4):
-    panSubs=os.listdir(panFolder)
-    panSubs[:] = [img for img in panSubs if img.startswith("sub_")]
-    panSubs[:] = [img for img in panSubs if img.endswith(".tif")]
+def BIGanalyzeMoly(panSubs,panFolder,maskFolder, P=150,D=180,M=210,HE=253,Pt=240,I='',MoDirt='Mo',res=4,
+                   store=None,storeDir=None,gaussBlur=3):
+    """
+    Returns the total foil area, the total exposed Pt area and the percent of
+    exposed Pt of the sub-images in panFolder at one set of thresholds. The
+    sub-images are read from the preprocessed tile store 'store' (see 
+    GenSIP.bigscans.tilestore). If no store is given, the one in storeDir 
+    (default Output/TileStore/<name of panFolder>) is opened, and built first
+    if it is missing or out of date.
+    """
+    if store is None:
+        if storeDir is None:
+            storeDir = 'Output/TileStore/'+os.path.basename(os.path.normpath(panFolder))
+        store = ts.openTileStore(panFolder, maskFolder, storeDir, gaussBlur)
     totPtArea = 0
     totFoilArea = 0
-    for sub in panSubs:
-        root,ext = os.path.splitext(sub)
-        
+    for tile in store:
         # Create the threshholded image
-        subImage = fun.loadImg(panFolder+'/'+sub,0)
-        subMask = fun.loadImg(maskFolder+'/'+sub,0)
-        proc = bf.bigPostPreProc(subImage)
-        poster = bf.bigPosterfy(proc)
-        threshed = bf.bigRegionalThresh(subImage,poster,Mask=subMask,\
-        p=P,d=D,m=M,hE=HE,pt=Pt,MoDirt=MoDirt)
-        threshed = threshed.astype(np.bool_)
+        threshed = ts.threshTile(tile,p=P,d=D,m=M,hE=HE,pt=Pt,
+                                 gaussBlur=store.gaussBlur,MoDirt=MoDirt)
         
         # Get amount of exposed Platinum:
         
         PixPt = np.sum(threshed)
         AreaPt = round(PixPt*res*10**-6, 4)
-        PixFoil = np.sum(subMask.astype(np.bool_))
+        PixFoil = np.sum(tile['mask'])
         AreaFoil = round(PixFoil*res*10**-6, 4)
         
         if AreaFoil == 0:
@@ -343,9 +364,6 @@ def BIGanalyzeMoly(panSubs,panFolder,maskFolder, P=150,D=180,M=210,HE=253,Pt=240
         else:
             PercPt = round(float(AreaPt)/float(AreaFoil)*100,2)
         
-        # Make output image
-        threshed=threshed.astype(np.uint8)*255
-        
         totPtArea = totPtArea + AreaPt
         totFoilArea = totFoilArea + AreaFoil
         del(threshed)
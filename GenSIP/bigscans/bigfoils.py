@@ -6,11 +6,15 @@ import cv2
 import os
 
 import numpy as np
-import mahotas as mh
 import GenSIP.functions as fun
 import GenSIP.measure as meas
 import GenSIP.bigscans.images as images
+import GenSIP.bigscans.tilelabel as tilelabel
+from GenSIP.bigscans.tilesource import TileSource
 import GenSIP.gencsv as gencsv
+import GenSIP.pipeline as pipe
+import GenSIP.mapwriter as mapwriter
+from GenSIP.regionthresh import regionThreshold
 
 
 #Q1 = fun.loadImg("InputPicts/FoilScans/Q1/panorama.tif",0)
@@ -20,12 +24,15 @@ import GenSIP.gencsv as gencsv
 ################################################################################
 
 def analyzePano(panPath, maskPath, res, foilname, 
-                Quarter="", MoDirt="Mo", GenPoster=False, verbose=True):
+                Quarter="", MoDirt="Mo", GenPoster=False, verbose=True, resume=False,
+                virtual=True, halo=0, numParts=256):
     """
     This function runs full analysis on a single panorama SEM scan of a foil. 
-    Essentially all this does is split up the panorama and mask images, puts 
-    the resulting subimages into folders, and then calls 'analyzeSubImages' on 
-    the folders of sub-images. 
+    Essentially all this does is split up the panorama and mask images into 
+    sub-images, and then calls 'analyzeSubImages' on them. The sub-images are
+    read from the panorama as they are analyzed (see 
+    GenSIP.bigscans.tilesource), unless virtual is False: then they are 
+    written to folders first, like they used to be.
     
     The inputs are:
         Arguments:
@@ -51,21 +58,36 @@ def analyzePano(panPath, maskPath, res, foilname,
                 or for dirt analysis: "Dirt","dirt","D","d"
         - GenPoster - option if the user wants to generate and save poster images
             in order to see how the image is split up into regions. 
+        - resume - skip the sub-images already in the CSV file of an earlier, 
+            unfinished run (see analyzeSubImages).
+        - virtual - read the sub-images from the panorama (memory mapped where
+            the file allows it, see tilesource.openPanorama) instead of writing
+            them to InputPicts/FoilScans/<foilname> and reading them back.
+        - halo - pixels of the panorama around every sub-image that the 
+            analysis also sees (virtual sub-images only, see TileSource)
+        - numParts - number of sub-images. Must be a perfect square.
     """
     print "MoDirt:  " + MoDirt
+    if virtual:
+        tiles = TileSource(panPath, maskPath, numParts=numParts, halo=halo)
+        analyzeSubImages(tiles,None,res,foilname,Quarter,MoDirt,GenPoster,
+                         resume=resume)
+        return
+    
     panorama = fun.loadImg(panPath, 0)
-    images.splitImage(panorama, 256, path="InputPicts/FoilScans/"+foilname, name=Quarter)
+    images.splitImage(panorama, numParts, path="InputPicts/FoilScans/"+foilname, name=Quarter)
     del(panorama)
     
     mask = fun.loadImg(maskPath, 0)
-    images.splitImage(mask, 256, path="InputPicts/FoilScans/"+foilname, name=Quarter+"_mask")
+    images.splitImage(mask, numParts, path="InputPicts/FoilScans/"+foilname, name=Quarter+"_mask")
     del(mask)
     
     panFolder = "InputPicts/FoilScans/"+foilname+"/sub_imgs_"+Quarter
     maskFolder = "InputPicts/FoilScans/"+foilname+"/sub_imgs_"+Quarter+"_mask"
     
     # Call analyze sub images. 
-    analyzeSubImages(panFolder,maskFolder,res,foilname,Quarter,MoDirt,GenPoster)
+    analyzeSubImages(panFolder,maskFolder,res,foilname,Quarter,MoDirt,GenPoster,
+                     resume=resume)
 
 ################################################################################
 
@@ -73,17 +95,21 @@ def analyzePano(panPath, maskPath, res, foilname,
 
 
 def analyzeSubImages(panFolder, maskFolder, res, foilname,  
-                     Quarter="", MoDirt="Mo",  GenPoster=False, verbose=False):
+                     Quarter="", MoDirt="Mo",  GenPoster=False, verbose=False,
+                     resume=False, pipeline=True, mapFormat='png'):
     """
     This function runs the analysis on all of the subimages of the panorama. It 
     writes the output to a csv file and produces images of the dirt and exposed 
-    platinum on the foil. 
+    platinum on the foil. The dirt totals count and size the particles of the
+    whole panorama, with the particles that cross the seams between sub-images
+    merged (see GenSIP.bigscans.tilelabel).
     
         Arguments:
         - panFolder - Path string to the folder containing all of the sub-
-            images of the panorama.
+            images of the panorama, or a TileSource (see 
+            GenSIP.bigscans.tilesource) that reads them from the panorama.
         - maskFolder - Path string to the folder containing all of the sub-
-            images of the mask.
+            images of the mask. Not used with a TileSource, which has the mask.
         - res - Resolution of the image, in square microns per pixel.
         - foilname - The name/serial number of the foil being analyzed, for 
             example: "40360,2". 
@@ -98,18 +124,33 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
                 or for dirt analysis: "Dirt","dirt","D","d"
         - GenPoster - option if the user wants to generate and save poster images
             in order to see how the image is split up into regions. 
+        - resume - The CSV file is written one row per finished sub-image (see
+            GenSIP.gencsv). If True, the sub-images that already have a row in
+            the CSV file of an earlier, unfinished run are skipped, and the 
+            totals are calculated from their rows and maps.
+        - pipeline - Decode the next sub-images and write the maps of the 
+            previous ones on background threads while a sub-image is analyzed
+            (see GenSIP.pipeline). 
+        - mapFormat - File format of the maps and posters: 'png', 'fastpng',
+            'png1' (1 bit PNG), 'bits' (packed bits in .npz) or 'none' (see 
+            GenSIP.mapwriter). The dirt totals are measured on the maps, so
+            they need a format that writes them.
                 
     """
-    # Create a list of the the contents of the panFolder and maskFolder, which will 
-    # Produce a list of the names of all of the subimages in the pan & mask folders.
-    # I.e. one element of the list would be the string: "sub_004_004.tiff"
-    
-    panSubs = os.listdir(panFolder)
-    maskSubs = os.listdir(maskFolder)
+    # Create a list of the names of all of the subimages, i.e. one element of 
+    # the list would be the string: "sub_004_004.tiff" ("sub_004_004" for a
+    # TileSource). The masks have the same names in the maskFolder.
     
-    # Make sure only subImages appear in panSubs and maskSubs
-    panSubs = FILonlySubimages(panSubs, limitToType=0)
-    maskSubs = FILonlySubimages(maskSubs, limitToType=0)
+    if isinstance(panFolder, TileSource):
+        # Virtual sub-images, in the order of the rows of the CSV file
+        tiles = panFolder
+        panSubs = tiles.names()
+    else:
+        tiles = None
+        panSubs = os.listdir(panFolder)
+        # Make sure only subImages appear in panSubs, in the order of the rows
+        # of the CSV file
+        panSubs = sorted(FILonlySubimages(panSubs, limitToType=0))
     
     """Create Output Folders"""
     
@@ -126,6 +167,11 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
     # Use checkMoDirt to limit MoDirt's value to either 'mo' or 'dirt' 
     MoDirt = fun.checkMoDirt(MoDirt)
     
+    mapExt = mapwriter.formatExt(mapFormat)
+    if mapExt is None and MoDirt=='dirt':
+        raise Exception("The dirt totals are measured on the maps, so mapFormat "
+                        "cannot be 'none' for dirt analysis.")
+    
     
     if MoDirt=='mo':
         MapFolder = os.path.join(outFolder,'PtMaps')
@@ -136,31 +182,56 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
     if not os.path.exists(MapFolder):
         os.makedirs(MapFolder)
     
-    """Iterate through the sub-images in the sub image folder"""    
+    if MoDirt=='mo':
+        ColHeaders = ['SubImage #',
+                      'Pt Area (mm^2)',
+                      'Foil area (mm^2)',
+                      '% Exposed Pt']
+        AreaHead = 'Pt Area (mm^2)'
+    elif MoDirt=='dirt':
+        ColHeaders = ['SubImage #',
+                      "Dirt Count",
+                      "Dirt Area (mm^2)", 
+                      "Foil area (mm^2)",
+                      "% Covered in dirt",
+                      'Mean Particle Area (micron^2)',
+                      'Max Particle Area (micron^2)',
+                      'Approx % Parts. w/ >100micron diam.']
+        AreaHead = "Dirt Area (mm^2)"
         
-    # Initialize the Data Dictionary, total Foil Area and total dirt/Pt area variables  
-    Data = {}
-    totFoilArea = 0
-    totArea = 0
-    #AllSizes = np.zeros((0,))
+    # Create the CSV File. The row of each sub-image is written as soon as it
+    # is done, so an interrupted run can be resumed.
+    title = Quarter + " " + MoDirt + " Data"
+    filePath = outFolder+'/'+Quarter+'_'+MoDirt+'Data.csv'
+    bigCSV = gencsv.DataToCSV(filePath, title, resume=resume)
+    bigCSV.startStream(ColHeaders)
     
-    for sub in panSubs:
-        
-        name, ext = os.path.splitext(sub)
+    """Iterate through the sub-images in the sub image folder"""    
         
+    # Initialize the Data Dictionary with the rows of the resumed run  
+    Data = dict(bigCSV.DoneData)
+    
+    def loadSub(sub):
+        # Decode stage
+        if tiles is not None:
+            return tiles.tile(sub)
         subImage = fun.loadImg(panFolder+'/'+sub,0)
         subMask = fun.loadImg(maskFolder+'/'+sub,0)
+        return subImage, subMask
+        
+    def analyzeSub(sub, loaded):
+        # Compute stage
+        name, ext = os.path.splitext(sub)
+        subImage, subMask = loaded
         subMask = cv2.morphologyEx(subMask, cv2.MORPH_ERODE, np.ones((5,5)))
         
         # Create the threshholded image, poster, and the measurement data
         # ImgAnalysis always outputs two tuples: stats and picts
+        # Only the sub-image itself is measured, not the halo around it
+        core = tiles.core(sub) if tiles is not None else None
         stats, picts = ImgAnalysis(subImage, subMask, 
                                    res, MoDirt=MoDirt, 
-                                   returnSizeData=True)
-                                   
-        # Extract the thresholded image and poster from the picts tuple
-        (threshed,
-         poster) = picts
+                                   returnSizeData=True, core=core)
         
         if MoDirt=='mo': 
             """Molybdenum Analysis"""
@@ -173,11 +244,6 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
             Data[name] = {'Pt Area (mm^2)':Area, 
                           'Foil area (mm^2)':AreaFoil,
                           '% Exposed Pt':PercPt}
-            
-            # Make output image
-            cv2.imwrite(os.path.join(MapFolder, name+".png"),
-                        threshed,
-                        [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
                         
             if verbose: 
                 print sub + " Pt Area: " + str(Area) + " mm^2"
@@ -202,33 +268,47 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
                           'Mean Particle Area (micron^2)':MeanSize,
                           'Max Particle Area (micron^2)':MaxSize,
                           'Approx % Parts. w/ >100micron diam.':percAreaOver100}
-                          
-            # Make output image(s)
-            cv2.imwrite(os.path.join(MapFolder,name+".png"),
-                        threshed,
-                        [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
-            #AllSizes = np.append(AllSizes, Sizes)
             if verbose: 
                 print sub +" dirt count: " + str(numDirt)
-                
-        totArea += Area
-        totFoilArea += AreaFoil
         
+        # The thresholded image and the poster
+        return picts
+        
+    def saveSub(sub, picts):
+        # Encode stage
+        name, ext = os.path.splitext(sub)
+        (threshed,
+         poster) = picts
+        
+        # Make output image
+        mapwriter.writeMap(MapFolder, name, threshed, mapFormat)
         if GenPoster:
-            cv2.imwrite(outFolder+'/PosterMaps/'+name+".png", 
-                        poster, 
-                        [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
-            
-        del(threshed)
-        del(poster)
+            mapwriter.writeMap(outFolder+'/PosterMaps', name, poster, 
+                               mapFormat, binary=False)
+        
+        # The maps are written, so the sub-image is done
+        bigCSV.writeRow(name, Data[name])
+        
+    todo = [sub for sub in panSubs if not bigCSV.isDone(os.path.splitext(sub)[0])]
+    stats = pipe.runPipeline(todo, loadSub, analyzeSub, saveSub, threaded=pipeline)
+    if verbose: print stats.report()
         
     # Stitch together montage images
-    images.stitchImage(MapFolder)
+    if mapExt is not None:
+        images.stitchImage(MapFolder, imgType=mapExt)
     
-    if GenPoster:
-        images.stitchImage(outFolder+'/PosterMaps')
+    if GenPoster and mapExt is not None:
+        images.stitchImage(outFolder+'/PosterMaps', 
+                           imgType=mapwriter.formatExt(mapFormat, binary=False))
     
     """ Calculate the Totals """ 
+    # From the rows, so that the sub-images of a resumed run are included
+    totFoilArea = 0
+    totArea = 0
+    for sub in panSubs:
+        name, ext = os.path.splitext(sub)
+        totArea += Data[name][AreaHead]
+        totFoilArea += Data[name]['Foil area (mm^2)']
     if totFoilArea == 0:
         Perc = np.nan
     else:
@@ -237,41 +317,37 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
     totArea = round(float(totArea)/100,4)
     totFoilArea = round(float(totFoilArea)/100,2)
 
-    # ColHeaders = ['SubImage #']
-    # ColHeaders.extend(Data[name].keys())
     """ Prepare Totals for Incorporation into the CSV file """
     if MoDirt=='mo':
-        ColHeaders = ['SubImage #',
-                      'Pt Area (mm^2)',
-                      'Foil area (mm^2)',
-                      '% Exposed Pt']
-                        
         Data["TOTALS"] = {"Foil Area (cm^2)":totFoilArea,
                           "Exposed Pt Area (cm^2)":totArea,
                           "% Exposed Pt":Perc}
                             
         
     elif MoDirt=='dirt':
-        ColHeaders = ['SubImage #',
-                      "Dirt Count",
-                      "Dirt Area (mm^2)", 
-                      "Foil area (mm^2)",
-                      "% Covered in dirt",
-                      'Mean Particle Area (micron^2)',
-                      'Max Particle Area (micron^2)',
-                      'Approx % Parts. w/ >100micron diam.']
-                      
+        # Count and size the dirt of the whole panorama. Particles that cross
+        # the seams between the sub-images are merged, so they are only 
+        # counted once (see GenSIP.bigscans.tilelabel).
+        panParts = tilelabel.tiledParticleStats(MapFolder, res, imgType=mapExt)
+        # Size distribution of the whole foil
+        panSizes = meas.SizeAccumulator(res).update(panParts)
+        panSizes.save(os.path.join(outFolder, Quarter+'_DirtSizes.npz'))
+        meas.makeSizeHistogram(panSizes, res, Quarter, outFolder)
+        (MeanSize, 
+         MaxSize, 
+         percAreaOver100) = meas.getDirtSizeData(panSizes, res)
+        
         Data['TOTALS'] = {"Foil Area (cm^2)":totFoilArea,
                           "Exposed Dirt Area (cm^2)":totArea,
-                          "% Covered in Dirt":Perc}
-        #meas.makeSizeHistogram(AllSizes, res, Quarter,outFolder)
+                          "% Covered in Dirt":Perc,
+                          "Dirt Count":panParts.size,
+                          'Mean Particle Area (micron^2)':MeanSize,
+                          'Max Particle Area (micron^2)':MaxSize,
+                          'Approx % Parts. w/ >100micron diam.':percAreaOver100}
 
             
-    # Create CSV File and write Data to it.
-    title = Quarter + " " + MoDirt + " Data"
-    filePath = outFolder+'/'+Quarter+'_'+MoDirt+'Data.csv'
-    bigCSV = gencsv.DataToCSV(filePath, title)
-    bigCSV.writeDataFromDict(Data, colHeads=ColHeaders)
+    # Write the totals after the rows of the sub-images
+    bigCSV.writeFooter(Data)
     bigCSV.closeCSVFile()
     
 
@@ -280,10 +356,20 @@ def analyzeSubImages(panFolder, maskFolder, res, foilname,
 
 ################################################################################
 
-def ImgAnalysis(img, mask, res, MoDirt='mo',returnSizeData=False,returnSizes=False):
-    
+def ImgAnalysis(img, mask, res, MoDirt='mo',returnSizeData=False,returnSizes=False,
+                poster=None,blurs=None,core=None):
+    """
+    Runs the bigfoils Mo or dirt analysis on one image. A poster and the region
+    blurs (functions.regionBlurs) already made for the image can be passed in 
+    with 'poster' and 'blurs', so that a Mo and a dirt pass can share them.
+    If 'core' is given (a pair of slices), only that part of the image is 
+    measured and returned; the rest is only there for the filters to see (the
+    halo of a TileSource).
+    """
     MoDirt = fun.checkMoDirt(MoDirt)
-    threshed, poster = threshImage(img, Mask=mask,MoDirt=MoDirt)
+    threshed, poster = threshImage(img, Mask=mask,MoDirt=MoDirt,poster=poster,blurs=blurs)
+    if core is not None:
+        threshed, poster, mask = threshed[core], poster[core], mask[core]
     PixFoil = np.sum(mask.astype(np.bool_))
     AreaFoil = round(PixFoil*res*10**-6, 4)
     
@@ -293,15 +379,15 @@ def ImgAnalysis(img, mask, res, MoDirt='mo',returnSizeData=False,returnSizes=Fal
         returnSizeData = False
         
     elif MoDirt =='dirt':
-        Area, numDirt,sizes,labeled = meas.calcDirt(threshed,
-                                                    res, 
-                                                    returnSizes=True,
-                                                    returnLabelled=True, 
-                                                    getAreaInSquaremm=True)
+        # One labelling pass gives the count, the area and the size data
+        parts = meas.particleStats(threshed, res)
+        numDirt = parts.size
+        sizes = np.sort(parts['area'])[::-1]
+        Area = float(sizes.sum()*res*10**-6)
                                                     
         (MeanSize, 
          MaxSize, 
-         percAreaOver100) = meas.getDirtSizeData(sizes, res)
+         percAreaOver100) = meas.getDirtSizeData(parts, res)
         
         SizeData = (MeanSize, MaxSize, percAreaOver100)
         
@@ -332,14 +418,15 @@ def ImgAnalysis(img, mask, res, MoDirt='mo',returnSizeData=False,returnSizes=Fal
 ################################################################################
 
 
-def threshImage(img, Mask=False,MoDirt='mo'):
+def threshImage(img, Mask=False,MoDirt='mo',poster=None,blurs=None):
     """
     Takes an image and optional mask and MoDirt option and preprocesses the image
     and performs regionalThresh on it, and returns the trhesholded image and the 
-    poster. 
+    poster. If the poster is given, the preprocessing is skipped.
     """
-    proc = images.bigPostPreProc(img)
-    poster = images.bigPosterfy(proc)
+    if poster is None:
+        proc = images.bigPostPreProc(img)
+        poster = images.bigPosterfy(proc)
     
     if fun.checkMoDirt(MoDirt)=='mo':
         threshed = bigRegionalThresh(img,poster,
@@ -349,7 +436,8 @@ def threshImage(img, Mask=False,MoDirt='mo'):
                                      m=210,
                                      hE=240,
                                      pt=253,
-                                     MoDirt=MoDirt)
+                                     MoDirt=MoDirt,
+                                     blurs=blurs)
                                      
     elif fun.checkMoDirt(MoDirt)=='dirt':
         threshed = bigRegionalThresh(img,poster,
@@ -359,7 +447,8 @@ def threshImage(img, Mask=False,MoDirt='mo'):
                                      m=55,
                                      hE=60,
                                      pt=70,
-                                     MoDirt=MoDirt)
+                                     MoDirt=MoDirt,
+                                     blurs=blurs)
                                      
     threshed = threshed.astype(np.uint8)
     return threshed, poster
@@ -368,7 +457,8 @@ def threshImage(img, Mask=False,MoDirt='mo'):
 
 ################################################################################
 
-def bigRegionalThresh(ogimage,poster,p=8,d=28,m=55,hE=60,pt=70,gaussBlur=3,threshType=0L,Mask=0,GetMask=0,MoDirt="Mo"):
+def bigRegionalThresh(ogimage,poster,p=8,d=28,m=55,hE=60,pt=70,gaussBlur=3,threshType=0L,Mask=0,GetMask=0,MoDirt="Mo",
+                      blurs=None):
     """
      This is the main thresholding method for analyzing the amount of Pt and dirt on
     the foils. It takes the posterized image and splits the image into regions based on
@@ -381,55 +471,21 @@ def bigRegionalThresh(ogimage,poster,p=8,d=28,m=55,hE=60,pt=70,gaussBlur=3,thres
     cut out so that only the dirt appears. This allows mh.label to count the dirt and not get
     thrown off by the foil outline. If the option "GetMask" is set to True, then regionalThresh
     also returns the image of the outline of the foil and all regions that are black (<5).
+    The Gaussian blurs of the image can be passed in with 'blurs' (see 
+    functions.regionBlurs) so the Mo and dirt passes over one image share them.
     """
     if poster.shape != ogimage.shape:
         raise Exception("The two arrays are not the same shape.")
         return
-    Image = ogimage.astype(np.uint8)
-    gPoster = poster.astype(np.uint8)
-    threshedImage = np.zeros((Image.shape),dtype=np.uint8)
-
-    # Create the images
-    blk = gPoster.copy()
-    pleat = gPoster.copy()
-    darkMo = gPoster.copy()
-    Mo = gPoster.copy()
-    highEx = gPoster.copy()
-    Pt = gPoster.copy()
-
-    # isolate various sections
-    blk[blk!=0]=255
-    pleat[pleat!=50]=0
-    darkMo[darkMo!=85]=0
-    Mo[Mo!=150]=0
-    highEx[highEx!=200]=0
-    Pt[Pt!=255]=0
-
-    # mask the original image
-    pleatMask = cv2.GaussianBlur(Image, (5,5), 0)
-    pleatMask = (pleat/50)*pleatMask
-    darkMoMask = cv2.GaussianBlur(Image, (5,5), 0)
-    darkMoMask = (darkMo/85)*darkMoMask
-    MoMask = cv2.GaussianBlur(Image, (gaussBlur,gaussBlur), 0)
-    MoMask = (Mo/150)*MoMask
-    highExMask = cv2.GaussianBlur(Image, (gaussBlur,gaussBlur), 0)
-    highExMask = (highEx/200)*highExMask
-    PtMask = cv2.GaussianBlur(Image, (gaussBlur,gaussBlur), 0)
-    PtMask = (Pt/255)*PtMask
-
-    # apply adjusted threshold
-    ret,pleatMask = cv2.threshold(pleatMask, p,255,threshType)
-    ret,darkMoMask = cv2.threshold(darkMoMask, d,255,threshType)
-    ret,MoMask = cv2.threshold(MoMask, m,255,threshType)
-    ret,highExMask = cv2.threshold(highExMask, hE,255,threshType)
-    ret,PtMask = cv2.threshold(PtMask, pt,255,threshType)
-
-    # put it all together
-    threshedImage = np.add(threshedImage, pleatMask)
-    threshedImage = np.add(threshedImage, darkMoMask)
-    threshedImage = np.add(threshedImage, MoMask)
-    threshedImage = np.add(threshedImage, highExMask)
-    threshedImage = np.add(threshedImage, PtMask)
+    # Threshold each region of the poster at its own level, on the blurred image
+    # (see GenSIP.regionthresh)
+    threshedImage = regionThreshold(ogimage, poster,
+                                    {50:(p,5),                # pleat
+                                     85:(d,5),                # darkMo
+                                     150:(m,gaussBlur),       # Mo
+                                     200:(hE,gaussBlur),      # highEx
+                                     255:(pt,gaussBlur)},     # Pt
+                                    threshType=threshType, blurs=blurs)
 
 
     # Apply Mask if provided
@@ -549,6 +605,7 @@ def bigAmountDirt(img):
     #inv = cv2.bitwise_not(img)
     inv=img.copy()
     #invDirt = cv2.bitwise_not(isoDirt(img,profile))
+    import mahotas as mh
     labeledFoil,numDirt = mh.label(inv)
     # Don't count the foil in numDirt:
     
@@ -6,10 +6,18 @@ as those used in analyzing the big foil scans.
 
 import numpy as np
 import os
+import shutil
+import struct
+import tempfile
 import GenSIP.functions as fun
+import GenSIP.mapwriter as mapwriter
 import cv2
 import GenSIP.kuwahara as K
-from scipy import misc
+from GenSIP.posterize import posterizeLUT
+from GenSIP.postercache import cachedPoster
+from GenSIP.bigscans.tilelabel import listTileGrid
+import GenSIP.bigscans.pyramid as pyramid
+from GenSIP.bigscans.tilesource import gridBounds
 
 ###################################################################################
 
@@ -19,7 +27,9 @@ def splitImage(image, numParts, path = "InputPicts/FoilScans/Q1",name=""):
     """
     Takes an image and divides it up into a number of sub-images specified by 
     numParts. writes the output to a folder in the path folder and names it 
-    "sub_imgs_"+name.
+    "sub_imgs_"+name. The sub-images cover every pixel of the image exactly 
+    once, so stitchImage gives back the whole image. To analyze a panorama
+    without writing the sub-images, see GenSIP.bigscans.tilesource.
         Inputs:
          - image - the image to be divided
          - numParts - the number of sub-Images to be produced. Must be a perfect
@@ -30,188 +40,192 @@ def splitImage(image, numParts, path = "InputPicts/FoilScans/Q1",name=""):
     """
     
     perSide = int(np.sqrt(numParts))
-    height = image.shape[0]
-    width = image.shape[1]
-    
-    h_unit = int(height/perSide)
-    w_unit = int(width/perSide)
-    h_rem = int(height%perSide)
-    w_rem = int(width%perSide)
-    start_col = 0
-    start_row = 0
     
     # Create output folder
     outPath = path+"/sub_imgs_"+name
     if not(os.path.exists(outPath)):
         os.makedirs(outPath)
     
-    
-    for r in range(perSide): # Column
-        #print "Starting Row " + str(r)
-        stop_row = h_unit + r*h_unit
-        
-        if r == perSide-1:
-            stop_row += h_rem - 1
-        
-        for c in range(perSide): # Row
-            #print "Row: " + str(r) +" Column: " + str(c)
-            stop_col = w_unit + c*w_unit
-            if c == 0:
-                start_col = 0
-            if c == perSide-1:
-                stop_col += w_rem - 1
+    # The same grid as the virtual sub-images of a TileSource
+    rowBounds = gridBounds(image.shape[0], perSide)
+    colBounds = gridBounds(image.shape[1], perSide)
+    for r, (start_row, stop_row) in enumerate(rowBounds):
+        for c, (start_col, stop_col) in enumerate(colBounds):
             subImage = image[start_row:stop_row,start_col:stop_col]
-            '''
-            print "Subimage Made. Writing Image..."
-            print "Start_row: " + str(start_row)
-            print "Stop_row: " + str(stop_row)
-            print "Start_col: " + str(start_col)
-            print "Stop_col: " + str(stop_col)
-            print "Image shape: " + str(subImage.shape)
-            '''
             cv2.imwrite(str(outPath+"/sub_"+str(r).zfill(3) +"_"+str(c).zfill(3)+".tif"),subImage)
-        
-            start_col = stop_col+1
-            
-        start_row = stop_row+1
 
 ###################################################################################
 
 ###################################################################################
 
-def stitchImage(folderpath, imgType = ".png", color=cv2.CV_LOAD_IMAGE_GRAYSCALE):
+def stitchImage(folderpath, imgType = ".png", color=cv2.CV_LOAD_IMAGE_GRAYSCALE, 
+                **kwargs):
     """
     This method takes a folder of sub-images and stitches them back together and
     writes the resulting image to a large montage image named "montage.png" in 
-    the given folder.
+    the given folder, and returns its path.
+    
+    The size of the montage comes from the headers of the sub-images (see 
+    tileLayout), and the sub-images are decoded one at a time into a uint8 
+    memory map of the montage, a temporary file in the folder. montage.png is
+    then encoded from the memory map a strip of rows at a time, so only about 
+    one sub-image is ever in memory, however big the panorama.
+    
+    The same strips also make the multi-resolution pyramid of the montage in 
+    the folder montage_pyramid (see GenSIP.bigscans.pyramid): the montage at 
+    1/2, 1/4, 1/8 ... of its size down to screenSize, as tiles that a viewer 
+    opens with pyramid.openPyramid at any zoom level without reading 
+    montage.png. For maps, the pixels of the smaller levels are the fractions
+    of their area covered by the map.
     
     Input Arguments:
         - folderpath - path to the folder containing the sub-images
     Key-Word Arguments:
         - imgType - type of image file contained in subfolder (i.e. .jpeg, .png,
-          .tif, etc.) it is important to include the '.' at the beginning. Default
-          set to ".png".
+          .tif, .npz etc.) it is important to include the '.' at the beginning. 
+          Default set to ".png".
         - color - specifies whether the images are to be loaded in color or 
           grayscale. 
+        - stripRows = 256 - number of rows of the montage encoded at a time
+        - pyramid = True - also write the pyramid of the montage
+        - tileSize = 512 - size of the tiles of the pyramid
+        - screenSize = 1024 - size of the smallest level of the pyramid
+        - verbose = False - prints the name of every sub-image as it is placed
 
     """
-
-    subImgs = os.listdir(folderpath)
-    subImgs.sort()
-    montageHeight = 0
-    montageWidth = 0
-    
-    # Make sure that the folder of sub-images only contains the sub images to be
-    # stitched together.
-    """
-    for img in subImgs:
-        if not(img.startswith("sub_")):
-            subImgs.remove(img)
-            print img
-        elif not(img.endswith(".png")):
-            subImgs.remove(img)
-    """
+    stripRows = kwargs.get('stripRows',256) # Rows of the montage encoded at a time
+    makePyramid = kwargs.get('pyramid',True) # Also write montage_pyramid
+    tileSize = kwargs.get('tileSize',512) # Tiles of the pyramid
+    screenSize = kwargs.get('screenSize',1024) # Smallest level of the pyramid
+    verbose = kwargs.get('verbose',False)
     
-    subImgs[:] = [img for img in subImgs if img.startswith("sub_")]
-    subImgs[:] = [img for img in subImgs if img.endswith(imgType)]
+    grid, rowHeights, colWidths = tileLayout(folderpath, imgType)
+    montageHeight = sum(rowHeights)
+    montageWidth = sum(colWidths)
     
-    if len(subImgs) == 0:
-        raise Exception("You may have specified the wrong image Type.")
-
-    def getIndex(name):
-        index = name.strip("sub_")
-        index = index.strip(imgType)
-        index = index.rsplit("_")
-        index = [int(index[0]),int(index[1])]
-        return index
-        
-    for img in subImgs:
-        index = getIndex(img)
-        sub = fun.loadImg(folderpath+"/"+img,0)
-        if index[1]==0:
-            montageHeight += sub.shape[0]
-        if index[0]==0:
-            montageWidth += sub.shape[1]
-        del(sub)
-    #return (montageHeight,montageWidth)
     # See if image is meant to be loaded in color or not. If so, make 
     # the montage a color image (a 3D array with the 3rd dimension as RGB)
-    if len(fun.loadImg(folderpath+"/"+subImgs[0],color).shape)==3:
-        is3D = True
-        montage = np.zeros((montageHeight,montageWidth,3))
+    is3D = len(fun.loadImg(os.path.join(folderpath,grid[0][0]),color).shape)==3
+    if is3D:
+        shape = (montageHeight,montageWidth,3)
     else:
-        is3D = False
-        montage = np.zeros((montageHeight,montageWidth))
-        
-    # Initialize iterating variables for the for loop:
-    lastindex = [0,0]
-    lastSubW = 0
-    lastSubH = 0
-    height = 0
-    width = 0
+        shape = (montageHeight,montageWidth)
     
-    for img in subImgs:
-        # index gives the tuple index of the sub-image in the montage matrix
-        index = getIndex(img)
-        
-        #list index gives the index of the sub-image in the list of subImgs
-        """
-        listIndex = subImgs.index(img)
-        
-        if listIndex<len(subImgs)-1:
-            nextIndex = getIndex(subImgs[listIndex+1])
-        else:
-            nextIndex = (0,0)
-        """
-        
-        # Load the sub image
-        sub = fun.loadImg(folderpath+"/"+img,color)
-        # Assign the height and width of the sub-image to subH and subW
-        # Check to see if the image is in color when loaded. If so, convert
-        # from BGR to RGB since Opencv by default loads the image as BGR.
-        if is3D:
-            subH,subW,rgb = sub.shape
-            sub=cv2.cvtColor(sub,cv2.COLOR_BGR2RGB)
-        else:
-            subH,subW = sub.shape
-        
-        # Set the variables for the indices in the montage over which the 
-        # sub-image will be inserted. These variables are set according to 
-        # the relationship between the current sub-image index and the last
-        # sub-image index, to see if the current sub-image starts a new row.
-        if index[0] == 0:
-        # if the sub-image is part of the first row
-            lastSubH = 0
-            height = subH
-        elif index[0] == lastindex[0]+1:
-        # if the sub-image is the start of a new row but is not
-        # in the first row. 
-            lastSubH = height
-            height += subH
-            
-        if index[1] == 0:
-        # if the sub-image is the start of a new row
-            lastSubW = 0
-            width = subW
+    outPath = os.path.join(folderpath,"montage.png")
+    fd, tmpPath = tempfile.mkstemp(suffix='.montage', dir=folderpath)
+    os.close(fd)
+    try:
+        montage = np.memmap(tmpPath, dtype=np.uint8, mode='w+', shape=shape)
+        # True while every sub-image is a binary map
+        binary = True
+        top = 0
+        for r, row in enumerate(grid):
+            left = 0
+            for c, img in enumerate(row):
+                # Load the sub image. Check to see if the image is in color when 
+                # loaded. If so, convert from BGR to RGB since Opencv by default
+                # loads the image as BGR.
+                sub = fun.loadImg(os.path.join(folderpath,img),color)
+                if is3D:
+                    sub = cv2.cvtColor(sub,cv2.COLOR_BGR2RGB)
+                if sub.shape[:2] != (rowHeights[r],colWidths[c]):
+                    raise Exception("The sub-image "+img+" does not fit the grid "
+                                    "of the other sub-images.")
+                if sub.dtype != np.uint8:
+                    # Saturate, like cv2.imwrite did with the old float montage
+                    sub = np.clip(sub,0,255).astype(np.uint8)
+                if binary:
+                    binary = not np.any((sub!=0)&(sub!=255))
+                # Insert the sub-image into the montage:
+                montage[top:top+rowHeights[r],left:left+colWidths[c]] = sub
+                left += colWidths[c]
+                if verbose: print img
+                del sub
+            top += rowHeights[r]
             
-        elif index[1] == lastindex[1]+1:
-        # if the sub-image continues a row
-            lastSubW = width
-            width += subW
-        print img
-        
-        # Insert the sub-image into the montage:
-        montage[lastSubH:height,lastSubW:width]=sub[:,:]
-        # Iterate the variable lastindex:
-        lastindex = index
-        
-    # Write the montage image to the folder containing
-    cv2.imwrite(folderpath+"/montage.png",montage,[cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+        # Write the montage image (and its pyramid) to the folder containing 
+        # the sub-images
+        writers = [mapwriter.PngStripWriter(outPath, shape)]
+        if makePyramid:
+            pyramidFolder = os.path.join(folderpath,"montage_pyramid")
+            if os.path.exists(pyramidFolder):
+                # The levels of an earlier montage may not all be written again
+                shutil.rmtree(pyramidFolder)
+            source = {'folder':'..', 'imgType':imgType, 'grid':grid,
+                      'rowHeights':rowHeights, 'colWidths':colWidths}
+            writers.append(pyramid.PyramidWriter(pyramidFolder, shape, 
+                                                 tileSize=tileSize, 
+                                                 screenSize=screenSize,
+                                                 coverage=binary, source=source))
+        for top in range(0,montageHeight,stripRows):
+            for writer in writers:
+                writer.write(montage[top:top+stripRows])
+        for writer in writers:
+            writer.close()
+        del montage
+    finally:
+        os.remove(tmpPath)
+    return outPath
     
 ###################################################################################
 
 ###################################################################################
 
+def tileLayout(folderpath, imgType=".png"):
+    """
+    Returns the layout of a folder of sub-images (sub_RRR_CCC tiles) without 
+    decoding them: the names of the sub-images as a list of rows of the grid, 
+    and the heights of the rows and the widths of the columns in pixels, read 
+    from the image headers (see imageShape).
+    """
+    names, nRows, nCols = listTileGrid(folderpath, imgType)
+    grid = [names[r*nCols:(r+1)*nCols] for r in range(nRows)]
+    rowHeights = [imageShape(os.path.join(folderpath,row[0]))[0] for row in grid]
+    colWidths = [imageShape(os.path.join(folderpath,name))[1] for name in grid[0]]
+    return grid, rowHeights, colWidths
+
+def imageShape(path):
+    """
+    Returns the (rows, columns) of an image file. PNG and TIFF files and the 
+    packed maps of GenSIP.mapwriter (.npz) are read from their headers; other 
+    files are decoded.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npz':
+        return mapwriter.packedMap(path)[1]
+    with open(path,'rb') as f:
+        header = f.read(32)
+        if header.startswith('\x89PNG\r\n\x1a\n'):
+            # IHDR is always the first chunk: width and height come first
+            width, height = struct.unpack('>II', header[16:24])
+            return int(height), int(width)
+        if header[:4] in ('II*\x00','MM\x00*'):
+            shape = _tiffShape(f, '<' if header[:2]=='II' else '>')
+            if shape is not None:
+                return shape
+    return fun.loadImg(path,0).shape[:2]
+
+def _tiffShape(f, order):
+    # ImageLength and ImageWidth of the first IFD of a TIFF file
+    f.seek(4)
+    f.seek(struct.unpack(order+'I', f.read(4))[0])
+    numEntries = struct.unpack(order+'H', f.read(2))[0]
+    tags = {}
+    for i in range(numEntries):
+        tag, fieldType, count, value = struct.unpack(order+'HHI4s', f.read(12))
+        if tag in (256,257):
+            if fieldType == 3: # SHORT
+                tags[tag] = struct.unpack(order+'H', value[:2])[0]
+            elif fieldType == 4: # LONG
+                tags[tag] = struct.unpack(order+'I', value)[0]
+    if 256 in tags and 257 in tags:
+        return tags[257], tags[256]
+    return None
+
+###################################################################################
+
+###################################################################################
+
 def makeManyPosters(foldername,foilname="40360_2", Quarter="Q1",Mask=0, kern=6,\
 KuSize=9,Gaus1=3,Gaus2=11,rsize=.1,Kuw_only=False, ExcludeDirt=True):
     """
@@ -258,6 +272,12 @@ def bigPostPreProc(image,**kwargs):
              - rsize = .1 - Resize value
              - Kuw_only = False - Option to only return the Kuwahara filtered image
              - ExcludeDirt = True - Option to Exclude dirt 
+             - KuMaxMem = 256 - Scratch memory limit of the tiled Kuwahara 
+                filter, in megabytes
+             - KuWorkers = None - Number of threads for the tiled Kuwahara 
+                filter. None uses one per CPU.
+             - useCache = True - Option to look the image up in the poster 
+                cache (GenSIP.postercache) before filtering it
 
     """
     # The keyword 
@@ -268,7 +288,35 @@ def bigPostPreProc(image,**kwargs):
     rsize = kwargs.get("rsize",.1) # Resize value
     Kuw_only = kwargs.get("Kuw_only",False) # Option to only return the Kuwahara filtered image
     ExcludeDirt = kwargs.get("ExcludeDirt",True) # Option to Exclude dirt 
+    KuMaxMem = kwargs.get("KuMaxMem",256) # Memory limit of the Kuwahara filter in MB
+    KuWorkers = kwargs.get("KuWorkers",None) # Threads for the Kuwahara filter
+    useCache = kwargs.get("useCache",True) # Option to use the poster cache
 
+    if Kuw_only:
+        # Only the resized image is wanted, which is cheap to make
+        return _bigPostPreProc(image,Mask,KuSize,Gaus1,Gaus2,rsize,Kuw_only,
+                               ExcludeDirt,KuMaxMem,KuWorkers)
+    compute = lambda: _bigPostPreProc(image,Mask,KuSize,Gaus1,Gaus2,rsize,Kuw_only,
+                                      ExcludeDirt,KuMaxMem,KuWorkers)
+    if not useCache:
+        return compute()
+    # KuMaxMem and KuWorkers do not change the output, so they are not in the key
+    params = {'KuSize':KuSize,'Gaus1':Gaus1,'Gaus2':Gaus2,'rsize':rsize,
+              'ExcludeDirt':ExcludeDirt}
+    if type(Mask)==np.ndarray and Mask.shape==image.shape:
+        return cachedPoster('bigPostPreProc', image, params, compute, mask=Mask)
+    else:
+        return cachedPoster('bigPostPreProc', image, params, compute)
+
+###################################################################################
+
+###################################################################################
+
+def _bigPostPreProc(image,Mask,KuSize,Gaus1,Gaus2,rsize,Kuw_only,ExcludeDirt,
+                    KuMaxMem,KuWorkers):
+    """
+    Does the work of bigPostPreProc, without the poster cache.
+    """
     img = np.copy(image)
     averageColor = int(np.average(img))
     if ExcludeDirt:
@@ -279,11 +327,12 @@ def bigPostPreProc(image,**kwargs):
         img = cv2.add(image,invMsk)
         img[img>np.max(image)] = int(np.average(image))
         
+    from scipy import misc
     rsz = misc.imresize(img,rsize,interp='bicubic')
     if Kuw_only:
         return rsz
     gr = cv2.GaussianBlur(rsz, (Gaus1,Gaus1),0)
-    kgr = K.Kuwahara(gr,KuSize)
+    kgr = K.Kuwahara(gr,KuSize,tiled=True,maxMemory=KuMaxMem,workers=KuWorkers)
     kgr = kgr.astype(np.uint8) # Make sure the Kuwahara image is uint8 so it doesn't scale
     rkgr = misc.imresize(kgr,(image.shape),interp='bicubic')
     grkgr = cv2.GaussianBlur(rkgr, (Gaus2,Gaus2),0)
@@ -296,38 +345,25 @@ def bigPostPreProc(image,**kwargs):
 
 ###################################################################################
        
-def bigPosterfy(image,k_size=6):
+def bigPosterfy(image,k_size=6,returnLabels=False):
     """
     Takes a gray image and sets all values within a given range to a single value
     this way we can divide up regions into high Exposure areas, primarily Pt, 
     primarily Mo, dirt, or black. The only difference between bigPosterfy and 
     posterfy found in GenSIP.functions is the additional 'highEx' region. This
     is added because the large foils have more fluctuation in topography, and 
-    hence various levels of contrast and exposure. 
+    hence various levels of contrast and exposure. The bands are the 'bigfoils'
+    preset of GenSIP.posterize, applied with a single lookup table.
     
     Kwargs:
         - k_size - size of the kernal used in the final morphological opening
-            step. 
+            step. (The opening step is currently turned off.)
+        - returnLabels - also return the region label image (see 
+            posterize.REGION_NAMES) along with the poster.
     """
-    image_copy=image.copy()
-    image_copy=image_copy.astype(np.uint8)
-    blk=(image_copy<=4)
-    pleat=(5<=image_copy)&(image_copy<=40)
-    darkMo=(41<=image_copy)&(image_copy<=139)
-    Mo=(140<=image_copy)&(image_copy<=195)
-    highEx=(196<=image_copy)&(image_copy<=215)
-    Plat=(216<=image_copy)
-    image_copy[blk]=0
-    image_copy[pleat]=50
-    image_copy[darkMo]=85
-    image_copy[Mo]=150
-    image_copy[highEx]=200
-    image_copy[Plat]=255
-    #image_copy = maskEdge(image_copy,thickness=60)
     #Do a morphological opening step to eliminate the rough edges
     # I prefer opening over closing because it is more important to catch
     # all of the dark areas, as the Pt areas will have pretty sraightforward
     # threshold results
-    kernel = np.ones((k_size,k_size))
-    #image_copy = cv2.morphologyEx(image_copy, cv2.MORPH_OPEN, kernel)
-    return image_copy
\ No newline at end of file
+    #return posterizeLUT(image, 'bigfoils', k_size=k_size, returnLabels=returnLabels)
+    return posterizeLUT(image, 'bigfoils', k_size=0, returnLabels=returnLabels)
@@ -0,0 +1,295 @@
+"""
+Contains the multi-resolution pyramid of a montage (see images.stitchImage).
+
+The montages of a whole foil are hundreds of megapixels, which is slow or
+impossible to open only to look at where the platinum or the dirt is. While
+stitchImage encodes montage.png, a PyramidWriter gets the same strips of rows
+and writes the montage at 1/2, 1/4, 1/8 ... of its size, down to the first level
+that fits in screenSize pixels, as a folder of PNG tiles:
+    montage_pyramid/index.json     - the index of the pyramid (see below)
+    montage_pyramid/<k>/<r>_<c>.png - tile (r, c) of level k, scale 1/2**k
+Every pixel of level k is the mean of the 2**k by 2**k block of the montage it
+covers (area averaging, rounded to uint8). For a binary map (0 and 255 only) the
+index sets 'coverage' to True: a pixel of value v is then a block of which
+v/255 is covered by the map.
+
+Level 0, full resolution, is not copied: the index points back at the
+sub-images the montage was stitched from, so openPyramid(folder).read(0, ...)
+only decodes the sub-images that the requested region touches.
+"""
+import cv2
+import json
+import numpy as np
+import os
+import GenSIP.functions as fun
+
+# Bump this whenever the layout of the pyramid folder changes
+PYRAMID_VERSION = 1
+
+###################################################################################
+
+###################################################################################
+
+def pyramidLevels(shape, screenSize=1024):
+    """
+    Returns the number of levels below full resolution of the pyramid of an
+    image of the given shape: the first level k that is at most screenSize
+    pixels on its long side (0 if the image already is).
+    """
+    levels = 0
+    size = max(shape[:2])
+    while size > screenSize:
+        size = (size+1)//2
+        levels += 1
+    return levels
+
+def _pairSum(a):
+    # Sums of the 2x2 blocks of a (rows and columns of the last, partial block
+    # count as zero)
+    if a.shape[0] % 2:
+        a = np.concatenate([a, np.zeros((1,)+a.shape[1:], a.dtype)], axis=0)
+    a = a[0::2] + a[1::2]
+    if a.shape[1] % 2:
+        a = np.concatenate([a, np.zeros((a.shape[0],1)+a.shape[2:], a.dtype)], axis=1)
+    return a[:,0::2] + a[:,1::2]
+
+###################################################################################
+
+###################################################################################
+
+class PyramidWriter(object):
+    """
+    Builds the pyramid of an image that is given a strip of rows at a time, from
+    the top (the strips do not need to line up with anything). Only a few strips
+    of every level are in memory at once.
+        > writer = PyramidWriter(folder, shape, coverage=True)
+        > for y in range(0, rows, 256): writer.write(montage[y:y+256])
+        > index = writer.close()
+        Key-word Arguments:
+            tileSize = 512
+                - Rows and columns of the tiles of every level
+            screenSize = 1024
+                - The last level is the first one this small (see pyramidLevels)
+            coverage = False
+                - True if the image is a binary map (see the module docstring)
+            source = None
+                - Dictionary of the sub-images of level 0: 'folder' (relative to
+                the pyramid folder), 'imgType', 'grid', 'rowHeights', 'colWidths'
+                (see images.tileLayout)
+    """
+    def __init__(self, folder, shape, **kwargs):
+        self.tileSize = kwargs.get('tileSize',512) # Size of the tiles
+        screenSize = kwargs.get('screenSize',1024) # Size of the last level
+        self.coverage = kwargs.get('coverage',False) # Binary map
+        self.source = kwargs.get('source',None) # Sub-images of level 0
+
+        self.folder = folder
+        self.shape = tuple(shape)
+        self.numLevels = pyramidLevels(shape, screenSize)
+        # Rows of the image that make a whole number of rows in every level
+        self.chunk = 2**self.numLevels
+        self.waiting = [] # Strips of the image not processed yet
+        self.waitingRows = 0
+        self.rowsSeen = 0
+        # Per level: the rows not cut into tiles yet, and the tile rows written
+        self.pending = [[] for k in range(self.numLevels+1)]
+        self.tileRows = [0]*(self.numLevels+1)
+        self.levelShapes = [self.shape[:2]]
+        for k in range(self.numLevels):
+            h, w = self.levelShapes[-1]
+            self.levelShapes.append(((h+1)//2, (w+1)//2))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for k in range(1, self.numLevels+1):
+            levelFolder = os.path.join(folder, str(k))
+            if not os.path.exists(levelFolder):
+                os.makedirs(levelFolder)
+
+    def write(self, strip):
+        """Adds the next rows of the image"""
+        self.rowsSeen += len(strip)
+        if self.rowsSeen > self.shape[0]:
+            raise Exception("More rows than the pyramid was made for")
+        if self.numLevels == 0:
+            return
+        self.waiting.append(np.asarray(strip))
+        self.waitingRows += len(strip)
+        if self.waitingRows >= self.chunk:
+            rows = np.concatenate(self.waiting, axis=0)
+            usable = (len(rows)//self.chunk)*self.chunk
+            self._reduce(rows[:usable])
+            self.waiting = [rows[usable:]]
+            self.waitingRows = len(rows)-usable
+
+    def close(self):
+        """
+        Writes the last tiles and index.json, and returns the index. Raises an
+        Exception if rows of the image are missing.
+        """
+        if self.rowsSeen != self.shape[0]:
+            raise Exception("%d rows of the image were not given to the pyramid"
+                            % (self.shape[0]-self.rowsSeen))
+        if self.waitingRows:
+            self._reduce(np.concatenate(self.waiting, axis=0))
+        self.waiting = []
+        for k in range(1, self.numLevels+1):
+            self._cutTiles(k, final=True)
+        index = {'version':PYRAMID_VERSION,
+                 'shape':list(self.shape[:2]),
+                 'channels':1 if len(self.shape)==2 else self.shape[2],
+                 'coverage':self.coverage,
+                 'tileSize':self.tileSize,
+                 'levels':[{'level':k, 'scale':1./2**k, 'shape':list(self.levelShapes[k]),
+                            'tileRows':-(-self.levelShapes[k][0]//self.tileSize),
+                            'tileCols':-(-self.levelShapes[k][1]//self.tileSize)}
+                           for k in range(1, self.numLevels+1)],
+                 'source':self.source}
+        with open(os.path.join(self.folder,'index.json'),'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        return index
+
+    def _reduce(self, rows):
+        # Area averages of the rows at every level. The sums are kept exact, so
+        # every level is the mean of the full resolution pixels it covers.
+        sums = rows.astype(np.uint16)
+        rowCounts = [1]*len(rows)
+        colCounts = [1]*self.shape[1]
+        for k in range(1, self.numLevels+1):
+            sums = _pairSum(sums)
+            if k == 1:
+                sums = sums.astype(np.uint32)
+            rowCounts = np.add.reduceat(rowCounts, range(0,len(rowCounts),2))
+            colCounts = np.add.reduceat(colCounts, range(0,len(colCounts),2))
+            counts = np.outer(rowCounts, colCounts)
+            if sums.ndim == 3:
+                counts = counts[:,:,None]
+            # Rounded to the nearest integer
+            means = ((2*sums+counts)//(2*counts)).astype(np.uint8)
+            self.pending[k].append(means)
+            self._cutTiles(k)
+
+    def _cutTiles(self, k, final=False):
+        # Writes every full row of tiles of level k (and the last, partial one)
+        if not self.pending[k]:
+            return
+        rows = np.concatenate(self.pending[k], axis=0)
+        T = self.tileSize
+        start = 0
+        while len(rows)-start >= T or (final and len(rows)-start > 0):
+            band = rows[start:start+T]
+            for c in range(0, band.shape[1], T):
+                tile = band[:,c:c+T]
+                if tile.ndim == 3:
+                    # The montage is RGB, and cv2.imwrite wants BGR
+                    tile = tile[:,:,::-1]
+                cv2.imwrite(os.path.join(self.folder, str(k),
+                                         '%d_%d.png' % (self.tileRows[k], c//T)),
+                            tile, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+            self.tileRows[k] += 1
+            start += len(band)
+        self.pending[k] = [rows[start:]] if start < len(rows) else []
+
+###################################################################################
+
+###################################################################################
+
+class Pyramid(object):
+    """
+    Read access to a pyramid folder written by PyramidWriter. Use openPyramid to
+    get one.
+        Attributes:
+         - folder - the pyramid folder
+         - index - the contents of index.json
+         - shape - (rows, columns) of the full resolution image
+         - coverage - True if the pixels are coverage fractions of a binary map
+    """
+    def __init__(self, folder, index):
+        self.folder = folder
+        self.index = index
+        self.shape = tuple(index['shape'])
+        self.coverage = index['coverage']
+
+    def numLevels(self):
+        """Number of levels, counting level 0 (full resolution)"""
+        return len(self.index['levels'])+1
+
+    def levelShape(self, level):
+        """(rows, columns) of a level"""
+        if level == 0:
+            return self.shape
+        return tuple(self.index['levels'][level-1]['shape'])
+
+    def levelFor(self, maxSize):
+        """
+        Returns the most detailed level that is at most maxSize pixels on its
+        long side (the last level if none of them is).
+        """
+        for level in range(self.numLevels()):
+            if max(self.levelShape(level)) <= maxSize:
+                return level
+        return self.numLevels()-1
+
+    def read(self, level, top=0, left=0, rows=None, cols=None):
+        """
+        Returns the region of a level that starts at (top, left) and is rows by
+        cols pixels (to the end of the level by default), in the coordinates of
+        that level. Only the tiles the region touches are read. Color pyramids
+        are returned as BGR, like fun.loadImg.
+        """
+        shape = self.levelShape(level)
+        if rows is None: rows = shape[0]-top
+        if cols is None: cols = shape[1]-left
+        bottom = min(top+rows, shape[0])
+        right = min(left+cols, shape[1])
+        if level == 0:
+            return self._readSource(top, left, bottom, right)
+        T = self.index['tileSize']
+        channels = self.index['channels']
+        flag = 0 if channels == 1 else 1
+        out = np.zeros((bottom-top, right-left) + ((channels,) if channels > 1 else ()),
+                       np.uint8)
+        for r in range(top//T, (bottom-1)//T+1):
+            for c in range(left//T, (right-1)//T+1):
+                tile = fun.loadImg(os.path.join(self.folder, str(level),
+                                                '%d_%d.png' % (r, c)), flag)
+                y0, x0 = max(top, r*T), max(left, c*T)
+                y1, x1 = min(bottom, r*T+tile.shape[0]), min(right, c*T+tile.shape[1])
+                out[y0-top:y1-top, x0-left:x1-left] = tile[y0-r*T:y1-r*T, x0-c*T:x1-c*T]
+        return out
+
+    def _readSource(self, top, left, bottom, right):
+        # Level 0 from the sub-images the montage was stitched from
+        source = self.index['source']
+        if source is None:
+            raise Exception("The pyramid in "+self.folder+" has no level 0")
+        folder = os.path.join(self.folder, source['folder'])
+        channels = self.index['channels']
+        flag = 0 if channels == 1 else 1
+        out = np.zeros((bottom-top, right-left) + ((channels,) if channels > 1 else ()),
+                       np.uint8)
+        y = 0
+        for r, row in enumerate(source['grid']):
+            h = source['rowHeights'][r]
+            x = 0
+            for c, name in enumerate(row):
+                w = source['colWidths'][c]
+                y0, x0 = max(top, y), max(left, x)
+                y1, x1 = min(bottom, y+h), min(right, x+w)
+                if y0 < y1 and x0 < x1:
+                    sub = fun.loadImg(os.path.join(folder, name), flag)
+                    out[y0-top:y1-top, x0-left:x1-left] = sub[y0-y:y1-y, x0-x:x1-x]
+                x += w
+            y += h
+        return out
+
+def openPyramid(folder):
+    """
+    Opens the pyramid in folder (the montage_pyramid folder next to a
+    montage.png, see images.stitchImage).
+    """
+    with open(os.path.join(folder,'index.json')) as f:
+        index = json.load(f)
+    if index.get('version') != PYRAMID_VERSION:
+        raise Exception("The pyramid in "+folder+" was written by another version"
+                        " of GenSIP. Run stitchImage again.")
+    return Pyramid(folder, index)
@@ -0,0 +1,237 @@
+"""
+Contains the seam-aware particle labelling of a panorama that is stored as a
+folder of sub-images (sub_RRR_CCC tiles, as written by images.splitImage or by
+the map output of bigfoils.analyzeSubImages).
+
+A panorama does not fit in memory, so the dirt used to be counted on each tile
+by itself. A particle that crosses a tile boundary was then counted once per
+tile it touches (up to four times) and its area was split between the tiles.
+tiledParticleStats labels one tile at a time with measure.particleStats, keeps
+only the labels of the bottom row and the right column of the tiles it has
+seen, and joins the particles that touch across each seam with a union-find
+pass. The result is the particle array (measure.PARTICLE_DTYPE) of the whole
+panorama, exactly as particleStats would give it for the stitched image, with
+one tile in memory at a time.
+"""
+import numpy as np
+import os
+import cv2
+import GenSIP.functions as fun
+import GenSIP.measure as meas
+
+###################################################################################
+
+###################################################################################
+
+def tileIndex(name):
+    """
+    Returns the (row, column) index of a tile from its name, i.e.
+    "sub_004_012.png" -> (4,12).
+    """
+    root = os.path.splitext(os.path.basename(name))[0]
+    parts = root.split("_")
+    return int(parts[-2]), int(parts[-1])
+
+###################################################################################
+
+###################################################################################
+
+def listTileGrid(folderpath, imgType=".png"):
+    """
+    Returns the tile names of a folder of sub-images in row-major order, and the
+    number of rows and columns of the grid. Raises an exception if a tile of the
+    grid is missing.
+    """
+    names = [f for f in os.listdir(folderpath)
+             if f.startswith("sub_") and f.endswith(imgType)]
+    if len(names) == 0:
+        raise Exception("No sub-images of type "+imgType+" in "+folderpath)
+    grid = dict([(tileIndex(f), f) for f in names])
+    nRows = max([r for r,c in grid]) + 1
+    nCols = max([c for r,c in grid]) + 1
+    if len(grid) != nRows*nCols:
+        raise Exception("The sub-images in "+folderpath+" are not a full "+
+                        str(nRows)+"x"+str(nCols)+" grid.")
+    return [grid[(r,c)] for r in range(nRows) for c in range(nCols)], nRows, nCols
+
+###################################################################################
+
+###################################################################################
+
+def _find(parent, i):
+    # Union-find root, with path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+###################################################################################
+
+###################################################################################
+
+def _seamPairs(a, b, shifts):
+    """
+    Returns the pairs of particle ids (both >= 0) of the pixels of line a and the
+    pixels of line b that are 'shifts' pixels along the seam from them.
+    """
+    pairs = []
+    n = b.size
+    for d in shifts:
+        lo, hi = max(0,-d), min(a.size, n-d)
+        if hi <= lo:
+            continue
+        A = a[lo:hi]
+        B = b[lo+d:hi+d]
+        both = (A>=0)&(B>=0)
+        pairs.extend(zip(A[both].tolist(), B[both].tolist()))
+    return set(pairs)
+
+###################################################################################
+
+###################################################################################
+
+def tiledParticleStats(folderpath, res=1, **kwargs):
+    """
+    Labels the particles of the binary panorama stored as sub-images in
+    folderpath, merging the particles that cross the seams between the tiles.
+    Returns the particle array of the panorama (see measure.particleStats), in
+    panorama coordinates. The labels number the particles in the order of their
+    first tile (row-major) and do not refer to a labelled image.
+
+        Key-word Arguments:
+            imgType = ".png"
+                - File type of the sub-images
+            BoundConds = np.ones((3,3))
+                - Structuring element of the neighbors that belong to the same
+                particle. The 4 and 8 neighbor elements are supported.
+            minPartArea = 0
+                - Minimum particle area in square microns. Applied after the
+                particles are merged across the seams.
+            backend = None
+                - Labelling backend of measure.particleStats
+    """
+    imgType = kwargs.get('imgType',".png") # File type of the sub-images
+    BoundConds = np.asarray(kwargs.get('BoundConds',np.ones((3,3)))) # Neighbors
+    minPartArea = kwargs.get('minPartArea',0) # In square microns
+    backend = kwargs.get('backend',None) # Backend of particleStats
+
+    cross = np.array([[0,1,0],[1,1,1],[0,1,0]],dtype=np.uint8)
+    if BoundConds.shape==(3,3) and np.all(BoundConds!=0):
+        shifts = (-1,0,1)
+    elif BoundConds.shape==(3,3) and np.array_equal(BoundConds!=0, cross!=0):
+        shifts = (0,)
+    else:
+        raise Exception("Only the 4 and 8 neighbor BoundConds are supported for tiles.")
+
+    names, nRows, nCols = listTileGrid(folderpath, imgType)
+
+    parent = []         # union-find parents of the particle ids
+    stats = []          # per tile particle arrays, in panorama coordinates
+    extraPerim = []     # ids of seam pixels found to be particle edges later on
+    above = aboveDone = None
+    y0 = 0
+    for r in range(nRows):
+        x0 = 0
+        below = []
+        belowDone = []
+        left = leftDone = None
+        for c in range(nCols):
+            img = fun.loadImg(os.path.join(folderpath, names[r*nCols+c]), 0)
+            parts, lab = meas.particleStats(img, BoundConds=BoundConds, backend=backend,
+                                            returnLabelled=True)
+            binary = (img!=0).astype(np.uint8)
+            h, w = binary.shape
+            offset = len(parent)
+            parent.extend(range(offset, offset+parts.size))
+            # Particle id of every pixel, -1 for the background
+            gid = lab.astype(np.int64) + (offset-1)
+            gid[lab==0] = -1
+
+            # Edge pixels inside of the tile. The panorama border counts as
+            # outside, the seams as inside until the neighbor tile is known.
+            pad = cv2.copyMakeBorder(binary,1,1,1,1,cv2.BORDER_CONSTANT,value=0)
+            pad[0,:] = r>0
+            pad[-1,:] = r<nRows-1
+            pad[:,0] = c>0
+            pad[:,-1] = c<nCols-1
+            inner = cv2.erode(pad, cross, borderType=cv2.BORDER_CONSTANT,
+                              borderValue=0)[1:-1,1:-1]
+            done = (binary!=0)&(inner==0)
+
+            if r > 0:
+                # Seam with the tiles above
+                if above.size < x0+w:
+                    raise Exception("The sub-image columns do not line up.")
+                top = gid[0,:]
+                line = above[x0:x0+w]
+                done[0,:] |= (top>=0)&(line<0)
+                newEdge = (line>=0)&(~aboveDone[x0:x0+w])&(top<0)
+                extraPerim.extend(line[newEdge].tolist())
+                lo = max(x0-1,0)
+                pairs = _seamPairs(top, above[lo:x0+w+1], [d+x0-lo for d in shifts])
+                for a,b in pairs:
+                    ra, rb = _find(parent,a), _find(parent,b)
+                    if ra != rb:
+                        parent[max(ra,rb)] = min(ra,rb)
+            if c > 0:
+                # Seam with the tile to the left
+                if left.size != h:
+                    raise Exception("The sub-image rows do not line up.")
+                first = gid[:,0]
+                done[:,0] |= (first>=0)&(left<0)
+                newEdge = (left>=0)&(~leftDone)&(first<0)
+                extraPerim.extend(left[newEdge].tolist())
+                if newEdge[-1]:
+                    # Bottom right corner of the left tile
+                    belowDone[-1][-1] = True
+                for a,b in _seamPairs(first, left, shifts):
+                    ra, rb = _find(parent,a), _find(parent,b)
+                    if ra != rb:
+                        parent[max(ra,rb)] = min(ra,rb)
+
+            tileStats = parts.copy()
+            tileStats['top'] += y0
+            tileStats['bottom'] += y0
+            tileStats['left'] += x0
+            tileStats['right'] += x0
+            tileStats['cy'] = (parts['cy']+y0)*parts['area']
+            tileStats['cx'] = (parts['cx']+x0)*parts['area']
+            tileStats['perimeter'] = np.bincount(lab[done], minlength=parts.size+1)[1:]
+            stats.append(tileStats)
+
+            below.append(gid[-1,:])
+            belowDone.append(done[-1,:].copy())
+            left = gid[:,-1]
+            leftDone = done[:,-1].copy()
+            x0 += w
+            del img, lab, gid, binary
+        above = np.concatenate(below)
+        aboveDone = np.concatenate(belowDone)
+        y0 += h
+
+    # Join the particles of every union-find tree
+    N = len(parent)
+    if N == 0:
+        return np.zeros((0,), dtype=meas.PARTICLE_DTYPE)
+    roots = np.array([_find(parent,i) for i in range(N)], dtype=np.int64)
+    allStats = np.concatenate(stats)
+    allStats['perimeter'] += np.bincount(np.array(extraPerim,dtype=np.int64), minlength=N)
+    # Roots are the smallest id of their tree, so sorting them keeps the order
+    # of the first tile of each particle
+    uroots, inverse = np.unique(roots, return_inverse=True)
+    M = uroots.size
+    merged = np.zeros((M,), dtype=meas.PARTICLE_DTYPE)
+    merged['label'] = np.arange(1,M+1)
+    merged['area'] = np.bincount(inverse, weights=allStats['area'], minlength=M)
+    merged['perimeter'] = np.bincount(inverse, weights=allStats['perimeter'], minlength=M)
+    merged['cy'] = np.bincount(inverse, weights=allStats['cy'], minlength=M)/merged['area']
+    merged['cx'] = np.bincount(inverse, weights=allStats['cx'], minlength=M)/merged['area']
+    order = np.argsort(inverse, kind='mergesort')
+    starts = np.searchsorted(inverse[order], np.arange(M))
+    merged['top'] = np.minimum.reduceat(allStats['top'][order], starts)
+    merged['left'] = np.minimum.reduceat(allStats['left'][order], starts)
+    merged['bottom'] = np.maximum.reduceat(allStats['bottom'][order], starts)
+    merged['right'] = np.maximum.reduceat(allStats['right'][order], starts)
+    if minPartArea > 0:
+        merged = merged[merged['area'] >= minPartArea/float(res)]
+    return merged
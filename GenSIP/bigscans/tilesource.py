@@ -0,0 +1,247 @@
+"""
+Contains the tile source of a panorama: the grid of sub-images that
+images.splitImage writes to sub_RRR_CCC.tif files, served as windows of the
+panorama instead.
+
+analyzePano used to decode the whole panorama and its mask, write every
+sub-image of both to disk with splitImage, and have analyzeSubImages decode them
+all again. A TileSource opens the panorama and the mask as memory maps where the
+file allows it (see openPanorama), so a sub-image is only read from the
+panorama when it is analyzed, and nothing is written:
+    > tiles = TileSource(panPath, maskPath, numParts=256)
+    > bigfoils.analyzeSubImages(tiles, None, res, foilname, Quarter)
+The grid is the one of splitImage (see gridBounds), and the sub-images have the
+same names, so the maps, the CSV rows and the montages are the same either way.
+
+A halo of extra pixels around every sub-image can be asked for: tile() then
+returns the larger window, and core() the part of it that is the sub-image. The
+filters of the analysis see the pixels across the seams, and the results are
+cropped back to the sub-image.
+"""
+import numpy as np
+import os
+import struct
+import GenSIP.functions as fun
+
+###################################################################################
+
+###################################################################################
+
+def gridBounds(length, perSide):
+    """
+    Returns the (start, stop) of the perSide parts that a side of length pixels
+    is split into: equal parts, with the remainder in the last one. The parts
+    cover every pixel exactly once.
+    """
+    unit = int(length/perSide)
+    bounds = [(i*unit, (i+1)*unit) for i in range(perSide)]
+    bounds[-1] = (bounds[-1][0], length)
+    return bounds
+
+###################################################################################
+
+###################################################################################
+
+def openPanorama(path, shape=None, dtype=np.uint8):
+    """
+    Opens a grayscale panorama without reading it, where the file allows it:
+        .npy  - a read-only memory map (np.load with mmap_mode='r')
+        .raw  - a read-only memory map of the bare pixels, row by row. shape
+                (rows, columns) and dtype have to be given.
+        .tif  - uncompressed 8 bit grayscale TIFF files are read a strip at a
+                time (see TiffStrips).
+    Anything else, like a compressed TIFF, is decoded into memory with
+    fun.loadImg. Returns an array, or an object that is sliced like one.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        pan = np.load(path, mmap_mode='r')
+        if pan.ndim != 2:
+            raise Exception("The panorama "+path+" is not a grayscale image")
+        return pan
+    if ext == '.raw':
+        if shape is None:
+            raise Exception("The shape of the raw panorama "+path+" is needed")
+        return np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape))
+    if ext in ('.tif','.tiff'):
+        strips = TiffStrips.open(path)
+        if strips is not None:
+            return strips.asArray()
+    return fun.loadImg(path, 0)
+
+class TiffStrips(object):
+    """
+    Reads the rows of an uncompressed 8 bit grayscale TIFF file from its strips,
+    only the strips that the rows are in. Sliced like an array:
+    strips[r0:r1, c0:c1]. Use TiffStrips.open to get one.
+    """
+    def __init__(self, path, shape, offsets, counts, rowsPerStrip):
+        self.path = path
+        self.shape = shape
+        self.offsets = offsets
+        self.counts = counts
+        self.rowsPerStrip = rowsPerStrip
+        self.ndim = 2
+        self.dtype = np.dtype(np.uint8)
+
+    @staticmethod
+    def open(path):
+        """
+        Returns a TiffStrips of the TIFF file, or None if its pixels cannot be
+        read without decoding them (compressed, more than 8 bits, color...)
+        """
+        with open(path, 'rb') as f:
+            header = f.read(8)
+            if header[:4] not in ('II*\x00','MM\x00*'):
+                return None
+            order = '<' if header[:2]=='II' else '>'
+            tags = _tiffTags(f, order, struct.unpack(order+'I', header[4:8])[0])
+        rows, cols = tags.get(257,[None])[0], tags.get(256,[None])[0]
+        if (rows is None or 273 not in tags or 279 not in tags
+                or tags.get(259,[1])[0] != 1       # Compression: none
+                or tags.get(258,[1])[0] != 8       # BitsPerSample
+                or tags.get(277,[1])[0] != 1       # SamplesPerPixel
+                or tags.get(262,[1])[0] != 1):     # Photometric: black is zero
+            return None
+        rowsPerStrip = min(tags.get(278,[rows])[0], rows)
+        return TiffStrips(path, (rows, cols), tags[273], tags[279], rowsPerStrip)
+
+    def asArray(self):
+        """
+        A read-only memory map of the image if the strips follow each other in
+        the file (they usually do), or else the TiffStrips itself.
+        """
+        contiguous = all(self.offsets[i+1] == self.offsets[i]+self.counts[i]
+                         for i in range(len(self.offsets)-1))
+        if contiguous:
+            return np.memmap(self.path, dtype=np.uint8, mode='r',
+                             offset=self.offsets[0], shape=self.shape)
+        return self
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index, slice(None))
+        rowSlice, colSlice = index
+        r0, r1, step = rowSlice.indices(self.shape[0])
+        if step != 1:
+            raise Exception("TiffStrips only reads contiguous rows")
+        if r1 <= r0:
+            return np.zeros((0, self.shape[1]), np.uint8)[:,colSlice]
+        first, last = r0//self.rowsPerStrip, (r1-1)//self.rowsPerStrip
+        parts = []
+        with open(self.path, 'rb') as f:
+            for s in range(first, last+1):
+                stripRows = min(self.rowsPerStrip, self.shape[0]-s*self.rowsPerStrip)
+                f.seek(self.offsets[s])
+                data = np.fromstring(f.read(stripRows*self.shape[1]), np.uint8)
+                parts.append(data.reshape(stripRows, self.shape[1]))
+        rows = np.concatenate(parts, axis=0)
+        top = r0-first*self.rowsPerStrip
+        return rows[top:top+r1-r0, colSlice]
+
+def _tiffTags(f, order, ifdOffset):
+    # The SHORT and LONG tags of an IFD, as lists of values
+    types = {3:('H',2), 4:('I',4)}
+    f.seek(ifdOffset)
+    numEntries = struct.unpack(order+'H', f.read(2))[0]
+    entries = [struct.unpack(order+'HHI4s', f.read(12)) for i in range(numEntries)]
+    tags = {}
+    for tag, fieldType, count, value in entries:
+        if fieldType not in types:
+            continue
+        code, size = types[fieldType]
+        if count*size > 4:
+            # The values are somewhere else in the file
+            f.seek(struct.unpack(order+'I', value)[0])
+            value = f.read(count*size)
+        tags[tag] = list(struct.unpack(order+code*count, value[:count*size]))
+    return tags
+
+###################################################################################
+
+###################################################################################
+
+class TileSource(object):
+    """
+    The sub-images of a panorama and its mask, read from the panorama when they
+    are asked for (see the module docstring).
+        > tiles = TileSource(panPath, maskPath, numParts=256, halo=32)
+        > for name in tiles.names(): img, mask = tiles.tile(name)
+        Arguments:
+         - panorama - path to the panorama (see openPanorama), or an array
+         - mask - path to the mask of the panorama, or an array. None means
+            that the whole panorama is foil.
+        Key-word Arguments:
+         - numParts = 256 - number of sub-images. Must be a perfect square (see
+            images.splitImage).
+         - halo = 0 - pixels of the panorama around every sub-image that tile()
+            also returns
+         - shape = None - (rows, columns) of .raw panoramas and masks
+    """
+    def __init__(self, panorama, mask=None, **kwargs):
+        numParts = kwargs.get('numParts',256) # Number of sub-images
+        self.halo = kwargs.get('halo',0) # Pixels around every sub-image
+        shape = kwargs.get('shape',None) # Shape of .raw files
+
+        if isinstance(panorama, str):
+            panorama = openPanorama(panorama, shape)
+        if isinstance(mask, str):
+            mask = openPanorama(mask, shape)
+        self.panorama = panorama
+        self.mask = mask
+        self.shape = tuple(panorama.shape[:2])
+        if mask is not None and tuple(mask.shape[:2]) != self.shape:
+            raise Exception("The mask and the panorama have different dimensions!")
+        perSide = int(np.sqrt(numParts))
+        self.rowBounds = gridBounds(self.shape[0], perSide)
+        self.colBounds = gridBounds(self.shape[1], perSide)
+        self.grid = {}
+        for r in range(perSide):
+            for c in range(perSide):
+                self.grid["sub_"+str(r).zfill(3)+"_"+str(c).zfill(3)] = (r, c)
+
+    def __len__(self):
+        return len(self.grid)
+
+    def names(self):
+        """
+        Names of the sub-images, in the order of the files of splitImage
+        """
+        return sorted(self.grid)
+
+    def bounds(self, name):
+        """
+        (top, bottom, left, right) of the sub-image in the panorama
+        """
+        r, c = self.grid[name]
+        return self.rowBounds[r] + self.colBounds[c]
+
+    def window(self, name):
+        """
+        (top, bottom, left, right) of the sub-image and its halo in the panorama
+        """
+        top, bottom, left, right = self.bounds(name)
+        h = self.halo
+        return (max(top-h, 0), min(bottom+h, self.shape[0]),
+                max(left-h, 0), min(right+h, self.shape[1]))
+
+    def core(self, name):
+        """
+        The slices of the window of tile() that are the sub-image itself
+        """
+        top, bottom, left, right = self.bounds(name)
+        wTop, wBottom, wLeft, wRight = self.window(name)
+        return (slice(top-wTop, bottom-wTop), slice(left-wLeft, right-wLeft))
+
+    def tile(self, name):
+        """
+        Returns the window of the sub-image (with its halo) in the panorama and
+        in the mask, as uint8 arrays of their own
+        """
+        top, bottom, left, right = self.window(name)
+        img = np.array(self.panorama[top:bottom, left:right], dtype=np.uint8)
+        if self.mask is None:
+            mask = np.ones_like(img)*255
+        else:
+            mask = np.array(self.mask[top:bottom, left:right], dtype=np.uint8)
+        return img, mask
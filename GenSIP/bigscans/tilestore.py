@@ -0,0 +1,237 @@
+"""
+Contains the preprocessed tile store used by the threshold sweeps of
+GenSIP.bigscans.bigcalibrate.
+
+A sweep analyzes the same sub-images (tiles) of a panorama at many threshold
+levels. Only the thresholds change from one point to the next, but every point
+used to decode every tile and its mask, run the Kuwahara poster preprocessing
+and posterize it again. The store does that work once per tile and writes
+    - the Gaussian blurs that bigRegionalThresh thresholds (kernel sizes 5 and
+      gaussBlur),
+    - the region label image of the poster (see posterize.REGION_NAMES),
+    - the mask, and the blurred mask that bigRegionalThresh applies,
+into one flat uint8 file per array in storeDir. The files are opened as numpy
+memory maps, so a sweep point only reads the pages it needs and never decodes a
+TIFF.
+
+The manifest of the store records the size and modification time of every tile
+and mask, the poster parameters, gaussBlur and postercache.CODE_VERSION.
+openTileStore rebuilds the store whenever any of them changed.
+"""
+import numpy as np
+import os
+import pickle
+import cv2
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+from GenSIP.posterize import PRESETS, posterLabels
+from GenSIP.postercache import CODE_VERSION
+from GenSIP.regionthresh import blurImage, regionThreshold
+
+# Bump this whenever the layout of the store changes.
+STORE_VERSION = '1'
+
+# Labels of the regions bigRegionalThresh thresholds (pleat, darkMo, Mo, highEx
+# and Pt), see posterize.REGION_NAMES
+PLEAT, DARKMO, MO, HIGHEX, PT = 1, 2, 3, 4, 5
+
+###################################################################################
+
+###################################################################################
+
+class TileStore:
+    """
+    Read-only view of a tile store written by buildTileStore. Use openTileStore
+    to get one.
+        Attributes:
+         - storeDir - folder of the store
+         - manifest - dictionary with the tile list, the source signature and the
+            parameters the store was built with
+         - gaussBlur - blur kernel size of the Mo, highEx and Pt regions
+    """
+    def __init__(self, storeDir, manifest):
+        self.storeDir = storeDir
+        self.manifest = manifest
+        self.gaussBlur = manifest['params']['gaussBlur']
+        self.arrays = {}
+        for name in manifest['arrays']:
+            path = os.path.join(storeDir, name+'.dat')
+            if manifest['size'] == 0:
+                self.arrays[name] = np.zeros((0,), dtype=np.uint8)
+            else:
+                self.arrays[name] = np.memmap(path, dtype=np.uint8, mode='r',
+                                              shape=(manifest['size'],))
+
+    def __len__(self):
+        return len(self.manifest['tiles'])
+
+    def names(self):
+        """
+        Returns the file names of the tiles, in store order.
+        """
+        return [t['name'] for t in self.manifest['tiles']]
+
+    def tile(self, i):
+        """
+        Returns a dictionary with the arrays of tile i (read-only memory maps):
+        'blurs' (dictionary keyed by kernel size, as made by
+        functions.regionBlurs), 'labels', 'mask' and 'threshMask'.
+        """
+        t = self.manifest['tiles'][i]
+        size = t['shape'][0]*t['shape'][1]
+        view = lambda name: self.arrays[name][t['offset']:t['offset']+size].reshape(t['shape'])
+        blurs = dict([(k, view('blur'+str(k))) for k in self.manifest['blurSizes']])
+        return {'name':t['name'], 'blurs':blurs, 'labels':view('labels'),
+                'mask':view('mask'), 'threshMask':view('threshMask')}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tile(i)
+
+###################################################################################
+
+###################################################################################
+
+def listTiles(panFolder):
+    """
+    Returns the sorted names of the sub-images (sub_*.tif) in panFolder.
+    """
+    return sorted([f for f in os.listdir(panFolder)
+                   if f.startswith("sub_") and f.endswith(".tif")])
+
+###################################################################################
+
+###################################################################################
+
+def storeParams(gaussBlur=3, **kwargs):
+    """
+    Returns the dictionary of everything besides the tiles themselves that the
+    stored arrays depend on: gaussBlur, the bigPostPreProc key-word arguments
+    that change the poster, the 'bigfoils' band table and the code versions.
+    """
+    posterKw = dict([(k,v) for k,v in kwargs.items()
+                     if k not in ('KuMaxMem','KuWorkers','useCache','Mask','Kuw_only')])
+    return {'gaussBlur':gaussBlur, 'poster':sorted(posterKw.items()),
+            'bands':PRESETS['bigfoils']['bands'], 'codeVersion':CODE_VERSION,
+            'storeVersion':STORE_VERSION}
+
+###################################################################################
+
+###################################################################################
+
+def sourceSignature(panFolder, maskFolder, names=None):
+    """
+    Returns the list of (name, tile size, tile mtime, mask size, mask mtime) of
+    the tiles, which changes whenever a tile or a mask is written again. Only
+    stats the files, nothing is decoded.
+    """
+    if names is None:
+        names = listTiles(panFolder)
+    sig = []
+    for name in names:
+        tile = os.path.join(panFolder, name)
+        mask = os.path.join(maskFolder, name)
+        sig.append((name, os.path.getsize(tile), os.path.getmtime(tile),
+                    os.path.getsize(mask), os.path.getmtime(mask)))
+    return sig
+
+###################################################################################
+
+###################################################################################
+
+def buildTileStore(panFolder, maskFolder, storeDir, gaussBlur=3, verbose=False, **kwargs):
+    """
+    Preprocesses every sub-image of panFolder and its mask in maskFolder (the
+    same file name) once, and writes the store to storeDir. The key-word
+    arguments besides gaussBlur and verbose are passed on to
+    images.bigPostPreProc. Returns the TileStore.
+    """
+    if not os.path.exists(storeDir):
+        os.makedirs(storeDir)
+    names = listTiles(panFolder)
+    params = storeParams(gaussBlur, **kwargs)
+    sizes = sorted(set((5,gaussBlur)))
+    arrays = ['blur'+str(k) for k in sizes] + ['labels','mask','threshMask']
+    # Remove the old manifest first, so that a build that does not finish
+    # leaves no valid store behind
+    manPath = os.path.join(storeDir, 'manifest.pkl')
+    if os.path.exists(manPath):
+        os.remove(manPath)
+
+    files = dict([(name, open(os.path.join(storeDir, name+'.dat'), 'wb')) for name in arrays])
+    tiles = []
+    offset = 0
+    try:
+        for name in names:
+            subImage = fun.loadImg(os.path.join(panFolder, name), 0)
+            subMask = fun.loadImg(os.path.join(maskFolder, name), 0)
+            if subMask.shape != subImage.shape:
+                raise Exception("Mask and image have different dimensions! ("+name+")")
+            proc = images.bigPostPreProc(subImage, **kwargs)
+            poster = images.bigPosterfy(proc)
+            blurs = blurImage(subImage, sizes)
+            # The mask as bigRegionalThresh applies it
+            threshMask = cv2.GaussianBlur(subMask, (gaussBlur,gaussBlur), 0)
+            for k in sizes:
+                files['blur'+str(k)].write(blurs[k].tobytes())
+            files['labels'].write(posterLabels(poster).tobytes())
+            files['mask'].write((subMask!=0).astype(np.uint8).tobytes())
+            files['threshMask'].write((threshMask!=0).astype(np.uint8).tobytes())
+            tiles.append({'name':name, 'shape':subImage.shape, 'offset':offset})
+            offset += subImage.size
+            if verbose:
+                print "Stored " + name
+    finally:
+        for f in files.values():
+            f.close()
+
+    manifest = {'tiles':tiles, 'size':offset, 'arrays':arrays, 'blurSizes':sizes,
+                'params':params, 'source':sourceSignature(panFolder, maskFolder, names)}
+    tmp = manPath + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(manifest, f)
+    os.rename(tmp, manPath)
+    return TileStore(storeDir, manifest)
+
+###################################################################################
+
+###################################################################################
+
+def openTileStore(panFolder, maskFolder, storeDir, gaussBlur=3, verbose=False, **kwargs):
+    """
+    Returns the TileStore of panFolder and maskFolder in storeDir. The store is
+    (re)built with buildTileStore if there is none yet, or if a tile, a mask,
+    the poster parameters (key-word arguments of images.bigPostPreProc),
+    gaussBlur or the code version changed since it was built.
+    """
+    manPath = os.path.join(storeDir, 'manifest.pkl')
+    if os.path.exists(manPath):
+        with open(manPath, 'rb') as f:
+            manifest = pickle.load(f)
+        if (manifest['params'] == storeParams(gaussBlur, **kwargs) and
+            manifest['source'] == sourceSignature(panFolder, maskFolder)):
+            return TileStore(storeDir, manifest)
+        if verbose:
+            print "Tile store in " + storeDir + " is out of date. Rebuilding..."
+    return buildTileStore(panFolder, maskFolder, storeDir, gaussBlur, verbose, **kwargs)
+
+###################################################################################
+
+###################################################################################
+
+def threshTile(tile, p=8, d=28, m=55, hE=60, pt=70, gaussBlur=3, MoDirt="Mo"):
+    """
+    Thresholds a stored tile the way bigfoils.bigRegionalThresh thresholds the
+    tile with its mask. Returns the thresholded image as a boolean array.
+    """
+    threshed = regionThreshold(tile['blurs'][5], tile['labels'],
+                               {PLEAT:(p,5),
+                                DARKMO:(d,5),
+                                MO:(m,gaussBlur),
+                                HIGHEX:(hE,gaussBlur),
+                                PT:(pt,gaussBlur)},
+                               blurs=tile['blurs'])
+    if fun.checkMoDirt(MoDirt) == 'dirt':
+        return np.logical_and(threshed==0, tile['threshMask'])
+    else:
+        return np.logical_and(threshed!=0, tile['threshMask'])
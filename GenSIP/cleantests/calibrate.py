@@ -5,8 +5,8 @@ GenSIP analysis tools, and set boundaries on the error in the results of the Gen
 analysis. 
 """
 from GenSIP.functions import *
-from GenSIP.molybdenum import getFoilArea, calcPtArea
-from GenSIP.dirt import amountDirt
+from GenSIP.regionthresh import regionThreshold
+import GenSIP.measure as meas
 from matplotlib import pyplot as plt
 from socket import gethostname
 from time import time
@@ -19,6 +19,9 @@ def threshPrec(sss, Domain=120, step=2, MoDirt="Mo",RUN=("P","D","M","Pt"),Pstar
     due to variations in the threshold level. It produces a series of graphs 
     depicting the variation of the calculated molybdenum loss or dirt loss with 
     the threshold levels in the regionalThresh.
+    Each image is loaded and posterized once; the threshold points are then all
+    evaluated at once from the region histograms of the image (see sweepMoComp
+    and sweepDirtComp) instead of re-running the analysis for every point.
         Inputs:
             - sss: The Sample Set String of input pictures to examine, just as in
             - Domain: An integer that gives the length of the threshold domain 
@@ -141,18 +144,17 @@ def threshPrec(sss, Domain=120, step=2, MoDirt="Mo",RUN=("P","D","M","Pt"),Pstar
                 yBEF = np.zeros((numpoints))
                 yAFT = np.zeros((numpoints))
                 
+                bf = loadImg(befpath)
+                af = loadImg(aftpath)
+                
                 if MoDirt in allowableMo:
-                    for i in range(numpoints):
-                        ret = CalMoComp(befpath, aftpath, P=P[i],D=D[i],M=M[i],Pt=Pt[i],I=str(i))
-                        Ptbef = ret[0]
-                        Ptaft = ret[1]
-                        #PerPtLoss = (Ptbef-Ptaft)/Ptbef
-                        massLoss = ret[3]
-                        PercLoss = ret[4]
-                        y1[i] = massLoss
-                        y2[i] = PercLoss
-                        yBEF[i] = Ptbef
-                        yAFT[i] = Ptaft
+                    # All the threshold points at once:
+                    ret = sweepMoComp(bf, af, P=P,D=D,M=M,Pt=Pt)
+                    yBEF[:] = ret[0]
+                    yAFT[:] = ret[1]
+                    #PerPtLoss = (Ptbef-Ptaft)/Ptbef
+                    y1[:] = ret[3] # massLoss
+                    y2[:] = ret[4] # PercLoss
                     
                     # MAKE PLOT 
                     
@@ -216,16 +218,14 @@ def threshPrec(sss, Domain=120, step=2, MoDirt="Mo",RUN=("P","D","M","Pt"),Pstar
                     print "Moly gradient plot for "+foilnum+" finished."
                     
                 elif MoDirt in allowableDirt:
-                    for i in range(numpoints):
-                        ret = CaldirtComp(befpath, aftpath,P=P[i],D=D[i],M=M[i],Pt=Pt[i])
-                        numBef = ret[0]
-                        numAft = ret[1]
-                        areaBef = ret[2]
-                        areaAft = ret[3]
-                        percNum = 100*(numBef-numAft)/numBef
-                        percArea = 100*(areaBef-areaAft)/areaBef
-                        y1[i] = percNum
-                        y2[i] = percArea
+                    # All the threshold points at once:
+                    ret = sweepDirtComp(bf, af, P=P,D=D,M=M,Pt=Pt)
+                    numBef = ret[0].astype(np.float64)
+                    numAft = ret[1].astype(np.float64)
+                    areaBef = ret[2].astype(np.float64)
+                    areaAft = ret[3].astype(np.float64)
+                    y1[:] = 100*(numBef-numAft)/numBef # percNum
+                    y2[:] = 100*(areaBef-areaAft)/areaBef # percArea
                     print "Dirt plot for "+foilnum+" finished."
                     
                     plt.figure()
@@ -391,15 +391,15 @@ def CalMoComp (before, after, P=90,D=120,M=180,Pt=180,res=1,I=""):
     foilareaaft = getFoilArea(af,res)
 
     # Calculate area of exposed platinum, adjust for resolution:
-    PtAreaBef = calcPtArea(Ptbef)*res
-    PtAreaAft = calcPtArea(Ptaft)*res
+    PtAreaBef = meas.calcExposedPt(Ptbef,res,getAreaInSquaremm=False)
+    PtAreaAft = meas.calcExposedPt(Ptaft,res,getAreaInSquaremm=False)
 	
     #print "Total foil area before: %s" %str(foilareabef)
     #print "Total foil area after:  %s" %str(foilareaaft)
 
     # Calculate difference in area of exposed Pt:
     # Normalize values to the area of the before image
-    befaftRatio = foilareabef/foilareaaft
+    befaftRatio = float(foilareabef)/foilareaaft
     areaLoss = PtAreaAft*befaftRatio-PtAreaBef
     MolyBef = foilareabef-PtAreaBef
     MolyAft = foilareaaft-PtAreaAft
@@ -430,7 +430,7 @@ def CALisolatePt (image, P=90,D=120,M=180,Pt=180):
     """
     poster = makePoster(image)
     # Threshold the image. This is a global threshold. There is probably a better one out there.
-    isoPt = regionalThresh(image, poster,p=P,d=D,m=M,pt=Pt,gaussBlur=3)
+    isoPt = regionalThresh(image, poster,p=P,d=D,m=M,pt=Pt,gaussBlur=3,MoDirt='mo')
     # Make the image into a boolean image
     isoPt = isoPt.astype(np.bool_)
     return isoPt
@@ -448,10 +448,10 @@ def CaldirtComp (before, after, P=8,D=28,M=55,Pt=60):
 	
     # Dirt analysis
     bposter,aposter = makePoster(bf),makePoster(af)
-    bthreshed,bmasked = regionalThresh(bf, bposter, p=P,d=D,m=M,pt=Pt,MaskEdges=True,GetMask=True)
-    athreshed,amasked = regionalThresh(af, aposter, p=P,d=D,m=M,pt=Pt,MaskEdges=True,GetMask=True)
-    numbf,areabf,labbf,sizesbf = amountDirt(bthreshed)
-    numaf,areaaf,labaf,sizesaf = amountDirt(athreshed)
+    bthreshed,bmasked = regionalThresh(bf, bposter, p=P,d=D,m=M,pt=Pt,MaskEdges=True,returnMask=True)
+    athreshed,amasked = regionalThresh(af, aposter, p=P,d=D,m=M,pt=Pt,MaskEdges=True,returnMask=True)
+    areabf,numbf = meas.calcDirt(bthreshed,1)
+    areaaf,numaf = meas.calcDirt(athreshed,1)
 
     bthreshed = (bmasked/255)*bthreshed
     athreshed = (amasked/255)*athreshed
@@ -461,6 +461,119 @@ def CaldirtComp (before, after, P=8,D=28,M=55,Pt=60):
     #picts = (bthreshed, athreshed)
     return ret
     
+def regionHistograms(image, poster, gaussBlur=3, mask=None):
+    """
+    Returns the histograms of the blurred image inside each region of the 
+    poster, blurred the way regionalThresh blurs each region, as a dictionary
+    {poster gray level: 256 bin histogram}. If a mask is given, only the pixels
+    where the mask is not 0 are counted.
+    """
+    blurs = regionBlurs(image, gaussBlur)
+    kernels = {50:5, 85:5, 150:gaussBlur, 255:gaussBlur}
+    hists = {}
+    for g in kernels:
+        sel = poster==g
+        if mask is not None:
+            sel &= (mask!=0)
+        hists[g] = np.bincount(blurs[kernels[g]][sel], minlength=256)
+    return hists
+
+def sweepCounts(hists, thresholds, above=True):
+    """
+    Returns the number of pixels above the threshold of their region (or at or 
+    below it if above=False) for every threshold point at once, from the region
+    histograms made by regionHistograms. 
+    'thresholds' is a dictionary {poster gray level: array of thresholds}, with
+    one threshold per point. This is the pixel count of the regionalThresh 
+    image, without thresholding the image.
+    """
+    total = 0
+    for g in hists:
+        # cv2.threshold rounds the threshold down; below[t+1] = pixels <= t
+        t = np.clip(np.floor(np.asarray(thresholds[g],dtype=np.float64)),-1,255).astype(np.int64)
+        below = np.concatenate(([0],np.cumsum(hists[g])))[t+1]
+        if above:
+            total = total + (hists[g].sum()-below)
+        else:
+            total = total + below
+    return total
+
+def sweepMoComp (bf, af, P=90,D=120,M=180,Pt=180,res=1):
+    """
+    Same as CalMoComp, but for arrays of threshold values P, D, M, Pt (one value
+    per point) and images instead of paths. The posters and region histograms
+    are made once per image, then every point is evaluated from the histograms.
+    Returns the tuple of arrays (PtAreaBef, PtAreaAft, areaLoss, molyLoss, 
+    pcntMolyLoss).
+    """
+    thresholds = {50:P, 85:D, 150:M, 255:Pt}
+    hbef = regionHistograms(bf, makePoster(bf), gaussBlur=3)
+    haft = regionHistograms(af, makePoster(af), gaussBlur=3)
+    
+    foilareabef = float(getFoilArea(bf,res))
+    foilareaaft = float(getFoilArea(af,res))
+    
+    # Area of exposed platinum at every point, adjusted for resolution:
+    PtAreaBef = sweepCounts(hbef, thresholds)*res
+    PtAreaAft = sweepCounts(haft, thresholds)*res
+    
+    # Same calculation as CalMoComp
+    befaftRatio = foilareabef/foilareaaft
+    areaLoss = PtAreaAft*befaftRatio-PtAreaBef
+    MolyBef = foilareabef-PtAreaBef
+    MolyAft = foilareaaft-PtAreaAft
+    pcntMolyLoss = 1-(MolyAft/MolyBef)*(foilareabef/foilareaaft)
+    pcntMolyLoss = roundEach(pcntMolyLoss*100,1)
+    molyLoss = roundEach(areaLoss*.3*10.2*(10**-6),2) #moly loss in micrograms
+    PtAreaBef = roundEach(PtAreaBef*10**-6, 4)
+    PtAreaAft = roundEach(PtAreaAft*10**-6, 4)
+    areaLoss = roundEach(areaLoss*10**-6, 4)
+    return (PtAreaBef, PtAreaAft, areaLoss, molyLoss, pcntMolyLoss)
+
+def sweepDirtComp (bf, af, P=8,D=28,M=55,Pt=60,countDirt=True):
+    """
+    Same as CaldirtComp, but for arrays of threshold values P, D, M, Pt (one 
+    value per point) and images instead of paths. The dirt areas come from the
+    region histograms of the masked foil. Counting particles needs the labelled
+    image, so if countDirt is True each point is thresholded with the poster,
+    blurs and edge mask made once per image; otherwise the counts are 0.
+    Returns the tuple of arrays (numbf, numaf, areabf, areaaf).
+    """
+    ret = []
+    points = max([np.asarray(t).size for t in (P,D,M,Pt)])
+    # One threshold per point for every region
+    thresholds = {50:P, 85:D, 150:M, 255:Pt}
+    for g in thresholds:
+        thresholds[g] = np.asarray(thresholds[g])*np.ones(points)
+    for img in (bf, af):
+        poster = makePoster(img)
+        # The foil as regionalThresh(MaskEdges=True) sees it
+        masked, mask = maskEdge(img)
+        mask = (mask.astype(np.bool_)&(poster!=0)).astype(np.uint8)*255
+        hists = regionHistograms(img, poster, gaussBlur=3, mask=mask)
+        area = sweepCounts(hists, thresholds, above=False)
+        num = np.zeros(points, dtype=np.int64)
+        if countDirt:
+            blurs = regionBlurs(img, 3)
+            threshed = np.empty(img.shape, dtype=np.uint8)
+            for i in range(points):
+                regions = {50:(thresholds[50][i],5), 85:(thresholds[85][i],5),
+                           150:(thresholds[150][i],3), 255:(thresholds[255][i],3)}
+                regionThreshold(img, poster, regions, blurs=blurs, out=threshed)
+                # White dirt on black inside the foil
+                dirt = cv2.bitwise_and(cv2.bitwise_not(threshed), mask)
+                num[i] = meas.calcDirt(dirt,1)[1]
+        ret.append((num, area))
+    return (ret[0][0], ret[1][0], ret[0][1], ret[1][1])
+    
+def roundEach(a, n):
+    """
+    Rounds every value of an array with the built-in round, which rounds halves
+    away from zero (np.round rounds them to even), so sweep results match the 
+    single point functions.
+    """
+    return np.array([round(v,n) for v in np.asarray(a,dtype=np.float64).flat]).reshape(np.shape(a))
+
 def convTime(t):
     mins = round(t/60,0)
     seconds = round(t%60,3)
@@ -198,13 +198,15 @@ def dirtComp (beforeImg, afterImg, res, MaskEdges=True, retSizeData=False):
 
 ####################################################################################
 
-def dirtnalysis (img, res, MaskEdges=True, retSizes=False):
+def dirtnalysis (img, res, MaskEdges=True, retSizes=False, poster=None, blurs=None):
     """
-    Performs dirt analysis on one image. 
+    Performs dirt analysis on one image. A poster and the region blurs 
+    (functions.regionBlurs) already made for the image can be passed in so that
+    they are shared with the Mo analysis.
     """
     
     # Dirt analysis
-    threshed, masked = isolateDirt(img)
+    threshed, masked = isolateDirt(img, poster=poster, blurs=blurs)
     area,num,sizes,labelled = meas.calcDirt(threshed, 
                                             res, 
                                             returnSizes=True,
@@ -223,8 +225,9 @@ def dirtnalysis (img, res, MaskEdges=True, retSizes=False):
 
 ####################################################################################
 
-def isolateDirt (img, MaskEdges=True):
-    poster = fun.makePoster(img)
+def isolateDirt (img, MaskEdges=True, poster=None, blurs=None):
+    if poster is None:
+        poster = fun.makePoster(img)
     threshed,masked = fun.regionalThresh(img, poster,
                                          p=8, 
                                          d=28,
@@ -232,7 +235,8 @@ def isolateDirt (img, MaskEdges=True):
                                          pt=60,
                                          MaskEdges=MaskEdges,
                                          returnMask=MaskEdges,
-                                         MoDirt='dirt')
+                                         MoDirt='dirt',
+                                         blurs=blurs)
     return threshed, masked
 '''
 EXTRA and OUTDATED CODE:
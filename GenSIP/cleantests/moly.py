@@ -13,7 +13,7 @@ import GenSIP.gencsv as gencsv
 
 ####################################################################################
 
-def analyzeMoly (sss, res, verbose=False):
+def analyzeMoly (sss, res, verbose=False, resume=False):
     """ 
     This is the master function for comparing the exposed Pt on foil images.
     It takes in a 'Sample Set String' ('sss') and runs the comparison functions 
@@ -23,6 +23,10 @@ def analyzeMoly (sss, res, verbose=False):
         - sss -  The Sample Set String, a short identifier for whichever set
                 of SEM scans you are running.
         - res - Resolution of the image, in square microns per pixel.     
+        Key-word Arguments:
+        - resume - The CSV file is written one row per foil (see GenSIP.gencsv).
+                If True, the foils that already have a row in the CSV file of 
+                an earlier, unfinished run are skipped.
     """
         
     # Declare a list of acceptable file types: tif and jpg
@@ -37,7 +41,21 @@ def analyzeMoly (sss, res, verbose=False):
     if not os.path.exists('Output/Output_'+sss+'/PtMaps'):
         os.makedirs('Output/Output_'+sss+'/PtMaps')
         
-    Data = {}
+    """Write results Data to a .csv file"""
+    # Make the Pt output csv file. Each foil gets its row as soon as it is done
+    filePath = 'Output/Output_'+sss+'/Mo_output_'+sss+'.csv'
+    PtCSV = gencsv.DataToCSV(filePath, sss, resume=resume)
+    
+    # Make column titles:
+    ColHeaders = ['Foil #',
+                  'Pt Area Before (mm^2)', 
+                  'Pt Area After (mm^2)', 
+                  'Area of Mo Loss (mm^2)', 
+                  'Approx Mo Loss (micrograms)',
+                  '% Mo lost']
+    PtCSV.startStream(ColHeaders)
+    
+    Data = dict(PtCSV.DoneData)
     # fn stands for filename. befpics is a list of the filenames in the folder 
     # containing the before pictures
     for fn in befpics:
@@ -46,6 +64,7 @@ def analyzeMoly (sss, res, verbose=False):
 	if exten in filetypes:
 	    # Get number of current foil
             foilnum = filename.split()[0]
+            if PtCSV.isDone(foilnum): continue
             if verbose: print "Now comparing foil %s" %foilnum
             aftfoil = foilnum + ' after clean' + exten
             aftpath = 'InputPicts/After/After_'+sss+'/'+aftfoil
@@ -75,25 +94,13 @@ def analyzeMoly (sss, res, verbose=False):
                                  'Area of Mo Loss (mm^2)':areaLoss, 
                                  'Approx Mo Loss (micrograms)':round(Moloss,2),
                                  '% Mo lost':PctMo}
+		PtCSV.writeRow(foilnum, Data[foilnum])
             else: print "No after image for foil "+foilnum
         else:
             print "Not a picture: %s" % filename
             
-    """Write results Data to a .csv file"""
-    # Make dirt and Pt output csv files and corresponding writers
-    filePath = 'Output/Output_'+sss+'/Mo_output_'+sss+'.csv'
-    PtCSV = gencsv.DataToCSV(filePath, sss)
-    
-    # Make column titles:
-    ColHeaders = ['Foil #',
-                  'Pt Area Before (mm^2)', 
-                  'Pt Area After (mm^2)', 
-                  'Area of Mo Loss (mm^2)', 
-                  'Approx Mo Loss (micrograms)',
-                  '% Mo lost']
-                  
-    # Write the Data to the CSV file
-    PtCSV.writeDataFromDict(Data,colHeads=ColHeaders)
+    # Finish the CSV file
+    PtCSV.writeFooter(Data)
     PtCSV.closeCSVFile()
     
     # Check to see if any foils have an after picture but not a before picture:
@@ -266,10 +273,14 @@ def MoComp (beforeImg, afterImg, res, verbose=False):
 
 ####################################################################################
 
-def Monalysis(img, res, verbose=False):
-
+def Monalysis(img, res, verbose=False, poster=None, blurs=None):
+    """
+    Runs the cleantests Mo analysis on one image. A poster and the region blurs
+    (functions.regionBlurs) already made for the image can be passed in so that
+    they are shared with the dirt analysis.
+    """
     # Generate binary thresholds for Platinum:
-    PtImg = isolatePt(img)
+    PtImg = isolatePt(img, poster=poster, blurs=blurs)
 
     # Approximate the percent of molybdenum lost:
     # Get the approximate foil area in square millimeters
@@ -304,12 +315,13 @@ def Monalysis(img, res, verbose=False):
 
 ####################################################################################
 
-def isolatePt (image):
+def isolatePt (image, poster=None, blurs=None):
     """
     This function filters and thresholds the image using regionalThres in order 
     to estimate the area of exposed Pt. Argument "image" must be ndarray.
     """
-    poster = fun.makePoster(image)
+    if poster is None:
+        poster = fun.makePoster(image)
     
     # Threshold the image. This is a global threshold. There is probably a better one out there.
     isoPt = fun.regionalThresh(image, poster,
@@ -319,7 +331,8 @@ def isolatePt (image):
                                pt=180,
                                gaussBlur=3,
                                MaskEdges=False,
-                               MoDirt='mo')
+                               MoDirt='mo',
+                               blurs=blurs)
                                
     # Make the image into a boolean image
     isoPt = isoPt.astype(np.bool_)
@@ -1,17 +1,81 @@
 # This module contains all functions used across GenSIP
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.figure as mplfig
-from scipy import misc
 from GenSIP.kuwahara import Kuwahara
+from GenSIP.posterize import posterizeLUT
+from GenSIP.postercache import cachedPoster
+from GenSIP.regionthresh import regionThreshold, blurImage
+from GenSIP.mapwriter import loadPacked
 import os
+import zlib
+from collections import OrderedDict
 from time import localtime, asctime, struct_time
 
 ####################################################################################
 
 ####################################################################################
 
+# Number of images that foilSegmentation remembers the foil of
+FOIL_CACHE_SIZE = 8
+_FOIL_CACHE = OrderedDict()
+
+def foilSegmentation(img, scale=.25, useCache=True):
+    """
+    Finds the foil in an image: the white pixels of the thresholded 100x100 
+    blur of the image (gray level over 50), and the outer contour of the 
+    largest white area, which should be the outline of the foil. Returns the 
+    mask of the foil (uint8, white = 255) and the contour, or None as the 
+    contour if there is no foil. maskEdge, getFoilArea, regionalThresh 
+    (MaskEdges=True) and nexus.analyzeImage (autoMaskEdges=True) all use it.
+    
+    The blur only keeps the large shapes of the image, so it is done on the 
+    image shrunk by scale (area averaged, which also takes care of the small 
+    dark areas that the old 3x3 closing removed), with a kernel shrunk by the 
+    same factor. The blurred image is scaled back up before thresholding, and 
+    only the outer contours of the small mask are looked for. The blurred 
+    images of the last FOIL_CACHE_SIZE images are kept, so asking for the foil 
+    of the same image again (maskEdge and then getFoilArea, for instance) skips
+    the blur. useCache=False always blurs.
+    """
+    rows, cols = img.shape[:2]
+    small = (max(1, int(round(rows*scale))), max(1, int(round(cols*scale))))
+    def compute():
+        shrunk = cv2.resize(img.astype(np.uint8), (small[1],small[0]), 
+                            interpolation=cv2.INTER_AREA)
+        kern = max(1, int(round(100*scale)))
+        return cv2.blur(shrunk, (kern,kern))
+    if useCache:
+        # The SHA-1 keys of the poster cache take longer than the blur itself,
+        # so the images are told apart by two quick checksums instead
+        data = np.ascontiguousarray(img).data
+        key = (img.shape, str(img.dtype), scale, zlib.crc32(data), zlib.adler32(data))
+        if key not in _FOIL_CACHE:
+            _FOIL_CACHE[key] = compute()
+            if len(_FOIL_CACHE) > FOIL_CACHE_SIZE:
+                _FOIL_CACHE.popitem(last=False)
+        blurred = _FOIL_CACHE[key]
+    else:
+        blurred = compute()
+    # Threshold the blur at full size, for smooth foil edges
+    ret,mask = cv2.threshold(cv2.resize(blurred, (cols,rows), interpolation=cv2.INTER_LINEAR),
+                             50,255,cv2.THRESH_BINARY)
+    ret,smallMask = cv2.threshold(blurred,50,255,cv2.THRESH_BINARY)
+    # Put a black border around the small mask to prevent edge problems
+    smallMask = cv2.copyMakeBorder(smallMask,1,1,1,1,cv2.BORDER_CONSTANT,value=0)
+    contours = cv2.findContours(smallMask,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)[-2]
+    if len(contours)==0:
+        return mask, None
+    # Largest contour should be the outer edge of foil. Back to the full size
+    # pixels (from the centers of the small pixels, without the border)
+    outercnt = max(contours, key=cv2.contourArea).astype(np.float64)-1
+    outercnt[...,0] = (outercnt[...,0]+.5)*cols/small[1]-.5
+    outercnt[...,1] = (outercnt[...,1]+.5)*rows/small[0]-.5
+    return mask, np.round(outercnt).astype(np.int32)
+
+####################################################################################
+
+####################################################################################
+
 def maskEdge(img, thickness = 80):
     """
     This function masks off the outer edge of the foil, since the edge complicates dirt particle counting
@@ -19,36 +83,17 @@ def maskEdge(img, thickness = 80):
         img = nparray of image,
         thickness = the number of pixels you want to take of the edge of the foil
                     Based on the image resolution, 1 micron ~= i pixel
+    The foil and its outline come from foilSegmentation.
     """
     #Load image
     image = img.copy()
-    # Apply a morphological closing to the image to remove small dark areas:
-    kernel = np.ones((3,3))
-    cimage = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
-    #Threshold and blur image for contour detection
-    blur2 = cv2.blur(cimage, (100,100))
-    ret,thresh2 = cv2.threshold(blur2,50,255,cv2.THRESH_BINARY)
-    # Put a black border around the thresholded image to prevent edge problems
-    thresh2 = cv2.copyMakeBorder(thresh2,5,5,5,5,cv2.BORDER_CONSTANT,value=0)
-    #Find the contours of the foil
-    can1 = cv2.Canny(thresh2, 50, 200)
-    contours,hierarchy = cv2.findContours(can1.copy(),cv2.RETR_TREE,cv2.CHAIN_APPROX_NONE)
-
-    # Isolate and draw the largest contour, which should be the outline of the foil
-    # Sort contours by size
-    contours = sorted(contours, key = cv2.contourArea, reverse = True)
-    # Largest contour should be the outer edge of foil
-    outercnt = contours[0]
-    #Create corresponding lists of contour areas and perimeters. 
-    #cntAreas = list()
-    #cntPerim = list()
+    thresh2, outercnt = foilSegmentation(img)
     #Black out the edges of the foil
     #Double the mask_thickness to get the thickness of the masking line. 
     mask_thickness = thickness*2
-    cv2.drawContours(image, [outercnt], -1, (0,255,0), mask_thickness)
-    cv2.drawContours(thresh2, [outercnt], -1, (0,255,0), mask_thickness)
-    # remove border from thresh2
-    thresh2 = thresh2[5:thresh2.shape[0]-5,5:thresh2.shape[1]-5]
+    if outercnt is not None:
+        cv2.drawContours(image, [outercnt], -1, (0,255,0), mask_thickness)
+        cv2.drawContours(thresh2, [outercnt], -1, (0,255,0), mask_thickness)
     # Return both the image and the foil area for the sake of future moly loss
     # approximations and for dirt counting.
     return image,thresh2
@@ -57,49 +102,60 @@ def maskEdge(img, thickness = 80):
 
 ####################################################################################
 	
-def makePoster(image,kern=6, KuSize=9,Gaus1=3,Gaus2=11,rsize=.1):
+def makePoster(image,kern=6, KuSize=9,Gaus1=3,Gaus2=11,rsize=.1,KuMaxMem=256,KuWorkers=None,
+               useCache=True):
     """
     This method takes the image of the foil and creates a smoothed Kuwahara image
     used to make the poster for regional thresholding.
+    The Kuwahara filter is run in tiled mode, using at most KuMaxMem megabytes
+    of scratch memory spread over KuWorkers threads (None = one per CPU).
+    Posters are kept in the poster cache (GenSIP.postercache), so asking for the
+    same poster again skips the filtering. useCache=False always filters.
     """
-    rsz = misc.imresize(image,rsize,interp='bicubic')
-    gr = cv2.GaussianBlur(rsz, (Gaus1,Gaus1),0)
-    kgr = Kuwahara(gr,KuSize)
-    kgr = kgr.astype(np.uint8) # Make sure the Kuwahara image is uint8 so it doesn't scale
-    rkgr = misc.imresize(kgr,(image.shape),interp='bicubic')
-    grkgr = cv2.GaussianBlur(rkgr, (Gaus2,Gaus2),0)
-    prkgr = posterfy(grkgr,kern)
-    return prkgr
+    def compute():
+        from scipy import misc
+        rsz = misc.imresize(image,rsize,interp='bicubic')
+        gr = cv2.GaussianBlur(rsz, (Gaus1,Gaus1),0)
+        kgr = Kuwahara(gr,KuSize,tiled=True,maxMemory=KuMaxMem,workers=KuWorkers)
+        kgr = kgr.astype(np.uint8) # Make sure the Kuwahara image is uint8 so it doesn't scale
+        rkgr = misc.imresize(kgr,(image.shape),interp='bicubic')
+        grkgr = cv2.GaussianBlur(rkgr, (Gaus2,Gaus2),0)
+        return posterfy(grkgr,kern)
+    if not useCache:
+        return compute()
+    # KuMaxMem and KuWorkers do not change the poster, so they are not in the key
+    params = {'kern':kern,'KuSize':KuSize,'Gaus1':Gaus1,'Gaus2':Gaus2,'rsize':rsize}
+    return cachedPoster('makePoster', image, params, compute)
 
 ####################################################################################
 
 ####################################################################################
 
-def posterfy(image,k_size=6):
+def posterfy(image,k_size=6,returnLabels=False):
     """
     Takes a gray image and sets all values within a given range to a single value
     this way we can divide up regions into primarily Pt, primarily Mo, dirt, or black
+    The bands are the 'smallfoils' preset of GenSIP.posterize, applied with a
+    single lookup table. If returnLabels is True, the region label image (see 
+    posterize.REGION_NAMES) is returned along with the poster.
     """
-    image_copy=image.copy()
-    image_copy=image_copy.astype(np.uint8)
-    blk=(image_copy<=4)
-    pleat=(5<=image_copy)&(image_copy<=75)
-    darkMo=(76<=image_copy)&(image_copy<=110)
-    Mo=(111<=image_copy)&(image_copy<=199)
-    Pt=(200<=image_copy)
-    image_copy[blk]=0
-    image_copy[pleat]=50
-    image_copy[darkMo]=85
-    image_copy[Mo]=150
-    image_copy[Pt]=255
-    #image_copy = maskEdge(image_copy,thickness=60)
     #Do a morphological opening step to eliminate the rough edges
     # I prefer opening over closing because it is more important to catch
     # all of the dark areas, as the Pt areas will have pretty sraightforward
     # threshold results
-    kernel = np.ones((k_size,k_size))
-    image_copy = cv2.morphologyEx(image_copy, cv2.MORPH_OPEN, kernel)
-    return image_copy
+    return posterizeLUT(image, 'smallfoils', k_size=k_size, returnLabels=returnLabels)
+
+####################################################################################
+
+####################################################################################
+
+def regionBlurs(image, gaussBlur=3):
+    """
+    Returns the Gaussian blurs of an image that regionalThresh and 
+    bigRegionalThresh threshold, as a dictionary keyed by kernel size: 5 for the
+    pleat and dark Mo regions, and gaussBlur for the rest.
+    """
+    return blurImage(image, (5,gaussBlur))
 
 ####################################################################################
 
@@ -117,6 +173,8 @@ def regionalThresh(ogimage,poster,p=8,d=28,m=55,pt=60,**kwargs):
     cut out so that only the dirt appears. This allows mh.label to count the dirt and not get
     thrown off by the foil outline. If the option "GetMask" is set to True, then regionalThresh
     also returns the image of the outline of the foil and all regions that are black (<5).
+    The Gaussian blurs of the image can be passed in with the 'blurs' kwarg (see 
+    regionBlurs) so that the Mo and dirt passes over one image share them.
     """
     gaussBlur=kwargs.get('gaussBlur',3)
     threshType=kwargs.get('threshType',0L)
@@ -124,48 +182,22 @@ def regionalThresh(ogimage,poster,p=8,d=28,m=55,pt=60,**kwargs):
     returnMask=kwargs.get('returnMask',0)
     Mask=kwargs.get('Mask',0)
     MoDirt=kwargs.get('MoDirt','dirt')
+    blurs=kwargs.get('blurs',None)
     
     if poster.shape != ogimage.shape:
         raise Exception("The poster is not the same shape as the original image.")
         return
-    Image = ogimage.astype(np.uint8)
     gPoster = poster.astype(np.uint8)
-    threshedImage = np.zeros((Image.shape),dtype=np.uint8)
-
-    # Create the images
-    blk = gPoster.copy()
-    pleat = gPoster.copy()
-    darkMo = gPoster.copy()
-    Mo = gPoster.copy()
-    Pt = gPoster.copy()
-    
-    # isolate various sections
-    blk[blk!=0]=1
-    pleat[pleat!=50]=0
-    darkMo[darkMo!=85]=0
-    Mo[Mo!=150]=0
-    Pt[Pt!=255]=0
-    
-    # mask the original image
-    pleatMask = cv2.GaussianBlur(Image, (5,5), 0)
-    pleatMask = (pleat/50)*pleatMask
-    darkMoMask = cv2.GaussianBlur(Image, (5,5), 0)
-    darkMoMask = (darkMo/85)*darkMoMask
-    MoMask = cv2.GaussianBlur(Image, (gaussBlur,gaussBlur), 0)
-    MoMask = (Mo/150)*MoMask
-    PtMask = cv2.GaussianBlur(Image, (gaussBlur,gaussBlur), 0)
-    PtMask = (Pt/255)*PtMask
+    blk = (gPoster!=0).astype(np.uint8)
     
-    # apply adjusted threshold
-    ret,pleat = cv2.threshold(pleatMask, p,255,threshType)
-    ret,darkMo = cv2.threshold(darkMoMask, d,255,threshType)
-    ret,MoMask = cv2.threshold(MoMask, m,255,threshType)
-    ret,PtMask = cv2.threshold(PtMask, pt,255,threshType)
-    # put it all together
-    threshedImage = np.add(threshedImage, pleat)
-    threshedImage = np.add(threshedImage, darkMo)
-    threshedImage = np.add(threshedImage, MoMask)
-    threshedImage = np.add(threshedImage, PtMask)
+    # Threshold each region of the poster at its own level, on the blurred image
+    # (see GenSIP.regionthresh)
+    threshedImage = regionThreshold(ogimage, gPoster,
+                                    {50:(p,5),                # pleat
+                                     85:(d,5),                # darkMo
+                                     150:(m,gaussBlur),       # Mo
+                                     255:(pt,gaussBlur)},     # Pt
+                                    threshType=threshType, blurs=blurs)
     
     # If using an external mask, apply it here:
     # Mask is assumed to be a binary image where black represents the areas to be
@@ -229,15 +261,8 @@ def getFoilArea(img, res, getAreaInSquaremm=False):
          - getAreaInSquaremm - If true, converts the getFoilArea from square microns
             to square millimeters.
     """
-    #Load image
-    image = img.copy()
-    # Apply a morphological closing to the image to remove small dark areas:
-    kernel = np.ones((3,3))
-    cimage = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
-    #Threshold and blur image for contour detection
-    blur2 = cv2.blur(cimage, (100,100))
-    ret,thresh2 = cv2.threshold(blur2,50,255,cv2.THRESH_BINARY)
-    thresh2 = cv2.copyMakeBorder(thresh2,5,5,5,5,cv2.BORDER_CONSTANT,value=0)
+    # The foil mask of foilSegmentation, shared with maskEdge
+    thresh2, outercnt = foilSegmentation(img)
     # Approximate foil area is the sum of the white pixels divided by 255 and the 
     # resolution. This method of calculating the area has a weak point of being 
     # dependent on the white pixels, rather than the outer contour of the foil. 
@@ -247,8 +272,7 @@ def getFoilArea(img, res, getAreaInSquaremm=False):
     # see GenSIP.py in version 2 or previous, or in the "Outdated" folder of this 
     # version. That algorithm had the problem of occasionally messing up the outer
     # contour and throwing off the Moly loss calculations. 
-    thresh2[thresh2!=0]=1
-    foilarea = np.sum(thresh2)*res
+    foilarea = np.count_nonzero(thresh2)*res
     if getAreaInSquaremm:
         # Convert the foilarea to square mm
         foilarea = float(foilarea)*10**-6
@@ -269,6 +293,9 @@ def show(*images, **kwargs):
                 for plt.imshow.
         - rows = 1 - designates numbers of rows to display the images on
     """
+    # matplotlib is slow to import, so only load it when something is shown
+    import matplotlib.pyplot as plt
+    import matplotlib.figure as mplfig
     # Get key word arguments:
     color = kwargs.get('color',"gray")
     rows = kwargs.get('rows',1)
@@ -298,8 +325,11 @@ def loadImg (path, flag=cv2.CV_LOAD_IMAGE_GRAYSCALE):
     """
     This is a function for loading images. It basically just solves an issue with 
     cv2.imread and raises an exception if the path is wrong and cv2 returns a NoneType 
-    rather than a numpy array.
+    rather than a numpy array. Also reads the maps that GenSIP.mapwriter writes
+    as packed bits (.npz).
     """
+    if path.endswith('.npz') and os.path.exists(path):
+        return loadPacked(path)
     image = cv2.imread(path, flag)
     if isinstance(image, type(None)):
     # check if image is an instance of type 'NoneType'
@@ -401,20 +431,26 @@ def convTime(t):
 
 ####################################################################################
 
-def checkMoDirt(MoDirt):
+def checkMoDirt(MoDirt, allowBoth=False):
     """
     Allows for several input options for MoDirt and converts them into a standard
     parameter 'mo' or 'dirt', and raises an exception if the input is invalid.
+    If allowBoth is True, 'both' (combined Mo and dirt analysis) is also allowed.
     """
     allowableMo = ("mo","moly","molybdenum","m")
     allowableDirt = ("dirt","d")
+    allowableBoth = ("both","b","modirt")
     if MoDirt.lower() in allowableMo:
         return 'mo'
     if MoDirt.lower() in allowableDirt:
         return 'dirt'
+    if allowBoth and MoDirt.lower() in allowableBoth:
+        return 'both'
     else:
-        raise Exception("\n MoDirt must be one of the following: \n"+\
-        str(allowableMo)+"\n - - - - - or - - - - - \n"+str(allowableDirt))
+        allowable = str(allowableMo)+"\n - - - - - or - - - - - \n"+str(allowableDirt)
+        if allowBoth:
+            allowable += "\n - - - - - or - - - - - \n"+str(allowableBoth)
+        raise Exception("\n MoDirt must be one of the following: \n"+allowable)
     
 
 ####################################################################################
@@ -1,6 +1,14 @@
 """
 This module contains class that handles all data writing and saving to csv
 file format for GenSIP.
+
+Long batch runs (animorf, analyzeSubImages, analyzeMoly) stream their rows: the
+column headers are written once, then one row is appended and flushed for every
+finished item, and a sidecar manifest (<csv file>.manifest) records the items
+that are done and where their rows end in the file. If a run stops, opening the
+same file again with resume=True keeps the finished rows, drops anything written
+after the last one (a half written row or an old footer), and the run only has
+to analyze the items that are not in the manifest.
 """
 import csv
 import GenSIP.functions as fun
@@ -13,13 +21,16 @@ from socket import gethostname
 
 class DataToCSV (object):
     
-    def __init__(self,filepath,title,mode='w+b'):
+    def __init__(self,filepath,title,mode='w+b',resume=False):
         """ Creates a CSV file. 
                 filepath - path of CSV file
                 title - a string denoting the test being run. For cleantests, this
                     is the sample set string. 
             Kwargs:
-                mode = 'w+b' - default set to allow writing."""
+                mode = 'w+b' - default set to allow writing.
+                resume = False - if True and the file has a streaming manifest
+                    (see startStream), the file is opened again with its 
+                    finished rows instead of being overwritten."""
         assert type(title)==str, "Title must be a string"
         if filepath.endswith('.csv'):
             self.path = filepath
@@ -28,10 +39,20 @@ class DataToCSV (object):
         else:
             raise Exception("Path must be a directory or .csv file: {0}".format(filepath))
         
-        self.CSVfile = open(self.path, mode)
-        self.dataWriter = csv.writer(self.CSVfile)
+        self.manifestPath = self.path+'.manifest'
         self.Title = title
         self.AllRows = []
+        self.colHeads = None # Column headers of the streamed rows
+        self.Done = []       # Names of the streamed rows, in order
+        self.DoneData = {}   # Entries of the rows found when resuming
+        self.manifest = None
+        
+        if resume and self.resumeStream():
+            return
+        if os.path.exists(self.manifestPath):
+            os.remove(self.manifestPath)
+        self.CSVfile = open(self.path, mode)
+        self.dataWriter = csv.writer(self.CSVfile)
         TitleRow = self.makeTitle(title)
         self.writeHeader(TitleRow)
 
@@ -150,10 +171,20 @@ class DataToCSV (object):
                     row.append(entry)
             Rows.append(row)
             
-        """Make the Footer"""
+        Rows.extend(self.makeFooter(dataDict, notItems))
+        self.dataWriter.writerows(Rows)
+        self.AllRows.extend(Rows)
+    
+    ###################################################################################
+    
+    def makeFooter(self, dataDict, notItems):
+        """
+        Returns the rows of the footer: a spacer row, then the entries of every
+        footer item (see writeDataFromDict) found in dataDict.
+        """
         # Separate the footer with a spacer row:
         spaceRow = ['']
-        Rows.append(spaceRow)
+        Rows = [spaceRow]
         # Make footer by iterating through the footer items 
         footerItems = [k for k in notItems if k in dataDict.keys()]
         for cat in footerItems:
@@ -167,12 +198,135 @@ class DataToCSV (object):
                 footerEntry = [dataDict[cat]]
                 FooterRows.append(footerEntry)
             Rows.extend(FooterRows)
+        return Rows
+        
+    ###################################################################################
+    
+    def startStream(self, colHeads):
+        """
+        Starts streaming rows with the column headers colHeads (the first one is
+        the header of the item names). Writes the header row, unless the file 
+        was resumed, in which case colHeads must match the headers in the file.
+        """
+        colHeads = list(colHeads)
+        if self.colHeads is not None:
+            if colHeads != self.colHeads:
+                raise Exception("The columns of {0} do not match: {1}".format(
+                                self.path, self.colHeads))
+            return
+        self.colHeads = colHeads
+        self.dataWriter.writerow(colHeads)
+        self.AllRows.append(colHeads)
+        self.CSVfile.flush()
+        self.manifest = open(self.manifestPath, 'wb')
+        self._markDone('')
+        
+    ###################################################################################
+    
+    def writeRow(self, name, entries):
+        """
+        Appends and flushes the row of the item 'name', with the values of the
+        dictionary 'entries' in the order of the streamed column headers, and 
+        adds the item to the manifest.
+        """
+        row = ["'"+name]
+        for col in self.colHeads[1:]:
+            row.append(entries.get(col,"'--"))
+        self.dataWriter.writerow(row)
+        self.AllRows.append(row)
+        self.CSVfile.flush()
+        self.Done.append(name)
+        self._markDone(name)
+        
+    ###################################################################################
+    
+    def isDone(self, name):
+        """Returns True if the row of the item 'name' has already been streamed"""
+        return name in self.DoneData or name in self.Done
+        
+    ###################################################################################
+    
+    def writeFooter(self, dataDict, **kwargs):
+        """
+        Writes the footer after the streamed rows. The footer is not in the 
+        manifest, so resuming the file removes it again.
+        Key-Word Arguments:
+            - footerItems = ["TOTALS","TOTAL"] - see writeDataFromDict
+        """
+        notItems = kwargs.get('footerItems',["TOTALS","TOTAL"])
+        Rows = self.makeFooter(dataDict, notItems)
         self.dataWriter.writerows(Rows)
         self.AllRows.extend(Rows)
+        self.CSVfile.flush()
+        
+    ###################################################################################
+    
+    def resumeStream(self):
+        """
+        Opens the file again from its manifest. Returns False if there is no 
+        usable manifest. Otherwise the file is cut after the last finished row, 
+        and the finished rows are read back into DoneData, as dictionaries of 
+        column header to entry (numbers are converted back from strings).
+        """
+        if not (os.path.exists(self.manifestPath) and os.path.exists(self.path)):
+            return False
+        with open(self.manifestPath, 'rb') as f:
+            lines = f.read().split('\n')[:-1] # A last line without '\n' is unfinished
+        if len(lines) == 0:
+            return False
+        names = [line.split('\t',1)[1] for line in lines]
+        rowsEnd = int(lines[-1].split('\t',1)[0])
+        if os.path.getsize(self.path) < rowsEnd:
+            return False
+        
+        self.CSVfile = open(self.path, 'r+b')
+        self.CSVfile.truncate(rowsEnd)
+        self.CSVfile.seek(0)
+        Rows = list(csv.reader(self.CSVfile))
+        # The title and info rows, the spacer row, the column headers and then 
+        # one row for every item after the first line of the manifest
+        if names[0] != '' or len(Rows) != 6+len(names)-1:
+            self.CSVfile.close()
+            return False
+        self.colHeads = Rows[5]
+        for name, row in zip(names[1:], Rows[6:]):
+            self.DoneData[name] = dict([(col, _parseEntry(entry)) for col, entry 
+                                        in zip(self.colHeads[1:], row[1:])
+                                        if entry != "'--"])
+        self.AllRows = Rows
+        self.CSVfile.seek(0, os.SEEK_END)
+        self.dataWriter = csv.writer(self.CSVfile)
+        with open(self.manifestPath, 'wb') as f:
+            f.write(''.join([line+'\n' for line in lines]))
+        self.manifest = open(self.manifestPath, 'ab')
+        return True
+        
+    ###################################################################################
     
+    def _markDone(self, name):
+        # One manifest line per finished row: the end of the row in the CSV
+        # file, then the name of the item. Written after the row is flushed.
+        self.manifest.write(str(self.CSVfile.tell())+'\t'+name+'\n')
+        self.manifest.flush()
+        
     ###################################################################################
     
     def closeCSVFile(self):
         """Closes the CSV file"""
         self.CSVfile.close()
+        if self.manifest is not None:
+            self.manifest.close()
+
+###################################################################################
+
+###################################################################################
+
+def _parseEntry(entry):
+    # Numbers are written with repr (str for integers), so they read back the same
+    for convert in (int, float):
+        try:
+            return convert(entry)
+        except ValueError:
+            pass
+    return entry
         
\ No newline at end of file
@@ -5,6 +5,7 @@ because these functions all produce or deal with binary images.
 Functions include:
    floodByThresh
    floodBySeed 
+   floodFrontier
    FloodStep
    threshold
    easythreshold
@@ -12,7 +13,7 @@ Functions include:
 
 import numpy as np
 
-def floodByThresh(img, min0, max0, d, upBound, lowBound, growthMin=0, growthMax=10000):
+def floodByThresh(img, min0, max0, d, upBound, lowBound, growthMin=0, growthMax=10000, verbose=False):
     """ 
     A Floodfill algorithm that takes an image and, starting with all the pixels 
     in a certain range, expands those regions to take in pixels with a similar 
@@ -36,20 +37,12 @@ def floodByThresh(img, min0, max0, d, upBound, lowBound, growthMin=0, growthMax=
          - growthMax - the maximum number of pixels that the Flooder is allowed 
             to grow in one step. Once the growth in a step is >= growthMax, the 
             Flooder stops. Prevents the flooder from incoporating all 
+         - verbose - print the growth of every step
 
     """
-    if growthMin < 0:
-        raise Exception("Minimum growth level must be 0 or positive.")
     ret = threshold(img, min0,max0,Binary=True,Bool=True)
-    growth = growthMin+1
-    i = 1
-    while (growthMin<growth<growthMax):
-        print "Step #" + str(i) + ":"
-        ret, growth = FloodStep(img, ret, d, upBound, lowBound, growthMin, growthMax)
-        i += 1
-        if i == 100:
-            break
-    return ret
+    return floodFrontier(img, ret, d, upBound, lowBound, growthMin=growthMin,
+                         growthMax=growthMax, maxSteps=99, verbose=verbose)
 
 def floodBySeed(img, seed, d, upBound, lowBound, growthMin=0, growthMax=10000, verbose=False):
     """ 
@@ -74,21 +67,67 @@ def floodBySeed(img, seed, d, upBound, lowBound, growthMin=0, growthMax=10000, v
          - growthMax - the maximum number of pixels that the Flooder is allowed 
             to grow in one step. Once the growth in a step is >= growthMax, the 
             Flooder stops. Prevents the flooder from incoporating all 
+         - verbose - print the growth of every step
+
+    """
+    return floodFrontier(img, seed, d, upBound, lowBound, growthMin=growthMin,
+                         growthMax=growthMax, maxSteps=999, verbose=verbose)
 
+def floodFrontier(img, seed, d, upBound, lowBound, growthMin=0, growthMax=10000, 
+                  maxSteps=999, verbose=False):
+    """
+    The flooding engine of floodBySeed and floodByThresh. Does the steps of 
+    FloodStep until the growth of a step is <= growthMin or >= growthMax, or 
+    maxSteps steps are done, and returns the flooded image (np.bool_).
+    
+    Whether a seed pixel floods a neighbor only depends on their values and on 
+    the neighbor not being flooded yet, so a pixel that did not flood one of its
+    neighbors in a step never will. Only the frontier (the pixels flooded in the
+    last step) is looked at in every step, instead of all the flooded pixels of
+    the image. The growth of a step is counted like FloodStep counts it: once 
+    for every pair of a frontier pixel and a neighbor it floods.
     """
     if growthMin < 0:
         raise Exception("Minimum growth level must be 0 or positive.")
-    ret = seed.copy()
+    rows, cols = img.shape[:2]
+    ret = seed.astype(np.bool_)
+    fi, fj = np.nonzero(ret)
+    neighbors = [(di, dj) for di in (-1,0,1) for dj in (-1,0,1) if (di,dj)!=(0,0)]
     growth = growthMin+1
-    i = 1
-    while (growthMin<growth<growthMax):
+    step = 0
+    while (growthMin<growth<growthMax) and step<maxSteps:
+        step += 1
+        if verbose:
+            print "Step #" + str(step) + ":"
+        selfVals = img[fi,fj].astype(np.int)
+        growth = 0
+        newI, newJ = [], []
+        for di, dj in neighbors:
+            ineigh = fi+di
+            jneigh = fj+dj
+            # Neighbors inside the image that are not flooded yet
+            keep = (ineigh>=0)&(jneigh>=0)&(ineigh<rows)&(jneigh<cols)
+            ineigh, jneigh, vals = ineigh[keep], jneigh[keep], selfVals[keep]
+            keep = ~ret[ineigh,jneigh]
+            ineigh, jneigh, vals = ineigh[keep], jneigh[keep], vals[keep]
+            neighVals = img[ineigh,jneigh]
+            # The absolute difference, back in uint8 like FloodStep
+            absdiff = np.absolute(vals-neighVals.astype(np.int)).astype(np.uint8)
+            quals = (absdiff<=d)&(neighVals<=upBound)&(neighVals>=lowBound)
+            growth += np.count_nonzero(quals)
+            newI.append(ineigh[quals])
+            newJ.append(jneigh[quals])
+        # The newly flooded pixels are the frontier of the next step
+        flat = np.unique(np.concatenate(newI)*cols+np.concatenate(newJ))
+        fi, fj = flat//cols, flat%cols
+        ret[fi,fj] = True
         if verbose:
-            print "Step #" + str(i) + ":"
-        ret, growth = FloodStep(img, ret, d, upBound, lowBound, \
-        growthMin=growthMin, growthMax=growthMax, verbose=verbose)
-        i += 1
-        if i == 1000:
-            break
+            print "  Growth: " + str(growth)
+            print "  Less than max? " + str(growth<growthMax)
+            print "  More than min? " + str(growth>growthMin)
+    if step == 0:
+        # No step was done, as in the old loop
+        return seed.copy()
     return ret
 
 def FloodStep(img, seed, d, upBound, lowBound, growthMin=0, growthMax=1000, verbose=False):
@@ -4,7 +4,6 @@ Contains all the functions used by Histograms to analyze data on the plots
 
 """
 import numpy as np
-from math import copysign
 
 
     
@@ -26,25 +25,27 @@ def atFWHM(histo, peakVal):
     on a histogram. Does not subtract the backround.
     
     """
-    MAX = histo[peakVal]
-    HalfMax = MAX/2
-    colors = np.arange(0,histo.size,1)
-    for i in colors[::-1][histo.size-peakVal:]:
-        if histo[i]<HalfMax:
-            HM1 = i
-            break
-    else:
-        HM1=None
-        #raise Exception("No first half-maximum.")
-    
-    for i in colors[peakVal:]:
-        if histo[i]<HalfMax:
-            HM2 = i
-            break
-    else:
-        HM2=None
-        #raise Exception("No second half-maximum.")
+    HM1, HM2 = fwhmBounds(np.asarray(histo)[None], [peakVal])
+    HM1 = int(HM1[0]) if HM1[0] >= 0 else None # No first half-maximum
+    HM2 = int(HM2[0]) if HM2[0] >= 0 else None # No second half-maximum
     return (HM1,HM2)
+
+def fwhmBounds(histos, peaks):
+    """
+    atFWHM for every row of a (rows x bins) array of histograms at once: the 
+    last color below peaks[row] and the first from peaks[row] up that are below
+    half of the peak. Returns two arrays, with -1 where there is none.
+    """
+    histos = np.asarray(histos)
+    rows = np.arange(len(histos))
+    peaks = np.asarray(peaks, dtype=np.intp)
+    below = histos < (histos[rows,peaks]/2)[:,None]
+    colors = np.arange(histos.shape[1])
+    left = below & (colors < peaks[:,None])
+    right = below & (colors >= peaks[:,None])
+    HM1 = np.where(left.any(axis=1), histos.shape[1]-1-left[:,::-1].argmax(axis=1), -1)
+    HM2 = np.where(right.any(axis=1), right.argmax(axis=1), -1)
+    return HM1, HM2
     
 def nsmooth(a, i=4, n=3):
     ret = a.copy()
@@ -87,64 +88,104 @@ def runningMeanFast(x, N):
     return np.convolve(x, np.ones((N,))/N)[(N-1):]
     
 def getMaxima(a, smoonum=4):
-    smoo = a.copy()
-    for i in range(smoonum):
-        smoo = smoothed(smoo)
-    grad = np.gradient(smoo)
-    Zx,Zy = getZeroes(grad)
-    concav = np.gradient(grad)
-    retX,retY = [],[]
-    for x in Zx:
-        if concav[x]<0:
-            retX.append(x)
-            retY.append(a[x])
-    return retX,retY
+    feats = histFeatures(np.asarray(a)[None], smoonum)
+    retX = feats['Peaks'][0].tolist()
+    return retX,[a[x] for x in retX]
 
 def getMinima(a, smoonum=4):
-    smoo = a.copy()
-    for i in range(smoonum):
-        smoo = smoothed(smoo)
-    grad = np.gradient(smoo)
-    Zx,Zy = getZeroes(grad)
-    concav = np.gradient(grad)
-    retX,retY = [],[]
-    for x in Zx:
-        if concav[x]>0:
-            retX.append(x)
-            retY.append(a[x])
-    return retX,retY
+    feats = histFeatures(np.asarray(a)[None], smoonum)
+    retX = feats['Valleys'][0].tolist()
+    return retX,[a[x] for x in retX]
     
 def getInflectionPoints(a, smoonum=4,sign='negative'):
-    smoo = a.copy()
+    feats = histFeatures(np.asarray(a)[None], smoonum)
+    if sign=='negative':
+        retX = feats['NegInfl'][0].tolist()
+    elif sign=='positive':
+        retX = feats['PosInfl'][0].tolist()
+    else:
+        retX = np.flatnonzero(_zeroes(feats['Concavity'])[0]).tolist()
+    return retX,[a[x] for x in retX]
+
+def getZeroes(a):
+    a = np.asarray(a)
+    x = np.flatnonzero(_zeroes(a[None])[0]).tolist()
+    return x,[a[i] for i in x]
+
+"""
+______________________
+BATCH FEATURE EXTRACTOR\_______________________________________________________
+
+ histFeatures finds the features of all the rows of a (rows x 256) matrix of 
+histograms (the regions of an image, or of all the sub-images of a panorama) 
+in a few passes over the whole matrix. The histograms are smoothed once, and 
+the peaks, valleys and inflection points all come from that. The arithmetic 
+is the same as the one of smoothed and np.gradient on one histogram, to the 
+last bit, so the features are the same as the ones getMaxima, getMinima and 
+getInflectionPoints find: a feature of a smoothed histogram is where a 
+gradient is zero or changes sign, and a change in the last bit of the float
+can move it.
+"""
+
+def smoothedRows(a, smoonum=1):
+    """
+    Applies smoothed smoonum times to every row of a (rows x 256) array.
+    """
+    ret = np.asarray(a)
     for i in range(smoonum):
-        smoo = smoothed(smoo)
-    concav = 10*np.gradient(np.gradient(smoo))
-    Zx,Zy = getZeroes(concav)
-    aberr = np.gradient(concav)
-    retX,retY = [],[]
+        # movingAverage along the rows (cumsum adds in order, like on one row)
+        mA = np.cumsum(ret, axis=1, dtype=float)
+        mA[:,3:] = mA[:,3:]-mA[:,:-3]
+        smoo = np.zeros(ret.shape)
+        smoo[:,0] = ret[:,0]
+        smoo[:,255] = ret[:,255]
+        smoo[:,1:255] = mA[:,2:]/3
+        ret = smoo
+    return ret
 
-    for x in Zx:
-        if sign=='negative':
-            if aberr[x]<0:
-                retX.append(x)
-                retY.append(a[x])
-        elif sign=='positive':
-             if aberr[x]>0:
-                retX.append(x)
-                retY.append(a[x])
-        else:
-            retX.append(x)
-            retY.append(a[x])
-    return retX,retY
+def _zeroes(a):
+    # getZeroes of every row: a[i] is 0, or a[i+1] has the other sign
+    z = np.zeros(a.shape, dtype=np.bool_)
+    z[:,:-1] = (a[:,:-1]==0)|(np.copysign(a[:,:-1], a[:,1:])!=a[:,:-1])
+    return z
 
-def getZeroes(a):
-    x,y = [],[]
-    for i in range(a[0:-1].size):
-        if a[i] == 0:
-            x.append(i)
-            y.append(a[i])
-        elif copysign(a[i],a[i+1])!=a[i]:
-            x.append(i)
-            y.append(a[i])
-    return x,y
+def _rowGradient(a):
+    # np.gradient of every row, like on one row: central differences, and one
+    # sided ones at the ends. (np.gradient only takes an axis since numpy 1.11)
+    g = np.empty(a.shape)
+    g[:,1:-1] = (a[:,2:]-a[:,:-2])/2.
+    g[:,0] = a[:,1]-a[:,0]
+    g[:,-1] = a[:,-1]-a[:,-2]
+    return g
+
+def histFeatures(histos, smoonum=4):
+    """
+    Finds the features of every row of a (rows x 256) array of histograms, 
+    after smoothing them smoonum times. Returns a dictionary of lists with one
+    array of colors per row:
+        'Peaks' - the maxima (getMaxima)
+        'Valleys' - the minima (getMinima)
+        'NegInfl', 'PosInfl' - the inflection points with a negative and a
+            positive third derivative (getInflectionPoints)
+    and the arrays 'Smoothed' and 'Concavity' (ten times the second derivative
+    of the smoothed histograms).
+    """
+    smoo = smoothedRows(histos, smoonum)
+    grad = _rowGradient(smoo)
+    concav = _rowGradient(grad)
+    gradZeroes = _zeroes(grad)
+    concav10 = 10*concav
+    aberr = _rowGradient(concav10)
+    concavZeroes = _zeroes(concav10)
+    masks = {'Peaks':gradZeroes&(concav<0),
+             'Valleys':gradZeroes&(concav>0),
+             'NegInfl':concavZeroes&(aberr<0),
+             'PosInfl':concavZeroes&(aberr>0)}
+    feats = {'Smoothed':smoo, 'Concavity':concav10}
+    for name in masks:
+        rows, colors = np.nonzero(masks[name])
+        # np.nonzero goes through the rows in order
+        splits = np.searchsorted(rows, np.arange(1, len(smoo)))
+        feats[name] = np.split(colors, splits)
+    return feats
                      
\ No newline at end of file
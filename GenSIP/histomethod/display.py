@@ -1,7 +1,6 @@
 """
 Contains functions for saving and displaying data used in histogram analysis
 """
-import matplotlib.pyplot as plt
 import numpy as np
 import GenSIP.histomethod.datatools as dat
 import GenSIP.histomethod.histogram_tools as hist
@@ -9,6 +8,7 @@ import os
 
 
 def saveHist(Data,path,name='foil'):
+    import matplotlib.pyplot as plt # Only loaded when a plot is made
     FIG=plt.figure()
     PLT = FIG.add_subplot(111)
     FIG.suptitle(name+" Histograms")
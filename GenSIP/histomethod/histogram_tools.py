@@ -7,6 +7,137 @@ HISTOGRAMS MODULE\______________________________________________________________
 import numpy as np
 import GenSIP.histomethod.datatools as dat
 
+# The regions of mainanalysis.MakeRegions, and their gray levels in a poster
+REGION_NAMES = ['blk','pleat','darkMo','Mo','highEx','Plat']
+REGION_LEVELS = [0,50,85,150,200,255]
+
+"""
+________________
+HISTOGRAM ENGINE\_______________________________________________________________
+
+ The 256-bin histograms of np.histogram(img,256,(0,255)) have one bin per pixel
+value, so for uint8 images they are np.bincount of the pixels. regionHistograms
+counts the histograms of all the regions of an image in the same bincount pass,
+and the max, min, mean and Mo peak of a region are read from its histogram 
+instead of from the pixels of the region.
+"""
+
+def imageHistogram(img):
+    """
+    Returns the 256-bin histogram of a uint8 image (the counts of 
+    np.histogram(img,256,(0,255))).
+    """
+    return np.bincount(np.asarray(img, dtype=np.uint8).ravel(), minlength=256)
+
+def regionHistograms(img, labels, numLabels):
+    """
+    Returns the 256-bin histograms of the regions of a uint8 image, all in one 
+    pass, as an array of shape (numLabels, 256): row i is the histogram of the 
+    pixels whose label is i. Pixels with a label of numLabels or more are not 
+    counted.
+    """
+    labels = np.minimum(labels.ravel(), numLabels).astype(np.intp)
+    labels *= 256
+    labels += np.asarray(img, dtype=np.uint8).ravel()
+    counts = np.bincount(labels, minlength=(numLabels+1)*256)
+    return counts[:numLabels*256].reshape(numLabels, 256)
+
+def regionLabels(poster):
+    """
+    Returns the region label image of a poster: the index of the region of 
+    every pixel in REGION_LEVELS (0 to 5), or 6 if it is in none of them.
+    """
+    lut = np.empty(256, dtype=np.uint8)
+    lut.fill(6)
+    lut[REGION_LEVELS] = range(6)
+    return lut[np.asarray(poster, dtype=np.uint8)]
+
+def posterHistograms(img, poster, Mask=None, labels=None):
+    """
+    Histograms of the regions of a poster (see REGION_LEVELS) in one pass. 
+    Returns two arrays of shape (6, 256): the histograms of the pixels of every
+    region that are not masked off (Mask==0), and of all the pixels of every
+    region. The region label image of the poster can be passed in with 
+    'labels' if it is already made (see regionLabels).
+    """
+    if labels is None:
+        labels = regionLabels(poster)
+    labels = labels.astype(np.intp)
+    labels[labels==6] = 12
+    if Mask is not None:
+        # The masked off pixels of region i are counted as label i+6
+        labels[(labels<6)&(Mask==0)] += 6
+    histos = regionHistograms(img, labels, 12)
+    return histos[:6], histos[:6]+histos[6:]
+
+def histStats(histo):
+    """
+    Returns the max, min and mean pixel value of the pixels that a 256-bin 
+    histogram counts (the same as np.max, np.min and int(np.mean) of the 
+    pixels), or None if it is empty.
+    """
+    values = np.flatnonzero(histo)
+    if values.size == 0:
+        return None
+    MEAN = int(float(np.dot(np.arange(histo.size), histo))/histo.sum())
+    return np.uint8(values[-1]), np.uint8(values[0]), MEAN
+
+def coarseHistogram(histo):
+    """
+    The 32-bin histogram (np.histogram(img,32,(0,255))) of the pixels that a 
+    256-bin histogram counts: the bins of 32 are 8 pixel values wide.
+    """
+    return histo.reshape(32, 8).sum(axis=1)
+
+def findMoPeakByHist(counts):
+    """
+    The Mo peak of findMoPeakByImg, from the 256-bin histogram of the image.
+    """
+    M = coarseHistogram(counts).argmax()*8
+    return int(counts[M:M+8].argmax()+M)
+
+def regionData(histos, fullHistos):
+    """
+    Returns the regions dictionary of mainanalysis.MakeRegions (without the 
+    labels and areas of the regions) from the histograms of posterHistograms: the 
+    region name is the key of a dictionary with the histogram, max, min, mean,
+    Mo peak and the features of the histogram (see datatools.histFeatures), or 
+    'Null' if the region has no pixels. 
+    histos and fullHistos can also be of shape (images, 6, 256), for the regions
+    of many images (e.g. all the sub images of a panorama): the features of all 
+    of them are found at once, and a list of the dictionaries is returned.
+    """
+    histos = np.asarray(histos)
+    fullHistos = np.asarray(fullHistos)
+    if histos.ndim == 2:
+        return regionData(histos[None], fullHistos[None])[0]
+    # Smoothed once with datatools.smoothed and then 6 times more, like before
+    feats = dat.histFeatures(histos.reshape(-1, 256), smoonum=7)
+    allRegions = []
+    for n in range(len(histos)):
+        regions = {}
+        for i in range(6):
+            row = n*6+i
+            regStats = histStats(fullHistos[n,i])
+            if regStats is None:
+                # if no pixels are labeled as part of a particular region, the
+                # value of that region in the regions dictionary is 'Null'.
+                regions[REGION_NAMES[i]] = 'Null'
+                continue
+            # The maximum, minimum, mean pixel value of the region
+            MAX, MIN, MEAN = regStats
+            regions[REGION_NAMES[i]] = {
+            'GrayLevel':REGION_LEVELS[i],
+            'Histogram':histos[n,i],
+            'Max':MAX,'Min':MIN,
+            'Mean':MEAN,'MoPeak':findMoPeakByHist(fullHistos[n,i]),
+            'Peaks':feats['Peaks'][row].astype(np.uint8),
+            'Valleys':feats['Valleys'][row].astype(np.uint8),
+            'NegInfl':feats['NegInfl'][row].astype(np.uint8),
+            'PosInfl':feats['PosInfl'][row].astype(np.uint8)}
+        allRegions.append(regions)
+    return allRegions
+
 
 def selectDirtThresh(sectData):
     Histogram = sectData['Histogram']
@@ -76,7 +207,7 @@ def selectPtThresh(sectData):
 def IDPeaks(img):
     #PtMax = np.max(img)
     #DirtCrackMin = np.min(img)
-    MoX, histo = findMoPeakByImg(img)
+    MoX, histo = findMoPeakByImg(img, returnHist=True)
     #x = np.arange(256)
     PksX,PksY = dat.getMaxima(histo)
     ValX,ValY = dat.getMinima(histo)
@@ -109,7 +240,7 @@ THRESHOLDING OPERATIONS\________________________________________________________
     
         
 def threshMo(img):
-    peakVal, histo = findMoPeakByImg(img)
+    peakVal, histo = findMoPeakByImg(img, returnHist=True)
     MIN,MAX = dat.atFWHM(histo,peakVal)
     thresh = dat.easyThresh(img,MIN,MAX,Binary=True)
     return thresh
@@ -129,18 +260,14 @@ def findMoPeakByImg(img, returnHist = False):
     # Therefore, I first take the histogram of the image with 32 sections of 8 pixel-values
     # each, and then I determine which of those 32 sections has the highest count value.
     # Then I look for the maximum value within that section in a histogram divided into 256 
-    parts, and that is the peak value. 
+    parts, and that is the peak value. Both histograms come from one bincount
+    of the image (see findMoPeakByHist).
     """
-    histo = np.histogram(img,256,(0,255))
-    histo8 = np.histogram(img,32,(0,255))
-    counts = histo[0]
-    #Smoothed = dat.smoothed(counts)
-    
-    #widths = np.ones(Smoothed.shape)
-    
-    M = histo8[0].argmax()*8
-    firstPeak = counts[M:M+8].argmax()+M
-    firstPeak = int(firstPeak)
+    if np.asarray(img).dtype == np.uint8:
+        counts = imageHistogram(img)
+    else:
+        counts = np.histogram(img,256,(0,255))[0]
+    firstPeak = findMoPeakByHist(counts)
     if returnHist:
         return firstPeak,counts
     else:
@@ -11,41 +11,60 @@ import GenSIP.functions as fun
 import GenSIP.kuwahara as Kuwahara
 import GenSIP.bigscans.images as images
 import GenSIP.histomethod.histogram_tools as hist
-import GenSIP.histomethod.datatools as dat
 import GenSIP.histomethod.binaryops as binops
 import GenSIP.measure as meas
+from GenSIP.postercache import cachedPoster
 import GenSIP.histomethod.foldertools as fold
 import GenSIP.histomethod.display as dis
+import GenSIP.pipeline as pipe
+import GenSIP.mapwriter as mapwriter
+from GenSIP.bigscans.tilesource import TileSource
 
 import os
 
 
 
 def runOnSubImgs(folderpath, maskPath, res, name, writeToCSV=True,
-                 genPoster = False, exten='.tif', verbose=True, genResults=True):
-    """
-    Runs newmethod analyzeImg on a folder of sub images.
-    
-    """
-    subImgs = os.listdir(folderpath)
-    subImgs = fold.FILonlySubimages(subImgs)
-    masks = os.listdir(maskPath)
-    masks = fold.FILonlySubimages(masks)
-    subImgs.sort()
-    masks.sort()
-    if not(folderpath.endswith('/')):
-        folderpath = folderpath+'/'
-    if not(maskPath.endswith('/')):
-        maskPath = maskPath+'/'
-    subNames = [i.strip(exten) for i in subImgs]
-    for sub in subImgs:
-        # Make the paths complete
-        subImgs[subImgs.index(sub)] = folderpath+sub
-        
-        try: masks[masks.index(sub)] = maskPath+sub
-        except: 
-            print sub, maskPath
-            return
+                 genPoster = False, exten='.tif', verbose=True, genResults=True,
+                 pipeline=True, mapFormat='png'):
+    """
+    Runs analyzeByHisto on a folder of sub images. With pipeline=True the
+    next sub images are decoded and the maps of the previous ones are written
+    on background threads while a sub image is analyzed (see GenSIP.pipeline).
+    mapFormat is the file format of the maps and posters (see GenSIP.mapwriter).
+    folderpath can also be a TileSource (see GenSIP.bigscans.tilesource), which
+    reads the sub images and their masks from the panorama; maskPath is then
+    not used. The areas of analyzeByHisto are measured on the whole image it 
+    is given, so the TileSource cannot have a halo.
+    
+    """
+    if isinstance(folderpath, TileSource):
+        tiles = folderpath
+        if tiles.halo:
+            raise Exception("runOnSubImgs measures the whole sub image, so the "
+                            "TileSource cannot have a halo.")
+        subNames = tiles.names()
+    else:
+        tiles = None
+        subImgs = os.listdir(folderpath)
+        subImgs = fold.FILonlySubimages(subImgs)
+        masks = os.listdir(maskPath)
+        masks = fold.FILonlySubimages(masks)
+        subImgs.sort()
+        masks.sort()
+        if not(folderpath.endswith('/')):
+            folderpath = folderpath+'/'
+        if not(maskPath.endswith('/')):
+            maskPath = maskPath+'/'
+        subNames = [i.strip(exten) for i in subImgs]
+        for sub in subImgs:
+            # Make the paths complete
+            subImgs[subImgs.index(sub)] = folderpath+sub
+            
+            try: masks[masks.index(sub)] = maskPath+sub
+            except: 
+                print sub, maskPath
+                return
             
     outFolders = ["Output/"+name,
                   "Output/"+name+"/DirtMaps",
@@ -56,26 +75,34 @@ def runOnSubImgs(folderpath, maskPath, res, name, writeToCSV=True,
         outFolders=outFolders[:-1]
     for f in outFolders:
         if not(os.path.exists(f)):
-            os.mkdir(f)
+            os.makedirs(f)
     # initiate results dictionary.
     Results = {}
-    for i in range(len(subNames)):
+    
+    def loadSub(i):
+        # Decode stage
+        if tiles is not None:
+            return tiles.tile(subNames[i])
+        return fun.loadImg(subImgs[i]), fun.loadImg(masks[i])
+        
+    def analyzeSub(i, loaded):
+        # Compute stage
         if verbose: print subNames[i]
-        img = fun.loadImg(subImgs[i])
-        mask = fun.loadImg(masks[i])
+        img, mask = loaded
+        stats, picts = analyzeByHisto(img, res, Mask=mask, verbose=verbose, 
+                                      MoDirt='both', returnPoster=genPoster,
+                                      returnData=True)
+        (PtArea, PercPt, dirtNum, dirtArea, dirtSizes, FoilArea, Data) = stats
+        PtMap, DirtMap = picts[:2]
         if genPoster:
-            PtMap, DirtMap, Data, post = analyzeImg(img,res,returnPoster=True,Mask=mask,verbose=verbose)
-            cv2.imwrite("Output/"+name+"/PosterMaps/"+subNames[i]+".png",
-                        post, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+            post = picts[2]
         else:
-            PtMap, DirtMap, Data = analyzeImg(img,res,returnPoster=False,Mask=mask,verbose=verbose)
-        # Remove the results from the Data dictionary and put them in the results
-        # Dictionary. If the Data dictionary somehow does not have one of the results,
-        # that entry in the Results dictionary is set to "ERROR".
+            post = None
+        # Put the results in the Results dictionary
         Results[subNames[i]]={}
-        Results[subNames[i]]['PtArea'] = Data.pop('PtArea',"ERROR")
-        Results[subNames[i]]['dirtArea'] = Data.pop('dirtArea',"ERROR")
-        Results[subNames[i]]['dirtNum'] = Data.pop('dirtNum',"ERROR")
+        Results[subNames[i]]['PtArea'] = PtArea
+        Results[subNames[i]]['dirtArea'] = dirtArea
+        Results[subNames[i]]['dirtNum'] = dirtNum
         '''
         for reg in Data[subNames[i]]:
             Results[subNames[i]][reg] = {}
@@ -83,20 +110,33 @@ def runOnSubImgs(folderpath, maskPath, res, name, writeToCSV=True,
             Results[subNames[i]][reg]['DirtThresh'] = Data.get('DirtThresh',"ERROR")
             Results[subNames[i]][reg]['MoPeak'] = Data.get('MoPeak',"ERROR")
         '''
+        # matplotlib stays on this thread
         dis.saveHist(Data, "Output/"+name, name=subNames[i])
+        return PtMap, DirtMap, post
         
-        cv2.imwrite("Output/"+name+"/DirtMaps/"+subNames[i]+".png",
-                    DirtMap.astype(np.uint8)*255, 
-                    [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
-        cv2.imwrite("Output/"+name+"/PtMaps/"+subNames[i]+".png",
-                    PtMap.astype(np.uint8)*255, 
-                    [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+    def saveSub(i, maps):
+        # Encode stage
+        PtMap, DirtMap, post = maps
+        if genPoster:
+            mapwriter.writeMap("Output/"+name+"/PosterMaps/", subNames[i], post, 
+                               mapFormat, binary=False)
+        mapwriter.writeMap("Output/"+name+"/DirtMaps/", subNames[i], 
+                           DirtMap.astype(np.uint8)*255, mapFormat)
+        mapwriter.writeMap("Output/"+name+"/PtMaps/", subNames[i], 
+                           PtMap.astype(np.uint8)*255, mapFormat)
                     
-    images.stitchImage("Output/"+name+"/DirtMaps")
-    images.stitchImage("Output/"+name+"/PtMaps")
+    stats = pipe.runPipeline(range(len(subNames)), loadSub, analyzeSub, saveSub,
+                             threaded=pipeline)
+    if verbose: print stats.report()
     
-    if genPoster:
-        images.stitchImage("Output/"+name+"/PosterMaps")
+    mapExt = mapwriter.formatExt(mapFormat)
+    if mapExt is not None:
+        images.stitchImage("Output/"+name+"/DirtMaps", imgType=mapExt)
+        images.stitchImage("Output/"+name+"/PtMaps", imgType=mapExt)
+    
+    if genPoster and mapExt is not None:
+        images.stitchImage("Output/"+name+"/PosterMaps", 
+                           imgType=mapwriter.formatExt(mapFormat, binary=False))
     if genResults: return Results
             
 
@@ -190,7 +230,7 @@ def getFoilArea (Data):
     """
     areaSum = 0
     for reg in Data:
-        areaSum += Data[reg]['RegMask'].sum()
+        areaSum += Data[reg]['RegArea']
     return areaSum
         
         
@@ -212,6 +252,12 @@ def PosterPreProc(image,**kwargs):
             rsize = .1 - Resize value
             Kuw_only = False - Option to only return the Kuwahara filtered image
             ExcludeDirt = True - Option to Exclude dirt 
+            KuMaxMem = 256 - Scratch memory limit of the tiled Kuwahara filter,
+                in megabytes
+            KuWorkers = None - Number of threads for the tiled Kuwahara filter.
+                None uses one per CPU.
+            useCache = True - Option to look the image up in the poster cache
+                (GenSIP.postercache) before filtering it
     """
     Mask = kwargs.get("Mask",0) # Assign the Mask here
     kern = kwargs.get("kern",6) # Kernal size for poster opening and closing steps
@@ -222,6 +268,31 @@ def PosterPreProc(image,**kwargs):
     Kuw_only = kwargs.get("Kuw_only",False) # Option to only return the Kuwahara filtered image
     ExcludeDirt = kwargs.get("ExcludeDirt",True) # Option to Exclude dirt from approximation of shading 
     ExcludePt = kwargs.get("ExcludePt",False) 
+    KuMaxMem = kwargs.get("KuMaxMem",256) # Memory limit of the Kuwahara filter in MB
+    KuWorkers = kwargs.get("KuWorkers",None) # Threads for the Kuwahara filter
+    useCache = kwargs.get("useCache",True) # Option to use the poster cache
+    
+    compute = lambda: _PosterPreProc(image,Mask,kern,KuSize,Gaus1,Gaus2,rsize,Kuw_only,
+                                     ExcludeDirt,ExcludePt,KuMaxMem,KuWorkers)
+    if not useCache:
+        return compute()
+    # KuMaxMem and KuWorkers do not change the output, so they are not in the key
+    params = {'kern':kern,'KuSize':KuSize,'Gaus1':Gaus1,'Gaus2':Gaus2,'rsize':rsize,
+              'Kuw_only':Kuw_only,'ExcludeDirt':ExcludeDirt,'ExcludePt':ExcludePt}
+    if type(Mask)==np.ndarray and Mask.shape==image.shape:
+        return cachedPoster('PosterPreProc', image, params, compute, mask=Mask)
+    else:
+        return cachedPoster('PosterPreProc', image, params, compute)
+
+###################################################################################
+
+###################################################################################
+
+def _PosterPreProc(image,Mask,kern,KuSize,Gaus1,Gaus2,rsize,Kuw_only,ExcludeDirt,
+                   ExcludePt,KuMaxMem,KuWorkers):
+    """
+    Does the work of PosterPreProc, without the poster cache.
+    """
     img = np.copy(image).astype(np.uint8)
     
     # Calculate the average Apply mask if provided
@@ -246,7 +317,7 @@ def PosterPreProc(image,**kwargs):
     proc = cv2.morphologyEx(proc,cv2.MORPH_ERODE, (kern,kern)) # Eliminates most platinum spots
     proc = cv2.morphologyEx(proc,cv2.MORPH_DILATE,(kern+1,kern+1)) # Eliminates most dirt spots
     proc = cv2.GaussianBlur(proc,(Gaus1,Gaus1),0)
-    proc = Kuwahara.Kuwahara(proc,KuSize)
+    proc = Kuwahara.Kuwahara(proc,KuSize,tiled=True,maxMemory=KuMaxMem,workers=KuWorkers)
     if Kuw_only:
         return proc
     proc = cv2.GaussianBlur(proc,(Gaus2,Gaus2),0)
@@ -260,53 +331,28 @@ def PosterPreProc(image,**kwargs):
 def NewRegThresh(ogimage, Data, Mask=0, MoDirt='Mo', returnData = False, verbose=False):
     """
     Creates thresholded images and modifies the Data dictionary for a given image.
+    Every region of the Data dictionary gets its 'PtThresh' and 'DirtThresh', 
+    and its 'PtArea', 'DirtArea' and 'MoArea' in pixels (see regionThreshMaps).
     
     """
 
-    # Clean up data dictionary. Maxreg is the region with the largest area
-    Data = cleanUpRegData(Data) 
-    Data,Maxreg = findMaxReg(Data)
-       
+    # Pick the Pt and dirt thresholds of every region
+    Data = selectRegionThresh(Data)
 
-    # Initiate the platinum, Area, Molybdenum, and Dirt Sums for each region.
+    # Threshold all the regions at once
+    PtMap, DirtMap, counts = regionThreshMaps(ogimage, Data, Mask=Mask)
+    
+    # Sum the platinum, Molybdenum, and Dirt areas of the regions. 
     Ptsum = 0
-    Allsum = 0
     MoSum = 0
     DirtSum = 0
-    CrackSum = 0
-    
-    PtMap = np.zeros(ogimage.shape).astype(np.uint8)
-    DirtMap = np.zeros(ogimage.shape).astype(np.uint8)
-    
     for reg in Data:
-        #  Set Threshold value for Pt
-        numPx = sum(Data[reg]['Histogram'])
-        # If the region is too small, then use the Pt threshold level of the largest
-        # region
-        if numPx<2000:
-            PtThresh = hist.selectPtThresh(Data[Maxreg])
-            DirtThresh = hist.selectDirtThresh(Data[Maxreg])
-            Data[reg]['PtThresh'] = PtThresh
-            Data[reg]['DirtThresh'] = DirtThresh
-        else:
-            PtThresh = hist.selectPtThresh(Data[reg])
-            DirtThresh = hist.selectDirtThresh(Data[reg])
-            Data[reg]['PtThresh'] = PtThresh
-            Data[reg]['DirtThresh'] = DirtThresh
-        # Make the PtMap using the applyPtThresh function.
-        Data[reg]['PtMap'] = applyPtThresh(ogimage,PtThresh,\
-        regionMask=Data[reg]['RegMask'],Mask=Mask).astype(np.bool_)
-        # Make the DirtMap using the applyDirtThresh function.
-        Data[reg]['DirtMap'] = applyDirtThresh(ogimage,DirtThresh,\
-        regionMask=Data[reg]['RegMask'],Mask=Mask).astype(np.bool_)
-        Data[reg]['MolyMap']=getMolyMap(Data[reg]['DirtMap'],Data[reg]['PtMap'],\
-        regionMask=Data[reg]['RegMask'],Mask=Mask).astype(np.bool_)
-        # Combine to 
-        PtMap += Data[reg]['PtMap']
-        DirtMap += Data[reg]['DirtMap']
-        Ptsum += meas.calcExposedPt(Data[reg]['PtMap'],1)
-        DirtSum += meas.calcDirt(Data[reg]['DirtMap'],1)[0] 
-        MoSum += meas.calcExposedPt(Data[reg]["MolyMap"],1)
+        (Data[reg]['PtArea'],
+         Data[reg]['DirtArea'],
+         Data[reg]['MoArea']) = counts[reg]
+        Ptsum += float(counts[reg][0])
+        DirtSum += counts[reg][1]
+        MoSum += float(counts[reg][2])
         
         
     Allsum = Ptsum+DirtSum+MoSum
@@ -343,6 +389,142 @@ def NewRegThresh(ogimage, Data, Mask=0, MoDirt='Mo', returnData = False, verbose
 
 ###################################################################################
 
+def regionThreshMaps(ogimage, Data, Mask=0, kernSize=2):
+    """
+    The engine of NewRegThresh: thresholds every region of the Data dictionary
+    of MakeRegions at its own 'PtThresh' and 'DirtThresh' in one pass over the 
+    image. The thresholds of the regions become per-pixel threshold maps 
+    through the label image of the poster, and the pixel counts of the regions
+    come from np.bincount of the labels. Returns the PtMap and DirtMap (the 
+    sums of the maps applyPtThresh and applyDirtThresh make for the regions) 
+    and a dictionary with the (Pt, dirt, Mo) pixel counts of every region.
+    
+    The dirt of every region is opened (see applyDirtThresh) on its own, so a
+    particle does not survive the opening only because it goes on in the next
+    region. One opening does that: a pixel is only kept by the erosion if all
+    of its kernel is dirt of the same region. The 'blk' region is the rest of 
+    the poster (see getMasksFromPoster), so it overlaps all the others, and is
+    thresholded on its own.
+    """
+    PtMap = np.zeros(ogimage.shape, dtype=np.uint8)
+    DirtMap = np.zeros(ogimage.shape, dtype=np.uint8)
+    counts = {}
+    if not Data:
+        return PtMap, DirtMap, counts
+    labels = Data.values()[0]['Labels']
+    numLabels = len(hist.REGION_NAMES)+1
+    if type(Mask)==np.ndarray:
+        keep = Mask!=0
+    else:
+        keep = np.ones(ogimage.shape, dtype=np.bool_)
+    value = ogimage
+    dirtValue = ogimage.astype(np.uint8) # Like applyDirtThresh
+    kernel = fun.makeDiamondKernel(kernSize).astype(np.uint8)
+    
+    def threshMaps(ptThresh, dirtThresh, inRegion):
+        # The Pt and dirt of the pixels of the regions. applyPtThresh keeps the
+        # pixels from PtThresh up that are not 0 (or over 255), and 
+        # applyDirtThresh the ones up to DirtThresh that are not 0. The pixels 
+        # of the other regions are 255 to applyDirtThresh, which is never dirt
+        # since the dirt thresholds are below the Mo peak.
+        pt = (value>=ptThresh)&(value!=0)&inRegion
+        if value.dtype != np.uint8:
+            pt &= value<=255
+        dirt = ((dirtValue<=dirtThresh)&(dirtValue!=0)&inRegion).astype(np.uint8)
+        return pt, dirt
+    
+    # All the regions but 'blk' are apart, and are thresholded together
+    ptLUT = np.empty(numLabels, dtype=np.int16)
+    ptLUT.fill(256)
+    dirtLUT = np.empty(numLabels, dtype=np.int16)
+    dirtLUT.fill(-1)
+    regs = [reg for reg in Data if reg != 'blk']
+    for reg in regs:
+        ptLUT[Data[reg]['Label']] = Data[reg]['PtThresh']
+        dirtLUT[Data[reg]['Label']] = Data[reg]['DirtThresh']
+    pt, dirt = threshMaps(ptLUT[labels], dirtLUT[labels], keep)
+    # Erode the dirt of every region on its own: where the kernel covers more
+    # than one label, nothing is left
+    eroded = cv2.erode(dirt, kernel)
+    eroded[cv2.erode(labels, kernel)!=cv2.dilate(labels, kernel)] = 0
+    dirt = cv2.dilate(eroded, kernel).astype(np.bool_)
+    PtMap += pt
+    DirtMap += dirt
+    ptCounts = np.bincount(labels[pt], minlength=numLabels)
+    dirtCounts = np.bincount(labels[dirt], minlength=numLabels)
+    # Mo is the rest of the region that is not masked off
+    moCounts = (np.bincount(labels[keep], minlength=numLabels)
+                -np.bincount(labels[pt|dirt], minlength=numLabels))
+    for reg in regs:
+        i = Data[reg]['Label']
+        counts[reg] = (int(ptCounts[i]), int(dirtCounts[i]), int(moCounts[i]))
+    
+    if 'blk' in Data:
+        inRegion = keep&(labels!=Data['blk']['Label'])
+        pt, dirt = threshMaps(Data['blk']['PtThresh'], Data['blk']['DirtThresh'],
+                              inRegion)
+        dirt = cv2.morphologyEx(dirt, cv2.MORPH_OPEN, kernel).astype(np.bool_)
+        PtMap += pt
+        DirtMap += dirt
+        counts['blk'] = (int(np.count_nonzero(pt)), int(np.count_nonzero(dirt)),
+                         int(np.count_nonzero(inRegion&~(pt|dirt))))
+    return PtMap, DirtMap, counts
+
+def selectRegionThresh(Data):
+    """
+    Cleans up the Data dictionary of an image (see cleanUpRegData) and sets the
+    'PtThresh' and 'DirtThresh' of every region in it. Returns the Data 
+    dictionary.
+    """
+    # Clean up data dictionary. Maxreg is the region with the largest area
+    Data = cleanUpRegData(Data) 
+    Data,Maxreg = findMaxReg(Data)
+    
+    for reg in Data:
+        #  Set Threshold value for Pt
+        numPx = sum(Data[reg]['Histogram'])
+        # If the region is too small, then use the Pt threshold level of the largest
+        # region
+        if numPx<2000:
+            Data[reg]['PtThresh'] = hist.selectPtThresh(Data[Maxreg])
+            Data[reg]['DirtThresh'] = hist.selectDirtThresh(Data[Maxreg])
+        else:
+            Data[reg]['PtThresh'] = hist.selectPtThresh(Data[reg])
+            Data[reg]['DirtThresh'] = hist.selectDirtThresh(Data[reg])
+    return Data
+
+def batchRegionThresh(imgs, posters, Masks=None):
+    """
+    Picks the Pt and dirt thresholds of the regions of many images at once, 
+    e.g. of all the sub images of a panorama: the histograms of every image 
+    are counted in one pass, and the features of the histograms of all the 
+    images are found together (see histogram_tools.regionData). Returns a list
+    with the Data dictionary of every image, like MakeRegions and 
+    selectRegionThresh make it, without the labels and areas of the regions.
+        Arguments:
+         - imgs - list (or stack) of images
+         - posters - their posters
+        Key-word Arguments:
+         - Masks = None - list of their masks, or None for no masks
+    """
+    if Masks is None:
+        Masks = [None]*len(imgs)
+    histos = []
+    fullHistos = []
+    for img, poster, Mask in zip(imgs, posters, Masks):
+        h, f = hist.posterHistograms(np.asarray(img).astype(np.uint8),
+                                     np.asarray(poster).astype(np.uint8), Mask)
+        histos.append(h)
+        fullHistos.append(f)
+    if not histos:
+        return []
+    allData = hist.regionData(np.array(histos), np.array(fullHistos))
+    return [selectRegionThresh(Data) for Data in allData]
+
+###################################################################################
+
+###################################################################################
+
 def cleanUpRegData(Data):
     """
     Removes regions from the data dictionary that are not in the poster (and hence
@@ -398,67 +580,31 @@ def MakeRegions(ogimage,poster,Mask=0,gaussBlur=3):
     gPoster = poster.astype(np.uint8)    
 
     if type(Mask)==int:
-        Mask = np.ones(ogimage.shape)
+        Mask = None
     
-    # Analyze histogram for each section:
-
-    blkHisto, Bins = np.histogram(Image[(gPoster==0)&(Mask!=0)],256,(0,255))
-    pleatHisto, Bins = np.histogram(Image[(gPoster==50)&(Mask!=0)],256,(0,255))
-    dMoHisto, Bins = np.histogram(Image[(gPoster==85)&(Mask!=0)],256,(0,255))
-    MoHisto, Bins = np.histogram(Image[(gPoster==150)&(Mask!=0)],256,(0,255))
-    highExHisto, Bins = np.histogram(Image[(gPoster==200)&(Mask!=0)],256,(0,255))
-    PlatHisto, Bins = np.histogram(Image[(gPoster==255)&(Mask!=0)],256,(0,255))
-    
-    # Put together the labels for the regions Dictionary
-    regions = {}
-    labels = ['blk','pleat','darkMo','Mo','highEx','Plat']
-
-    graylevels = [0,50,85,150,200,255]
-    histos = [blkHisto,pleatHisto,dMoHisto,MoHisto,highExHisto,PlatHisto]
-    #features = [range(0,256),range(0,256),range(0,256),range(0,256),range(0,256),range(0,256)]
-    masks = getMasksFromPoster(gPoster)
+    # Analyze histogram for each section. The histograms of all the regions are
+    # counted in one pass: the ones of the pixels not masked off, and the ones 
+    # of all the pixels of the region, which the max, min, mean and Mo peak 
+    # come from (see histogram_tools.posterHistograms).
+    labels = hist.regionLabels(gPoster)
+    histos, fullHistos = hist.posterHistograms(Image, gPoster, Mask, labels=labels)
     
-    # Assemble the regions Dictionary by putting in the data for every region that exists in 
-    # the poster
-    for i in range(6): 
-        
-        smoo = dat.smoothed(histos[i])
-        if Image[gPoster==graylevels[i]].size != 0:
-            # Calculate the maximum, minimum, mean pixel value of the region
-            MAX = np.max(Image[gPoster==graylevels[i]])
-            MIN = np.min(Image[gPoster==graylevels[i]])
-            MEAN = int(np.mean(Image[gPoster==graylevels[i]]))
-            # Determine the peak pixel value of the molybdenum in the region and produce
-            # a histogram of the region with findMo in the histograms module
-            MoPEAK,histo = hist.findMoPeakByImg(Image[gPoster==graylevels[i]],returnHist=True)
-            # Get all peaks and valleys in the regions histogram
-            PEAKS,Y = dat.getMaxima(smoo, smoonum=6)
-            VALLEYS,Y = dat.getMinima(smoo, smoonum=6)
-            # Get all inflection points in the Histogram
-            NEGINFL,Y = dat.getInflectionPoints(smoo, smoonum=6,sign = 'negative')
-            POSINFL,Y = dat.getInflectionPoints(smoo, smoonum=6,sign = 'positive')
-            
-            # Convert all lists into numpy ndarrays, which make it easier to use these
-            # values in the future
-            PEAKS = np.asarray(PEAKS).astype(np.uint8)
-            VALLEYS = np.asarray(VALLEYS).astype(np.uint8)
-            NEGINFL = np.asarray(NEGINFL).astype(np.uint8)
-            POSINFL = np.asarray(POSINFL).astype(np.uint8)
-            
-            # Assemble the subdictionary for this region and add it to the regions 
-            # dictionary. 
-            regions[labels[i]] = {
-            'RegMask':masks[i],'GrayLevel':graylevels[i],
-            'Histogram':histos[i],
-            'Max':MAX,'Min':MIN,
-            'Mean':MEAN,'MoPeak':MoPEAK,
-            'Peaks':PEAKS,'Valleys':VALLEYS,
-            'NegInfl':NEGINFL,'PosInfl':POSINFL}
-        else:
-            # if no pixels are labeled as part of a particular region, the value of that 
-            # region in the regions dictionary is 'Null'.
-            regions[labels[i]] = 'Null'
-        
+    # Assemble the regions Dictionary with the data for every region that 
+    # exists in the poster (the features of all the histograms are found at 
+    # once, see histogram_tools.regionData). Instead of a mask of its own, 
+    # every region gets the label image of the poster (the same array for all
+    # of them) and its label in it (see NewRegThresh). 'RegArea' is the sum of
+    # the mask getMasksFromPoster makes for the region: its pixels, but 255 
+    # for every pixel of the rest of the poster for 'blk'.
+    regions = hist.regionData(histos, fullHistos)
+    for i, label in enumerate(hist.REGION_NAMES):
+        if regions[label] != 'Null':
+            regions[label]['Labels'] = labels
+            regions[label]['Label'] = i
+            if label == 'blk':
+                regions[label]['RegArea'] = 255*(labels.size-int(fullHistos[i].sum()))
+            else:
+                regions[label]['RegArea'] = int(fullHistos[i].sum())
     return regions
     
 ###################################################################################
@@ -1,13 +1,295 @@
 # First try at manually rewriting the Kuwahara function from Luca Balbi which was written
 # originally in MatLab
 import numpy as np
-from scipy.signal import convolve2d
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import time
 # help on convolve2d: http://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.convolve2d.html
 
-def Kuwahara(original, winsize):
+# Number of threads used by the tiled filter when workers is None. None means one
+# per CPU. Process pools (nexus.animorf with workers > 1) set it to 1 in each
+# worker process so the pool does not start cpu_count() threads per process.
+DEFAULT_WORKERS = None
+
+def Kuwahara(original, winsize, tiled=False, maxMemory=256, workers=None):
     """
-    Kuwahara filters an image using the Kuwahara filter
+    Kuwahara filters an image using the Kuwahara filter. Gives the same result 
+    as KuwaharaConv (the original translation of Luca Balbi's MatLab code 
+    below), to the last gray level, but the cost per pixel of integer images 
+    does not depend on the window size.
+    
+    Inputs:
+    original      -->    image to be filtered
+    winsize       -->    size of the filter window: legal values are
+                                                    5, 9, 13, ... = (4*k+1)
+    Key-word Arguments:
+    tiled = False -->    filter the image in horizontal strips so that large 
+                         images (full resolution foil scans) fit in memory. The
+                         output is identical to the untiled filter.
+    maxMemory = 256 -->  upper limit, in megabytes, on the scratch memory used
+                         by all of the strips being filtered at once. Only used
+                         if tiled is True. If not even one strip of the 
+                         smallest height fits, one strip of that height is 
+                         filtered at a time anyway.
+    workers = None -->   largest number of threads filtering strips at the 
+                         same time. None uses DEFAULT_WORKERS, or one thread 
+                         per CPU if that is None too. Fewer threads are used if
+                         their strips do not fit in maxMemory. Only used if 
+                         tiled is True.
+    
+    The sums and sums of squares over each of the four subwindows are read off
+    of two summed-area tables (integral images), so every subwindow costs four 
+    lookups no matter how big it is. For integer images (the usual uint8 foil
+    images) the sums are kept as 64-bit integers and the variances are compared
+    as
+        n*(sum of squares) - (sum)^2   with n = pixels per subwindow,
+    which is exact. The convolution version works with rounded floating point
+    means and variances, so where two subwindows have the same variance it can
+    pick either of them, and a mean of exactly 100 can come out as 99.999999 
+    and be truncated to 99. Only those pixels (ties in variance and whole 
+    number means, a small part of the image) are redone with the floating 
+    point arithmetic of the convolution version, term by term in the same 
+    order (see _convPixels). Float images that are not whole numbers are 
+    filtered that way everywhere.
+    
+    Just like the convolution version, pixels outside of the image are treated
+    as zeros, the subwindows are divided by the full subwindow size, and ties 
+    go to the first subwindow in the order south-east, south-west, north-east,
+    north-west.
+    
+    Example
+    filtered = Kuwahara(original,5);
+    filtered = Kuwahara(original,17,tiled=True,maxMemory=512,workers=4);
+    """
+    # make sure window size is correct
+    if winsize%4 != 1:
+        raise Exception ("Invalid winsize %s: winsize must follow formula: w = 4*n+1." %winsize)
+    
+    image = np.asarray(original)
+    if not tiled:
+        return _kuwaharaSAT(image, winsize)
+    
+    # TILED MODE: Each strip of output rows needs (winsize-1)/2 rows of halo 
+    # above and below it. Within the halo the strip sees exactly the pixels the
+    # whole image would, and at the top and bottom of the image it sees the 
+    # same zero padding, so the seams are exact.
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    if workers is None:
+        workers = cpu_count()
+    halo = (winsize-1)//2
+    H,W = image.shape
+    stripRows, workers = _stripPlan(W, winsize, maxMemory, workers)
+    if stripRows >= H:
+        return _kuwaharaSAT(image, winsize)
+    
+    filtered = np.empty((H,W), dtype=np.uint8)
+    
+    def filterStrip(start):
+        stop = min(start+stripRows, H)
+        top = max(start-halo, 0)
+        bottom = min(stop+halo, H)
+        strip = _kuwaharaSAT(image[top:bottom], winsize)
+        filtered[start:stop] = strip[start-top:stop-top]
+        
+    starts = range(0, H, stripRows)
+    if workers > 1:
+        pool = ThreadPool(min(workers, len(starts)))
+        try:
+            pool.map(filterStrip, starts, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start in starts:
+            filterStrip(start)
+    return filtered
+
+# Smallest strip height of the tiled filter, in halos. Every strip filters 
+# 2*halo rows more than it keeps, so thinner strips compute each output row
+# many times over.
+_MIN_STRIP_HALOS = 4
+
+def _stripPlan(W, winsize, maxMemory, workers):
+    """
+    Returns the height of the strips of the tiled filter of an image W pixels
+    wide, and the number of threads filtering them, so that the scratch memory
+    of all the threads (strip plus halos, each) stays under maxMemory 
+    megabytes. The strips are never thinner than _MIN_STRIP_HALOS halos: when
+    the memory runs short, fewer threads are used instead.
+    """
+    halo = (winsize-1)//2
+    # padded rows that fit in maxMemory
+    budget = int(maxMemory*2**20/(_BYTES_PER_PIXEL*(W+2*halo)))
+    minRows = _MIN_STRIP_HALOS*max(halo,1)
+    workers = max(workers,1)
+    stripRows = max(budget//workers-2*halo, minRows)
+    workers = min(workers, budget//(stripRows+2*halo))
+    if workers < 1:
+        # Not even one strip fits: filter the smallest strips one at a time
+        workers = 1
+    return stripRows, workers
+
+# Approximate peak scratch memory of _kuwaharaSAT in bytes per padded pixel: 
+# the int64 copy of the image, two summed-area tables, the sums and variances
+# of the four subwindows and the temporaries of the comparison. 
+_BYTES_PER_PIXEL = 128
+
+# Unit roundoff of float64
+_EPS = 2.0**-53
+
+def _kuwaharaSAT(image, winsize):
+    """
+    Summed-area table Kuwahara filter of a whole image. See Kuwahara.
+    """
+    c = (winsize-1)//2  # offset of the subwindow corner from the center
+    n = (c+1)**2        # number of pixels in each subwindow
+    
+    # Integer images, and float images of whole numbers, are summed exactly
+    if image.dtype.kind in 'biu':
+        ints = image.astype(np.int64)
+    elif (image.size and np.isfinite(image).all() and (np.floor(image)==image).all()
+          and np.abs(image).max() < 2**24):
+        ints = image.astype(np.int64)
+    else:
+        # Everything has to be done the floating point way
+        rows, cols = np.indices(image.shape)
+        padded = np.zeros((image.shape[0]+2*c, image.shape[1]+2*c))
+        padded[c:c+image.shape[0], c:c+image.shape[1]] = image
+        return _convPixels(padded, c, rows.ravel(), cols.ravel()
+                           ).reshape(image.shape).astype(np.uint8)
+        
+    # Summed-area tables of the zero padded image and of its square. The 
+    # extra leading row and column of zeros makes every box sum four lookups.
+    sat1 = _summedAreaTable(ints, c)
+    sat2 = _summedAreaTable(ints*ints, c)
+    
+    # Row and column offsets of each subwindow in the padded tables, in the 
+    # same order as the convolution kernels of KuwaharaConv
+    offsets = ((c,c),(c,0),(0,c),(0,0))
+    sums = []
+    keys = []
+    for dr,dc in offsets:
+        s1 = _boxSum(sat1, c, dr, dc, ints.shape)
+        s2 = _boxSum(sat2, c, dr, dc, ints.shape)
+        # n**2 times the variance of the subwindow
+        sums.append(s1)
+        keys.append(n*s2 - s1*s1)
+    del sat1, sat2
+    best = np.zeros(ints.shape, dtype=np.intp)
+    bestKey = keys[0].copy()
+    bestSum = sums[0].copy()
+    for k in range(1,4):
+        # strictly smaller, so ties keep the first subwindow like np.argmin
+        better = keys[k] < bestKey
+        best[better] = k
+        bestKey[better] = keys[k][better]
+        bestSum[better] = sums[k][better]
+    filtered = (bestSum//n).astype(np.uint8)
+    
+    # Bounds on the rounding errors of the convolution version, in the mean 
+    # and in n**2 times the variance. Subwindows with variances closer than 
+    # that may be swapped by it (for uint8 images, only equal variances), and
+    # a mean that close to a whole number may be truncated to the one below.
+    M = float(np.abs(ints).max()) if ints.size else 0.
+    meanErr = (n+3)*_EPS*M
+    keyErr = int(2*4*(n+4)*_EPS*M*M*n*n)
+    contenders = np.zeros(ints.shape, dtype=np.uint8)
+    sameSums = np.ones(ints.shape, dtype=np.bool_)
+    for k in range(4):
+        close = keys[k]-bestKey <= keyErr
+        contenders += close
+        sameSums &= ~close|(sums[k]==bestSum)
+    rest = bestSum%n
+    nearWhole = (np.minimum(rest, n-rest) <= meanErr*n)|(bestSum<0)
+    
+    # Flat subwindows (all the contenders are flat, with the same value) all
+    # give the mean that adding n times the same term gives
+    flat = (bestKey==0)&sameSums&(keyErr==0)
+    values = np.unique(bestSum[flat]//n)
+    if values.size:
+        means = np.zeros(values.size)
+        term = values.astype(np.float64)*(1.0/n)
+        for i in range(n):
+            means += term
+        filtered[flat] = means[np.searchsorted(values, bestSum[flat]//n)].astype(np.uint8)
+        
+    # Ties in variance: redo the whole pixel the floating point way
+    padded = None
+    redo = (contenders>1)&~flat
+    if redo.any():
+        padded = np.zeros((ints.shape[0]+2*c, ints.shape[1]+2*c))
+        padded[c:c+ints.shape[0], c:c+ints.shape[1]] = ints
+        rows, cols = np.nonzero(redo)
+        filtered[rows,cols] = _convPixels(padded, c, rows, cols).astype(np.uint8)
+    # Whole number means of the only subwindow that can be picked: redo its mean
+    redo = (contenders==1)&~flat&nearWhole
+    if redo.any():
+        if padded is None:
+            padded = np.zeros((ints.shape[0]+2*c, ints.shape[1]+2*c))
+            padded[c:c+ints.shape[0], c:c+ints.shape[1]] = ints
+        rows, cols = np.nonzero(redo)
+        dr = np.array([o[0] for o in offsets])[best[rows,cols]]
+        dc = np.array([o[1] for o in offsets])[best[rows,cols]]
+        filtered[rows,cols] = _convMeans(padded, c, rows+dr, cols+dc)[0].astype(np.uint8)
+    return filtered
+
+def _convMeans(padded, c, tops, lefts):
+    """
+    The mean and the mean of squares of the (c+1)x(c+1) subwindows with the
+    top left corners (tops, lefts) in the zero padded image, with the floating
+    point operations of KuwaharaConv: convolve2d adds up the products with the
+    kernel (every pixel times 1/n) from the last pixel of the window to the 
+    first, row by row.
+    """
+    w = 1.0/((c+1)**2)
+    avg = np.zeros(len(tops))
+    sq = np.zeros(len(tops))
+    for i in range(c, -1, -1):
+        for j in range(c, -1, -1):
+            x = padded[tops+i, lefts+j]
+            avg += x*w
+            sq += (x*x)*w
+    return avg, sq
+    
+def _convPixels(padded, c, rows, cols):
+    """
+    The output of KuwaharaConv at the pixels (rows, cols) of the image that is
+    zero padded with c pixels on every side, as floats.
+    """
+    avgs = np.empty((4, len(rows)))
+    variances = np.empty((4, len(rows)))
+    for k,(dr,dc) in enumerate(((c,c),(c,0),(0,c),(0,0))):
+        avgs[k], sq = _convMeans(padded, c, rows+dr, cols+dc)
+        variances[k] = sq-avgs[k]**2
+    return avgs[np.argmin(variances,0), np.arange(len(rows))]
+    
+def _summedAreaTable(image, c):
+    """
+    Returns the summed-area table of the image padded with c zeros on every side
+    and one extra leading row and column of zeros.
+    """
+    H,W = image.shape
+    table = np.zeros((H+2*c+1, W+2*c+1), dtype=image.dtype)
+    table[c+1:c+1+H, c+1:c+1+W] = image
+    np.cumsum(table, axis=0, out=table)
+    np.cumsum(table, axis=1, out=table)
+    return table
+    
+def _boxSum(table, c, dr, dc, shape):
+    """
+    Sums of the (c+1)x(c+1) boxes whose top left corner is offset by (dr,dc) 
+    from each pixel in the padded image, read off of the summed-area table.
+    """
+    H,W = shape
+    k = c+1
+    return (table[dr+k:dr+k+H, dc+k:dc+k+W] - table[dr:dr+H, dc+k:dc+k+W]
+            - table[dr+k:dr+k+H, dc:dc+W] + table[dr:dr+H, dc:dc+W])
+    
+def KuwaharaConv(original, winsize):
+    """
+    Kuwahara filters an image using the Kuwahara filter. This is the original
+    convolution based translation, kept as the reference for Kuwahara.
     
     Inputs:
     original      -->    image to be filtered
@@ -20,7 +302,7 @@ def Kuwahara(original, winsize):
     readable, a commented-out, fully vectorialised version is provided as well.
     
     Example
-    filtered = Kuwahara(original,5);
+    filtered = KuwaharaConv(original,5);
 
     Filter description:
     The Kuwahara filter works on a window divided into 4 overlapping
@@ -44,6 +326,8 @@ def Kuwahara(original, winsize):
     
     Translated from Matlab into Python by Andrew Dussault, 2015
     """
+    # scipy.signal is slow to import and only this reference version needs it
+    from scipy.signal import convolve2d
     # Check the time:
     #t1=time.time()
 
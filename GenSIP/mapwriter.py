@@ -0,0 +1,233 @@
+"""
+Contains the writers of the maps (PtMaps, DirtMaps) and posters that the batch
+functions write for every image (nexus.animorf and analyzeBatch,
+bigfoils.analyzeSubImages and mainanalysis.runOnSubImgs).
+
+The maps are binary, but they used to be written as 8 bit PNG files at
+compression 6, which is a good part of the time and disk space of a panorama
+run. The 'mapFormat' kwarg of those functions picks one of these formats:
+    png      - 8 bit PNG at compression 6. The default, same files as before.
+    fastpng  - 8 bit PNG at compression 1: about as big, much faster to write.
+    png1     - 1 bit PNG: the smallest files, and they still open anywhere.
+    bits     - the rows packed 8 pixels to a byte (np.packbits) in an
+               uncompressed .npz file. The fastest to write, and the packed
+               rows can be memory mapped (see packedMap).
+    none     - the maps are not written at all.
+Pictures that are not binary (the posters) are written as fastpng by the png1
+and bits formats. fun.loadImg reads every one of these files back, with 255 for
+the pixels of a map, so stitchImage, tilelabel and compareToStandards work on
+any of them once they are given the extension (see formatExt).
+"""
+import cv2
+import numpy as np
+import os
+import struct
+import zipfile
+import zlib
+
+###################################################################################
+
+###################################################################################
+
+class MapFormat(object):
+    """
+    A way of writing maps: the file extension, the function that writes a
+    picture to a path and whether that function only keeps binary pictures.
+    """
+    def __init__(self, name, ext, write, binaryOnly=False):
+        self.name = name
+        self.ext = ext
+        self.write = write
+        self.binaryOnly = binaryOnly
+
+# Every map format by name. See registerFormat
+MAP_FORMATS = {}
+
+def registerFormat(name, ext, write, binaryOnly=False):
+    """
+    Adds a map format. write(path, img) writes the picture img to path, which
+    ends with ext. If binaryOnly is True, write is only given maps (0 or 255)
+    and the posters are written as fastpng. ext None means no file is written.
+    """
+    MAP_FORMATS[name.lower()] = MapFormat(name.lower(), ext, write, binaryOnly)
+
+def getFormat(fmt):
+    """Returns the MapFormat named fmt, or raises an Exception"""
+    mapFormat = MAP_FORMATS.get(str(fmt).lower())
+    if mapFormat is None:
+        raise Exception("Unknown map format: {0}\n Map format should be one of: {1}"
+                        .format(fmt, ', '.join(sorted(MAP_FORMATS))))
+    return mapFormat
+
+def formatExt(fmt, binary=True):
+    """
+    Extension of the files of the maps (or of the posters, if binary is False)
+    written in the format fmt: '.png', '.npz' or None if there are none.
+    """
+    mapFormat = getFormat(fmt)
+    if mapFormat.binaryOnly and not binary:
+        mapFormat = MAP_FORMATS['fastpng']
+    return mapFormat.ext
+
+###################################################################################
+
+###################################################################################
+
+def writeMap(folder, name, img, fmt='png', binary=True):
+    """
+    Writes the picture img of the image 'name' to folder in the format fmt, and
+    returns the path of the file (None for the 'none' format). binary=False is
+    for the posters. An 8 bit PNG gets the picture as it is, so the files are
+    the same as they were before there was a choice of format.
+    """
+    mapFormat = getFormat(fmt)
+    if mapFormat.binaryOnly and not binary:
+        mapFormat = MAP_FORMATS['fastpng']
+    if mapFormat.ext is None:
+        return None
+    path = os.path.join(folder, name+mapFormat.ext)
+    mapFormat.write(path, img)
+    return path
+
+def findMap(folder, name):
+    """
+    Returns the path of the map of the image 'name' in folder, whatever its
+    format, or None if there is none.
+    """
+    for ext in mapExts():
+        path = os.path.join(folder, name+ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+def isMapFile(fileName):
+    """True for the files that one of the map formats writes"""
+    return os.path.splitext(fileName)[1] in mapExts()
+
+def mapExts():
+    # The extensions of the files of all formats, .png first
+    return sorted(set([f.ext for f in MAP_FORMATS.values() if f.ext is not None]),
+                  key=lambda ext: ext!='.png')
+
+###################################################################################
+
+###################################################################################
+
+def packedMap(path):
+    """
+    Returns the packed rows of a map written in the bits format, without reading
+    them: a read-only memory map of shape (rows, ceil(columns/8)) and the shape
+    of the map. np.unpackbits(packed[r0:r1], axis=1)[:,:columns] are rows r0 to
+    r1 of the map, as 0 and 1.
+    """
+    shape = tuple(np.load(path)['shape'])
+    with zipfile.ZipFile(path) as z:
+        info = z.getinfo('bits.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        # Someone saved it with savez_compressed, so it cannot be mapped
+        return np.load(path)['bits'], shape
+    with open(path, 'rb') as f:
+        # The array starts after the local header of the zip entry, and its
+        # own .npy header
+        f.seek(info.header_offset)
+        header = f.read(30)
+        nameLen, extraLen = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset+30+nameLen+extraLen)
+        np.lib.format.read_magic(f)
+        bitsShape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+    packed = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=bitsShape)
+    return packed, shape
+
+def loadPacked(path):
+    """Reads a map written in the bits format, as uint8 with 255 for the map"""
+    packed, shape = packedMap(path)
+    img = np.unpackbits(packed, axis=1)[:,:shape[1]]
+    img *= 255
+    return img
+
+###################################################################################
+
+###################################################################################
+
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+def _pngChunk(tag, data):
+    crc = zlib.crc32(tag+data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+class PngStripWriter(object):
+    """
+    Writes an 8 bit grayscale (shape (rows, columns)) or RGB (shape (rows, 
+    columns, 3)) PNG file a strip of rows at a time, from the top, so a picture 
+    that does not fit in memory (see images.stitchImage) never has to be in 
+    memory at once. level is the zlib compression level.
+        > writer = PngStripWriter(path, shape)
+        > for y in range(0, rows, 256): writer.write(picture[y:y+256])
+        > writer.close()
+    """
+    def __init__(self, path, shape, level=6):
+        self.rowsLeft = shape[0]
+        channels = 1 if len(shape)==2 else shape[2]
+        if channels not in (1,3):
+            raise Exception("Only grayscale and RGB PNGs can be written, not "
+                            "%d channels" % channels)
+        self.rowBytes = shape[1]*channels
+        self.compressor = zlib.compressobj(level)
+        self.f = open(path, 'wb')
+        self.f.write(_PNG_SIGNATURE)
+        colorType = 0 if channels==1 else 2
+        self.f.write(_pngChunk('IHDR', struct.pack('>IIBBBBB', shape[1], shape[0], 
+                                                   8, colorType, 0, 0, 0)))
+
+    def write(self, strip):
+        """Adds the next rows of the picture"""
+        strip = np.asarray(strip, dtype=np.uint8).reshape(len(strip), self.rowBytes)
+        if len(strip) > self.rowsLeft:
+            raise Exception("More rows than the PNG file was made for")
+        self.rowsLeft -= len(strip)
+        # Filter type 0 (none) in front of every row
+        raw = np.hstack([np.zeros((len(strip),1), np.uint8), strip]).tostring()
+        data = self.compressor.compress(raw)
+        if data:
+            self.f.write(_pngChunk('IDAT', data))
+
+    def close(self):
+        """Finishes the file. Raises an Exception if rows are missing"""
+        self.f.write(_pngChunk('IDAT', self.compressor.flush()))
+        self.f.write(_pngChunk('IEND', ''))
+        self.f.close()
+        if self.rowsLeft:
+            raise Exception("%d rows of the PNG file were not written" % self.rowsLeft)
+
+###################################################################################
+
+###################################################################################
+
+def _writePng(path, img, compression=6):
+    cv2.imwrite(path, img, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,compression])
+
+def _writeFastPng(path, img):
+    _writePng(path, img, 1)
+
+def _writePng1(path, img):
+    # Grayscale PNG with 1 bit per pixel. Each row is a filter byte (0, none)
+    # and the packed pixels; libpng, and so cv2.imread, reads it back as 0/255.
+    h, w = img.shape[:2]
+    rows = np.packbits(img!=0, axis=1)
+    raw = np.hstack([np.zeros((h,1), np.uint8), rows]).tostring()
+    with open(path, 'wb') as f:
+        f.write(_PNG_SIGNATURE)
+        f.write(_pngChunk('IHDR', struct.pack('>IIBBBBB', w, h, 1, 0, 0, 0, 0)))
+        f.write(_pngChunk('IDAT', zlib.compress(raw, 6)))
+        f.write(_pngChunk('IEND', ''))
+
+def _writeBits(path, img):
+    # Uncompressed, so that packedMap can memory map the rows
+    np.savez(path, bits=np.packbits(img!=0, axis=1), shape=np.array(img.shape[:2]))
+
+registerFormat('png', '.png', _writePng)
+registerFormat('fastpng', '.png', _writeFastPng)
+registerFormat('png1', '.png', _writePng1, binaryOnly=True)
+registerFormat('bits', '.npz', _writeBits, binaryOnly=True)
+registerFormat('none', None, None)
@@ -4,11 +4,23 @@ etc. based on the thresholded images produced by analysis methods.
 """
 import numpy as np
 import cv2
-import mahotas as mh
 import os
 
 import GenSIP.functions as fun
-import matplotlib.pyplot as plt
+
+# Row format of the particle statistics arrays returned by particleStats. The
+# bounding box is top/left inclusive and bottom/right exclusive (like slices),
+# the centroid is in pixel coordinates (row, column) and the perimeter is the
+# number of particle pixels that have a 4-neighbor outside of the particle.
+PARTICLE_DTYPE = np.dtype([('label',np.int32),
+                           ('area',np.int64),
+                           ('top',np.int32),
+                           ('left',np.int32),
+                           ('bottom',np.int32),
+                           ('right',np.int32),
+                           ('cy',np.float64),
+                           ('cx',np.float64),
+                           ('perimeter',np.int64)])
 
 ####################################################################################
 
@@ -47,7 +59,135 @@ def calcExposedPt (Ptimage, res,**kwargs):
 ####################################################################################
 
 ####################################################################################
-    
+
+def checkBinary(img):
+    """
+    Raises an exception unless the image is binary: 0 and at most one other
+    value. uint8 images are checked with a single histogram pass.
+    """
+    if img.dtype == np.bool_:
+        return
+    if img.dtype == np.uint8:
+        hist = np.bincount(img.ravel(), minlength=256)
+        if np.count_nonzero(hist[1:]) > 1:
+            raise Exception("Image must be a binary image of 0 and a non-zero number.")
+    else:
+        nonzero = img[img!=0]
+        if nonzero.size != 0 and np.any(nonzero!=nonzero[0]):
+            raise Exception("Image must be a binary image of 0 and a non-zero number.")
+
+####################################################################################
+
+####################################################################################
+
+def particleStats(img, res=1, **kwargs):
+    """
+    Labels the particles (connected regions of non-zero pixels) of a binary image
+    in one pass and returns their statistics as a structured array with one row
+    per particle (see PARTICLE_DTYPE): label, area (in pixels), bounding box,
+    centroid and perimeter. The zero pixels are the background (label 0), which
+    is never in the array. Rows are in label order.
+
+        Key-word Arguments:
+            BoundConds = np.ones((3,3))
+                - Structuring element of the neighbors that belong to the same
+                particle. Default set to the 8 nearest neighbors.
+            minPartArea = 0
+                - Minimum particle area in square microns (res is in square
+                microns per pixel). Smaller particles are left out of the array,
+                but keep their label in the labelled image.
+            backend = None
+                - 'cv2' (cv2.connectedComponentsWithStats) or 'mahotas'. None
+                uses cv2 if the installed OpenCV has it and BoundConds is the
+                4 or 8 neighbor element, and mahotas otherwise. Both give the
+                same labels.
+            returnLabelled = False
+                - Option to also return the labelled image.
+    """
+    BoundConds = np.asarray(kwargs.get('BoundConds',np.ones((3,3)))) # Neighbors of a pixel
+    minPartArea = kwargs.get('minPartArea',0) # In square microns
+    backend = kwargs.get('backend',None) # 'cv2', 'mahotas' or None
+    returnLabelled = kwargs.get('returnLabelled',False) # Option to return the labelled image
+
+    checkBinary(img)
+    binary = (img!=0).astype(np.uint8)
+
+    cross = np.array([[0,1,0],[1,1,1],[0,1,0]])
+    if BoundConds.shape==(3,3) and np.all(BoundConds!=0):
+        connectivity = 8
+    elif BoundConds.shape==(3,3) and np.array_equal(BoundConds!=0, cross!=0):
+        connectivity = 4
+    else:
+        connectivity = None
+    if backend is None:
+        if connectivity is not None and hasattr(cv2,'connectedComponentsWithStats'):
+            backend = 'cv2'
+        else:
+            backend = 'mahotas'
+
+    if backend == 'cv2':
+        if connectivity is None:
+            raise Exception("The cv2 backend only supports 4 and 8 neighbor BoundConds.")
+        num, labelled, stats, centroids = cv2.connectedComponentsWithStats(
+                                                binary, connectivity=connectivity,
+                                                ltype=cv2.CV_32S)
+        parts = np.zeros((num,), dtype=PARTICLE_DTYPE)
+        parts['area'] = stats[:,cv2.CC_STAT_AREA]
+        parts['top'] = stats[:,cv2.CC_STAT_TOP]
+        parts['left'] = stats[:,cv2.CC_STAT_LEFT]
+        parts['bottom'] = stats[:,cv2.CC_STAT_TOP]+stats[:,cv2.CC_STAT_HEIGHT]
+        parts['right'] = stats[:,cv2.CC_STAT_LEFT]+stats[:,cv2.CC_STAT_WIDTH]
+        parts['cx'] = centroids[:,0]
+        parts['cy'] = centroids[:,1]
+        # cv2 does not number the particles in raster order like mh.label does.
+        # Renumber them by their first pixel so both backends give the same labels.
+        if num > 2:
+            flat = labelled.ravel()
+            fg = flat[flat!=0]
+            order = fg[np.sort(np.unique(fg, return_index=True)[1])]
+            relabel = np.zeros((num,), dtype=np.int32)
+            relabel[order] = np.arange(1,num)
+            labelled = relabel[labelled]
+            parts[1:] = parts[order]
+    elif backend == 'mahotas':
+        import mahotas as mh
+        from scipy import ndimage
+        labelled, num = mh.label(binary, Bc=BoundConds)
+        num += 1
+        parts = np.zeros((num,), dtype=PARTICLE_DTYPE)
+        flat = labelled.ravel()
+        parts['area'] = np.bincount(flat, minlength=num)
+        rows, cols = np.indices(labelled.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            parts['cy'] = np.bincount(flat, weights=rows.ravel(), minlength=num)/parts['area']
+            parts['cx'] = np.bincount(flat, weights=cols.ravel(), minlength=num)/parts['area']
+        for i,sl in enumerate(ndimage.find_objects(labelled)):
+            if sl is not None:
+                parts['top'][i+1], parts['bottom'][i+1] = sl[0].start, sl[0].stop
+                parts['left'][i+1], parts['right'][i+1] = sl[1].start, sl[1].stop
+    else:
+        raise Exception("Unknown particle statistics backend: {0}".format(backend))
+    parts['label'] = np.arange(num)
+
+    # Perimeter: particle pixels with a 4-neighbor outside of the particle (the
+    # image border counts as outside)
+    inner = cv2.erode(binary, cross.astype(np.uint8), borderType=cv2.BORDER_CONSTANT,
+                      borderValue=0)
+    edge = (binary!=0) & (inner==0)
+    parts['perimeter'] = np.bincount(labelled[edge], minlength=num)
+
+    # Leave out the background by its label, and the particles that are too small
+    parts = parts[1:]
+    if minPartArea > 0:
+        parts = parts[parts['area'] >= minPartArea/float(res)]
+    if returnLabelled:
+        return parts, labelled
+    return parts
+
+####################################################################################
+
+####################################################################################
+
 def calcDirt(img, res, **kwargs):
     """
     Calculates the number of dirt particles and the area of the foil covered by dirt
@@ -70,8 +210,10 @@ def calcDirt(img, res, **kwargs):
                 nearest neighbors to consider as part of the same region. Default
                 set to a 3x3 matrix of ones so it will consider the 8 nearest neighbors.
             minPartArea = 0
-                - Minimum dirt particle area to be considered in the count and area
-                approximation. In square microns. Default set to 0.
+                - Minimum dirt particle area to be considered in the area 
+                approximation and the sizes. In square microns. Default set to 0.
+            backend = None
+                - Labelling backend of particleStats ('cv2' or 'mahotas').
     
     """
     returnSizes=kwargs.get('returnSizes',False)
@@ -80,38 +222,26 @@ def calcDirt(img, res, **kwargs):
     getAreaInSquaremm=kwargs.get('getAreaInSquaremm',False)
     BoundConds = kwargs.get('BoundConds',np.ones((3,3)))
     minPartArea = kwargs.get('minPartArea',0)
+    backend = kwargs.get('backend',None)
     
-    # Make sure the image is binary
-    if img.min()!=0 or np.any(img[img!=img.min()]!=img.max()):
-        raise Exception("Image must be a binary image of 0 and a non-zero number.")
-
-    #inv = cv2.bitwise_not(img)
-    #invDirt = cv2.bitwise_not(isoDirt(img,profile))
-    # Make a 3x3 matrix of ones as the structuring element so that any of the 8 nearest
-    # neighbors are all considered part of the same region. 
-    labeledFoil,numDirt = mh.label(img,Bc=BoundConds)
-    
-    #Calculate the area of the dirt using Findcontours
-    sizes = mh.labeled.labeled_size(labeledFoil)
-    # Sort sizes of particles by size in descending order:
-    sizes = np.sort(sizes)[::-1]
-    # Eliminate the background from the "sizes" array:
-    # If the image includes the background and the foil, 
-    # they will be largest and second-largest regions in the sizes area
-    if foilIncluded:
-        sizes = sizes[1:]
-        # Don't count the foil in numDirt:
+    # Label the dirt and get the particle statistics in one pass. The background
+    # (label 0) is not in the particle array.
+    parts, labeledFoil = particleStats(img, res, BoundConds=BoundConds,
+                                       backend=backend, returnLabelled=True)
+    numDirt = parts.size
+    # If the image includes the foil outline, the white area around the foil
+    # is the largest particle. Don't count it as dirt:
+    if foilIncluded and numDirt > 0:
+        parts = np.delete(parts, np.argmax(parts['area']))
         numDirt -= 1
-    # Otherwise just eliminate the background region:
-    else:
-        sizes = sizes[1:]
-    # Consider the minimum in pixels:
-    minPartPx = minPartArea/res
-    sizes[sizes<minPartPx]=0
-    sizes = sizes[sizes!=0]
+    # Consider the minimum in pixels (numDirt still counts every particle):
+    if minPartArea > 0:
+        parts = parts[parts['area'] >= minPartArea/float(res)]
+    # Sort sizes of particles by size in descending order:
+    sizes = np.sort(parts['area'])[::-1]
     # Total area of dirt is equal to the sum of the sizes. 
     # In square microns unless otherwise specified.
-    areaDirt = sum(sizes)*res
+    areaDirt = sizes.sum()*res
     # If specified, convert area to square mm
     if getAreaInSquaremm:
         areaDirt = float(areaDirt*10**-6)
@@ -128,39 +258,174 @@ def calcDirt(img, res, **kwargs):
 ####################################################################################
 
 def getDirtSizeData(DirtSizes, res):
-    if DirtSizes.size==0:
-        MeanSize = "'--"
-        MaxSize = "'--"
-        percAreaOver100 = "'--"
-    else:
-        DirtSizes = DirtSizes*res
-        MeanSize = round(DirtSizes.mean(),1)
-        MaxSize = DirtSizes.max()
-        # Number of Particles with a diameter approximately over 100 microns,
-        # Corresponding to an area of ~7854 square microns. 
-        numOver100 = DirtSizes[DirtSizes>7850].size
-        areaOver100 = DirtSizes[DirtSizes>7850].sum()
-        percAreaOver100 = round(100*(float(areaOver100)/(DirtSizes.sum())),2)
-        
-    return MeanSize, MaxSize, percAreaOver100
+    """
+    Returns the mean particle area, the max particle area and the percent of the
+    dirt area in particles over ~100 microns in diameter. DirtSizes is the array
+    of particle sizes (in pixels), a particle array from particleStats or a
+    SizeAccumulator.
+    """
+    return asSizeAccumulator(DirtSizes, res).sizeData()
+
+####################################################################################
+
+####################################################################################
+
+def asSizeAccumulator(sizes, res):
+    """
+    Returns sizes if it is a SizeAccumulator, and otherwise a new SizeAccumulator
+    of the particle sizes (in pixels) or particle array (from particleStats).
+    """
+    if isinstance(sizes, SizeAccumulator):
+        return sizes
+    acc = SizeAccumulator(res)
+    acc.update(sizes)
+    return acc
+
+####################################################################################
+
+####################################################################################
+
+# Area of a particle with a diameter of about 100 microns (~7854 square microns)
+AREA_OVER_100 = 7850
+
+class SizeAccumulator:
+    """
+    Streaming summary of the dirt particle sizes of any number of images. It
+    keeps the exact count, total area, max area and the number and area of the
+    particles over ~100 microns in diameter, and a histogram of the particle
+    areas (count and total area per bin) with log-spaced bins. It has the same
+    small size for a single sub-image and for a whole foil.
+        Key-word Arguments:
+         - res = 1 - resolution of the images, in square microns per pixel
+         - minArea = .01 - lower edge of the first bin, in square microns
+         - maxArea = 1e9 - upper edge of the last bin, in square microns
+         - binsPerDecade = 10 - number of bins per power of ten
+    Particles outside of the bin range go in the first or last bin, but still
+    count exactly in the totals.
+    """
+    def __init__(self, res=1, minArea=.01, maxArea=1e9, binsPerDecade=10):
+        self.res = res
+        numBins = int(round(np.log10(float(maxArea)/minArea)*binsPerDecade))
+        self.edges = np.logspace(np.log10(minArea), np.log10(maxArea), numBins+1)
+        self.counts = np.zeros((numBins,), dtype=np.int64)
+        self.areas = np.zeros((numBins,), dtype=np.float64)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.numOver100 = 0
+        self.areaOver100 = 0
+
+    def update(self, sizes):
+        """
+        Adds the particles of one image: an array of particle sizes in pixels,
+        or a particle array from particleStats.
+        """
+        sizes = np.asarray(sizes)
+        if sizes.dtype.names is not None:
+            sizes = sizes['area']
+        if sizes.size == 0:
+            return self
+        areas = sizes.ravel()*self.res
+        self.count += areas.size
+        self.total += areas.sum()
+        self.max = max(self.max, areas.max())
+        over = areas[areas>AREA_OVER_100]
+        self.numOver100 += over.size
+        self.areaOver100 += over.sum()
+        bins = np.searchsorted(self.edges, areas, side='right') - 1
+        bins = np.clip(bins, 0, self.counts.size-1)
+        self.counts += np.bincount(bins, minlength=self.counts.size)
+        self.areas += np.bincount(bins, weights=areas, minlength=self.counts.size)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the particles of another SizeAccumulator (with the same bins), i.e.
+        the partial result of another worker.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise Exception("Cannot merge size accumulators with different bins.")
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.numOver100 += other.numOver100
+        self.areaOver100 += other.areaOver100
+        self.counts += other.counts
+        self.areas += other.areas
+        return self
+
+    def sizeData(self):
+        """
+        Returns (mean particle area, max particle area, percent of the dirt area
+        in particles over ~100 microns in diameter), as getDirtSizeData.
+        """
+        if self.count == 0:
+            return "'--", "'--", "'--"
+        MeanSize = round(float(self.total)/self.count,1)
+        percAreaOver100 = round(100*(float(self.areaOver100)/self.total),2)
+        return MeanSize, self.max, percAreaOver100
+
+    def histogram(self):
+        """
+        Returns the particle count and the total particle area of every bin, and
+        the bin edges (in square microns).
+        """
+        return self.counts.copy(), self.areas.copy(), self.edges.copy()
+
+    def save(self, path):
+        """
+        Writes the accumulator to a small .npz file.
+        """
+        np.savez(path, res=self.res, edges=self.edges, counts=self.counts,
+                 areas=self.areas, totals=np.array([self.count, self.total, self.max,
+                                                    self.numOver100, self.areaOver100]))
+
+    @staticmethod
+    def load(path):
+        """
+        Reads an accumulator written by save.
+        """
+        f = np.load(path)
+        acc = SizeAccumulator(f['res'].item())
+        acc.edges = f['edges']
+        acc.counts = f['counts']
+        acc.areas = f['areas']
+        totals = f['totals']
+        acc.count = int(totals[0])
+        acc.numOver100 = int(totals[3])
+        # Keep integer totals integers, as they are for integer resolutions
+        if totals.dtype.kind in 'iu':
+            acc.total, acc.max, acc.areaOver100 = [int(t) for t in totals[[1,2,4]]]
+        else:
+            acc.total, acc.max, acc.areaOver100 = [t.item() for t in totals[[1,2,4]]]
+        f.close()
+        return acc
 
 ####################################################################################
 
 ####################################################################################
 
 def makeSizeHistogram(sizes, res, name, path):
-    AreaSizes = sizes*res
-    histoRange = AreaSizes.max()
-    sizeHist,bins = np.histogram(AreaSizes,bins=histoRange)
-    x = np.arange(1,histoRange+1,1)
-    normHistoByArea = sizeHist*x
+    """
+    Plots the dirt particle area in each size bin against the particle size and
+    saves it to path as <name>_DirtPartSize_Hist.png. sizes is the array of 
+    particle sizes (in pixels), a particle array from particleStats or a
+    SizeAccumulator.
+    """
+    import matplotlib.pyplot as plt # Only loaded when a plot is made
+    counts, areas, edges = asSizeAccumulator(sizes, res).histogram()
+    # Geometric bin centers, for the log size axis
+    x = np.sqrt(edges[:-1]*edges[1:])
     FIG=plt.figure()
     PLT = FIG.add_subplot(111)
     FIG.suptitle(name+" Histograms")
     
     plt.xlabel("Particle Size in square Microns")
-    plt.ylabel("Count")
-    PLT.plot(x, normHistoByArea)
+    plt.ylabel("Dirt area in size bin (square Microns)")
+    used = np.nonzero(counts)[0]
+    if used.size:
+        x, areas = x[used[0]:used[-1]+1], areas[used[0]:used[-1]+1]
+    PLT.semilogx(x, areas)
     FIG.savefig(os.path.join(path,name+"_DirtPartSize_Hist.png"))
     print "Histogram plot for "+name+" finished."
     plt.close()
@@ -1,15 +1,14 @@
 # -*- coding: utf-8 -*-
-import cv2
 import os
 import numpy as np
 import GenSIP.functions as fun
 import GenSIP.measure as meas
 import GenSIP.gencsv as gencsv
-
-from GenSIP.cleantests.moly import Monalysis
-from GenSIP.cleantests.dirt import dirtnalysis
-from GenSIP.bigscans.bigfoils import ImgAnalysis
-from GenSIP.histomethod.mainanalysis import analyzeByHisto
+import GenSIP.postercache as postercache
+import GenSIP.mapwriter as mapwriter
+import GenSIP.kuwahara as K
+import GenSIP.pipeline as pipe
+from multiprocessing import Pool
 
 ################################################################################
 
@@ -38,7 +37,10 @@ def animorf (path, res, method="cleantests", **kwargs):
                             directly from those thresholded images. No matter what
                             you assign the path variable, if method='standards', 
                             then the function will work with the standard images. 
-        - MoDirt = 'Mo' - option to do molybdenum or dirt analysis
+        - MoDirt = 'Mo' - option to do molybdenum or dirt analysis, or 'both'
+                    to do both in one pass. 'both' shares the image, mask and 
+                    poster between the two analyses, writes the PtMaps and 
+                    DirtMaps folders and one CSV file with the results of both.
         - Mask = 0 - option to include a path string to either a single mask (in 
                     the case that the path variable links to a single image) or 
                     a folder of masks with the same name as the image they corre-
@@ -54,6 +56,22 @@ def animorf (path, res, method="cleantests", **kwargs):
                     masking off the dark background around the foil.If this option
                     is set to True, then any input for the Mask variable is over
                     -ridden.
+        - posterCache = 'Output/PosterCache/' - folder where posters are 
+                    cached between runs (see GenSIP.postercache), so running 
+                    again over the same images, for example with MoDirt switched, 
+                    skips the Kuwahara filtering. None keeps posters in memory only.
+        - mapFormat = 'png' - file format of the maps and posters: 'png', 
+                    'fastpng', 'png1' (1 bit PNG), 'bits' (packed bits in .npz)
+                    or 'none' (see GenSIP.mapwriter).
+        - workers = 1 - number of processes analyzing the images of a folder at
+                    the same time. Each worker writes the maps of its images, 
+                    and the CSV file is the same as with workers = 1. 
+        - pipeline = True - with one worker, decode the next images and write 
+                    the maps of the previous ones on background threads while
+                    an image is analyzed (see GenSIP.pipeline). 
+        - resume = False - the CSV file is written one row per finished image
+                    (see GenSIP.gencsv). If True, the images that already have a 
+                    row in the CSV file of an earlier, unfinished run are skipped.
         - verbose = False - makes the function verbose.
 
     """
@@ -64,9 +82,17 @@ def animorf (path, res, method="cleantests", **kwargs):
     verbose = kwargs.get('verbose',False)
     autoMask = kwargs.get('autoMaskEdges',False)
     stdDir = kwargs.get('stdDir', 'standards/')
+    posterCache = kwargs.get('posterCache', 'Output/PosterCache/')
+    workers = kwargs.get('workers', 1) # Processes analyzing a folder of images
+    resume = kwargs.get('resume', False) # Skip the images of an unfinished run
+    threaded = kwargs.get('pipeline', True) # Overlap decoding, analysis and PNG writing
+    mapFormat = kwargs.get('mapFormat', 'png') # See GenSIP.mapwriter
+    
+    # Keep posters on disk so later runs over the same images can reuse them
+    postercache.setCacheDir(posterCache)
     
-    # Standardize MoDirt to 'mo' or 'dirt' using checkMoDirt
-    MoDirt = fun.checkMoDirt(MoDirt)
+    # Standardize MoDirt to 'mo', 'dirt' or 'both' using checkMoDirt
+    MoDirt = fun.checkMoDirt(MoDirt, allowBoth=True)
     
     filetypes = ['.tif', '.jpg', '.jpeg','.tiff']
     
@@ -88,29 +114,31 @@ def animorf (path, res, method="cleantests", **kwargs):
     
     if genPoster: posterFolder = outFolder+'/PosterMaps/'
     
-    if MoDirt == 'mo':
-        mapFolder = os.path.join(outFolder,'PtMaps/')
-    else:
-        mapFolder = os.path.join(outFolder,'DirtMaps/')
+    mapFolders = []
+    if MoDirt in ('mo','both'):
+        mapFolders.append(os.path.join(outFolder,'PtMaps/'))
+    if MoDirt in ('dirt','both'):
+        mapFolders.append(os.path.join(outFolder,'DirtMaps/'))
         
-    if not os.path.exists(mapFolder): os.makedirs(mapFolder)
-    if not os.path.exists(mapFolder): os.makedirs(mapFolder)
+    for mapFolder in mapFolders:
+        if not os.path.exists(mapFolder): os.makedirs(mapFolder)
     if genPoster and not os.path.exists(posterFolder): os.makedirs(posterFolder)
     
     """Create Data Dictionary"""
     # Iterate through the images within a folder if the path is to a directory, 
     # and run analyzeImg on each of image, then write the results to the Data 
-    # Dictionary. 
-    Data = {}
+    # Dictionary and a row of the CSV file. 
+    filePath = os.path.join(outFolder,MoDirt.capitalize()+'_ouput_'+name+'.csv')
+    CSV = gencsv.DataToCSV(filePath, name, resume=resume)
+    Data = dict(CSV.DoneData)
     
     # OPERATE ON FOLDER OF IMAGES ==============================================
     if os.path.isdir(path):
         
         # Get list of images in directory
-        images = [f for f in os.listdir(path) if os.path.splitext(f)[1] in filetypes]
-        # Create paths to those images
-        imgPaths = [os.path.join(path,f) for f in images]
-        imgPaths.sort()
+        images = sorted([f for f in os.listdir(path) if os.path.splitext(f)[1] in filetypes])
+        # One (name, path) item per image
+        items = [(os.path.splitext(f)[0], os.path.join(path,f)) for f in images]
         if Mask!=0:
             assert type(Mask)==str, """
                                     'Mask' kwarg must be a path to a directory
@@ -120,84 +148,266 @@ def animorf (path, res, method="cleantests", **kwargs):
                                         'Mask' kwarg must be a path to a directory
                                         if the 'path' variable is a path to a directory.
                                         """
-            # Get list of images in directory
-            masks  = [m for m in os.listdir(Mask) if os.path.splitext(m)[1] in filetypes]
-            # Create paths to those images
-            maskPaths = [os.path.join(Mask,m) for m in masks]
-            # I am assuming the mask name will be the same as the corresponding 
-            # name in the image folder, so when both are sorted, they should match. 
-            maskPaths.sort() 
-            
+            # The mask of an image has the same name as the image
+            masks = maskIndex(Mask, filetypes)
         else:
-            maskPaths = [0 for f in imgPaths]
-        
-        for i in range(len(images)):
-            # Make the mask image from the mask path
-            if Mask!=0: mask = fun.loadImg(maskPaths[i])
-            else: mask=0
-            # run analysis on the image
-            statsDict, picts = analyzeImage(imgPaths[i], res, 
-                                            method=method, MoDirt=MoDirt, 
-                                            Mask=mask,autoMaskEdges=autoMask,
-                                            stdDir=stdDir, verbose=verbose)
-            imgName = os.path.splitext(images[i])[0]
-            # Assign to Data Dictionary
-            Data[imgName] = statsDict
-            (threshed,
-             poster) = picts
-            threshed = threshed.astype(np.uint8)
-            threshed[threshed!=0]=255
-            poster = poster.astype(np.uint8)
-            
-            # Create the output images
-            cv2.imwrite(mapFolder+imgName+'.png',
-                        threshed, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
-            if genPoster:
-                cv2.imwrite(posterFolder+imgName+'.png',
-                            poster, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+            masks = None
                             
     # OPERATE ON A SINGLE IMAGE ================================================
     else:
-        # run analysis on the image
-        statsDict, picts = analyzeImage(path, res, 
-                                        method=method, MoDirt=MoDirt, 
-                                        Mask=Mask,autoMaskEdges=autoMask,
-                                        stdDir=stdDir, verbose=verbose)
-        Data[name] = statsDict
-        (threshed,
-         poster) = picts
-        threshed = threshed.astype(np.uint8)
-        threshed[threshed!=0]=255
-        poster = poster.astype(np.uint8)
-        poster[poster!=0]=255
-        # Create the output images
-        cv2.imwrite(mapFolder+name+'.png',
-                    threshed, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
-        if genPoster:
-            cv2.imwrite(posterFolder+name+'.png',
-                        poster, [cv2.cv.CV_IMWRITE_PNG_COMPRESSION,6])
+        items = [(name, path, Mask)]
+        masks = None
+        
+    # Run the analysis on the images that are not in the CSV file yet. The maps
+    # are written as the images finish, and the rows in the order of the images.
+    items = [item for item in items if not CSV.isDone(item[0])]
+    results = analyzeBatch(items, res, method=method, MoDirt=MoDirt, 
+                           Masks=masks, autoMaskEdges=autoMask, 
+                           stdDir=stdDir, verbose=verbose, 
+                           workers=workers, pipeline=threaded,
+                           mapFolders=mapFolders, mapFormat=mapFormat,
+                           posterFolder=posterFolder if genPoster else None)
+    for imgName, statsDict, picts in results:
+        Data[imgName] = statsDict
+        _writeImageRow(CSV, imgName, statsDict)
                         
-    """Write the output to a CSV file"""
-    filePath = os.path.join(outFolder,MoDirt.capitalize()+'_ouput_'+name+'.csv')
-    CSV = gencsv.DataToCSV(filePath, name)   
-    CSV.writeDataFromDict(Data,FirstColHead='Image')
+    """Finish the CSV file"""
+    CSV.writeFooter(Data)
     CSV.closeCSVFile() 
             
 ################################################################################
 
 ################################################################################
 
+# Names accepted for each analysis method
+CLEANTESTS = ['cleantests','smallfoils','cleantest','ct','foils']
+BIGFOILS = ['bigfoils','big','bigscans','no border']
+HISTOGRAM = ['newmethod', 'histograms', 'histo', 'histogram']
+STANDARDS = ['standards','standard','std','stds']
+
+################################################################################
+
+################################################################################
+
+def analyzeBatch(items, res, method='cleantests', **kwargs):
+    """
+    Runs analyzeImage on a batch of images, and returns a generator of 
+    (name, statsDict, picts) for every image, in the order of the images. 
+    statsDict and picts are what analyzeImage returns for the image. 
+    'items' is either:
+        - an iterable of (name, image, mask) or (name, image) tuples. The image
+          and mask are numpy arrays, or paths to image files that are loaded 
+          ahead of the analysis. A mask of 0 or None means no mask.
+        - a numpy stack of images (first axis = image), named by the 'names' 
+          kwarg.
+    Masks are paired with the images by name, never by their order.
+    Example:
+        > for name, data, picts in analyzeBatch(frames, 16, MoDirt='both'):
+    Kwargs:
+        - method, MoDirt = 'mo', autoMaskEdges = False, stdDir = 'standards/', 
+          verbose = False - as in analyzeImage.
+        - Masks = None - masks of the images that have none in their tuple: a 
+                    dictionary {name: mask or path} (see maskIndex), or for a 
+                    stack of images, a stack of masks in the same order. An image
+                    without an entry raises an Exception.
+        - names = None - names of the images of a stack. Default is 
+                    'img_0000', 'img_0001', ...
+        - workers = 1 - number of processes analyzing images at the same time.
+        - pipeline = True - with one worker, load the next images and write the 
+                    maps of the previous ones on background threads (see 
+                    GenSIP.pipeline).
+        - mapFolders = None - folders to write the maps of every image to, as
+                    '<name>.png', one folder for each map of picts. The maps are
+                    written where the image was analyzed, and picts is None in 
+                    the results so that the workers do not send them back.
+        - posterFolder = None - folder to write the posters to.
+        - mapFormat = 'png' - file format of the maps and posters (see 
+                    GenSIP.mapwriter).
+    """
+    MoDirt = fun.checkMoDirt(kwargs.get('MoDirt', 'mo'), allowBoth=True)
+    Masks = kwargs.get('Masks', None) # {name: mask}, or a stack of masks
+    names = kwargs.get('names', None) # Names of the images of a stack
+    autoMask = kwargs.get('autoMaskEdges', False)
+    stdDir = kwargs.get('stdDir', 'standards/')
+    verbose = kwargs.get('verbose', False)
+    workers = kwargs.get('workers', 1) # Processes analyzing the images
+    threaded = kwargs.get('pipeline', True) # Overlap decoding, analysis and PNG writing
+    mapFolders = kwargs.get('mapFolders', None) # Write the maps here
+    posterFolder = kwargs.get('posterFolder', None) # Write the posters here
+    mapFormat = kwargs.get('mapFormat', 'png') # File format of the maps
+    
+    # Fail before any image is analyzed
+    mapwriter.getFormat(mapFormat)
+    
+    if type(items)==np.ndarray:
+        if names is None:
+            names = ['img_%04d' % i for i in range(len(items))]
+        if type(Masks)==np.ndarray:
+            Masks = dict(zip(names, Masks))
+        items = zip(names, items)
+        
+    def makeTask(item):
+        name, img = item[:2]
+        if len(item) > 2:
+            mask = item[2]
+        elif Masks is None:
+            mask = 0
+        elif name in Masks:
+            mask = Masks[name]
+        else:
+            raise Exception("No mask for image: %s" % name)
+        return (img, name, mask, res, method, MoDirt, autoMask, stdDir, verbose,
+                mapFolders, posterFolder, mapFormat)
+    
+    if hasattr(items, '__len__'):
+        tasks = [makeTask(item) for item in items]
+        count = len(tasks)
+    else:
+        # Leave an iterator (frames coming from a camera, for instance) lazy
+        tasks = (makeTask(item) for item in items)
+        count = None
+        
+    if workers <= 1 or (count is not None and count <= 1):
+        stats = pipe.PipelineStats()
+        for result in pipe.iterPipeline(tasks, _loadImage, _analyzeLoaded, 
+                                        _writeMaps, threaded=threaded, stats=stats):
+            yield result
+        if verbose: print stats.report()
+        return
+        
+    # Workers may save posters to the cache at the same time, so make the 
+    # folder before they start.
+    posterCache = postercache.POSTER_CACHE.cacheDir
+    if posterCache and not os.path.exists(posterCache):
+        os.makedirs(posterCache)
+    # A few chunks per worker keeps the pool busy when some images are slower
+    # than others without sending every image separately.
+    chunksize = max(1, (count or 0)//(workers*4))
+    pool = Pool(workers, initializer=_initWorker, initargs=(posterCache,))
+    try:
+        # imap keeps the order of the tasks
+        for result in pool.imap(_animorfImage, tasks, chunksize):
+            yield result
+    except:
+        # Also stops the workers when the caller stops iterating early
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+def maskIndex(folder, filetypes=('.tif','.jpg','.jpeg','.tiff')):
+    """
+    Returns a dictionary of the paths to the masks in 'folder', keyed by the 
+    name of the image they belong to (the file name of the mask without its
+    extension), for the 'Masks' kwarg of analyzeBatch.
+    """
+    return dict([(os.path.splitext(m)[0], os.path.join(folder,m)) 
+                 for m in os.listdir(folder) 
+                 if os.path.splitext(m)[1] in filetypes])
+
+################################################################################
+
+################################################################################
+
+def _initWorker(posterCache):
+    # Runs once in every worker process of analyzeBatch
+    postercache.setCacheDir(posterCache)
+    # The pool already keeps every CPU busy
+    K.DEFAULT_WORKERS = 1
+
+def _animorfImage(task):
+    """
+    Analyzes one image of a batch and writes its maps (and poster). Returns
+    the result of the image for analyzeBatch. Module level so that it can be 
+    sent to the worker processes.
+    """
+    return _writeMaps(task, _analyzeLoaded(task, _loadImage(task)))
+
+def _loadImage(task):
+    # Decode stage: the image and its mask, from their paths if they are not 
+    # loaded yet
+    img, mask = task[0], task[2]
+    if type(img)==str:
+        img = fun.loadImg(img)
+    if mask is None:
+        mask = 0
+    elif type(mask)==str:
+        mask = fun.loadImg(mask)
+    return img, mask
+
+def _analyzeLoaded(task, loaded):
+    # Compute stage: run analysis on the image
+    (img, imgName, mask, res, method, MoDirt, autoMask, stdDir, verbose,
+     mapFolders, posterFolder, mapFormat) = task
+    # The standards method finds the standard maps by the name of the image
+    path = img if type(img)==str else imgName
+    img, mask = loaded
+    return analyzeImage(path, res, 
+                        method=method, MoDirt=MoDirt, 
+                        Mask=mask,autoMaskEdges=autoMask,
+                        stdDir=stdDir, verbose=verbose, img=img)
+
+def _writeMaps(task, analyzed):
+    # Encode stage: write the maps (and poster) of the image. Returns the result
+    # of the image for analyzeBatch.
+    imgName = task[1]
+    mapFolders, posterFolder, mapFormat = task[9:12]
+    statsDict, picts = analyzed
+    # The last picture is the poster, the others are the maps in the 
+    # same order as mapFolders
+    threshedMaps, poster = picts[:-1], picts[-1]
+    
+    # Create the output images
+    if mapFolders is not None:
+        for mapFolder, threshed in zip(mapFolders, threshedMaps):
+            threshed = threshed.astype(np.uint8)
+            threshed[threshed!=0]=255
+            mapwriter.writeMap(mapFolder, imgName, threshed, mapFormat)
+        picts = None
+    if posterFolder is not None:
+        mapwriter.writeMap(posterFolder, imgName, poster.astype(np.uint8), 
+                           mapFormat, binary=False)
+    return imgName, statsDict, picts
+
+def _writeImageRow(CSV, imgName, statsDict):
+    # The columns are the sorted entries of the first image, as writeDataFromDict
+    # would make them
+    if CSV.colHeads is None:
+        CSV.startStream(['Image']+sorted([k for k in statsDict 
+                                          if type(statsDict[k])!=dict]))
+    CSV.writeRow(imgName, statsDict)
+
+################################################################################
+
+################################################################################
+
 def analyzeImage(path, res, method='cleantests', MoDirt='mo', 
-                 Mask=0, autoMaskEdges=False, stdDir='standards/', verbose=False):
+                 Mask=0, autoMaskEdges=False, stdDir='standards/', verbose=False,
+                 img=None):
     """
     Given the path, runs analysis on a single image using one of the methods in
-    GenSIP specified by the 'method' kwarg (currently: cleantests or bigfoils). 
+    GenSIP specified by the 'method' kwarg (see METHODS). 
     Returns a Data Dictionary and the thresholded image and poster.
+    If MoDirt is 'both', the image, mask, poster and blurred images are made 
+    once and shared by the Mo and the dirt analysis. The Data Dictionary then 
+    holds the results of both, and the pictures are (PtMap, DirtMap, poster).
+    img is the image at path if it has already been loaded (by the decode stage
+    of animorf's pipeline, for instance). To analyze images that are already in
+    memory, see analyzeBatch.
     """
-    img = fun.loadImg(path)
-    MoDirt = fun.checkMoDirt(MoDirt)
+    backend = METHODS.get(method.lower())
+    if backend is None:
+        raise Exception("""The specified method is not available: {0} \n
+                           Method should be one of the following: \n
+                           'cleantests','bigfoils','histogram','standard'.
+                           """.format(str(method)))
+    if img is None:
+        img = fun.loadImg(path)
+    MoDirt = fun.checkMoDirt(MoDirt, allowBoth=True)
+    doMo = MoDirt in ('mo','both')
+    doDirt = MoDirt in ('dirt','both')
     
-    if Mask==0:
+    if Mask is None or (type(Mask)!=np.ndarray and Mask==0):
         mask = np.ones(img.shape)
     elif type(Mask)==np.ndarray and Mask.shape == img.shape:
         mask = Mask.copy()
@@ -209,161 +419,43 @@ def analyzeImage(path, res, method='cleantests', MoDirt='mo',
         maskedImg, mask = fun.maskEdge(img)
     retData = {}
     
-    # MOLYBDENUM ANALYSIS ======================================================
-    if MoDirt == 'mo':
-        # Method used by cleantests  ––––––––––––––––––––––––––––––––––––
-        if method.lower() in ['cleantests','smallfoils', 'cleantest']:
-            (PtArea, 
-            FoilArea, 
-            MolyArea, 
-            MolyMass, 
-            threshed) = Monalysis(img, res,verbose=verbose)
-            
-            PercPt = 100*PtArea/FoilArea
-            poster = fun.makePoster(img)
-        
-        # Method used by bigfoils  –––––––––––––––––––––––––––––––––––––
-        elif method.lower() in ['bigfoils','big','bigscans','no border']:
-            stats, picts = ImgAnalysis(img, mask, res, MoDirt=MoDirt,returnSizes=False)
-            (PtArea,
-            FoilArea,
-            PercPt) = stats
-            MolyArea = FoilArea-PtArea
-            MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
-            (threshed, poster) = picts
-            
-        # Method Used by Histogram Analysis (newmethod) ––––––––––––––––––––
-        elif method.lower() in ['newmethod', 'histograms', 'histo', 'histogram']:
-            stats, picts = analyzeByHisto (img, res, 
-                                           Mask=mask, verbose=verbose,
-                                           MoDirt=MoDirt, returnPoster=True,
-                                           returnData=False,returnSizes=False)
-            (PtArea,
-            PercPt,
-            FoilArea) = stats
-            
-            MolyArea = FoilArea-PtArea
-            MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
-            
-            (threshed, poster) = picts
-            
-        # STANDARD ANALYSIS –––––––––––––––––––––––––––––––––––––––––––
-        elif method.lower() in ['standards','standard','std','stds']:
-            poster = fun.posterfy(img)
-            imgName = os.path.splitext(os.path.split(path)[1])[0]
-            PtMapPath = os.path.join(stdDir, 'all_plat/')+imgName+'.png'
-            if os.path.exists(PtMapPath):
-                threshed = fun.loadImg(PtMapPath)
-                PtArea = meas.calcExposedPt(threshed, res, getAreaInSquaremm=True)
-                PixFoil = np.sum(mask.astype(np.bool_))
-                FoilArea = round(PixFoil*res*10**-6, 4)
-                MolyArea = FoilArea-PtArea
-                MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
-                if FoilArea == 0:
-                    PercPt = 0
-                else:
-                    PercPt = round(float(PtArea)/float(FoilArea)*100,2)
-            else:
-                print "Not a standard: " + imgName
-                print "  File path does not Exist: " + PtMapPath
-                retData = blankDataDict(MoDirt)
-                threshed = blankImg(img.shape)
-                return retData, (threshed, poster)
+    results, poster = backend(img, mask, res, doMo, doDirt, path=path, 
+                              stdDir=stdDir, verbose=verbose)
                 
-        # UNMATCHED METHOD ––––––––––––––––––––––––––––––––––––––––––––
-        else:
-            raise Exception("""The specified method is not available: {0} \n
-                               Method should be one of the following: \n
-                               'cleantests','bigfoils','histogram','standard'.
-                               """.format(str(method)))
-                            
-        # Prepare Return Data Dictionary ---------------------------------------
-        retData = {'Pt Area (mm^2)':round(PtArea,4),
-                    'Foil Area (mm^2)':round(FoilArea,2),
-                    'Moly Area (mm^2)':round(MolyArea,3),
-                    'Mass Molybdenum (micrograms)':round(MolyMass,3),
-                    '% Exposed Pt':round(PercPt,3)}
+    # MOLYBDENUM RESULTS =======================================================
+    if doMo:
+        # A backend only sets moData when it has no results for the image
+        moData = results.get('moData')
+        if moData is None:
+            moData = {'Pt Area (mm^2)':round(results['PtArea'],4),
+                      'Foil Area (mm^2)':round(results['FoilArea'],2),
+                      'Moly Area (mm^2)':round(results['MolyArea'],3),
+                      'Mass Molybdenum (micrograms)':round(results['MolyMass'],3),
+                      '% Exposed Pt':round(results['PercPt'],3)}
+        retData.update(moData)
                     
-    # DIRT ANALYSIS ============================================================
-    elif MoDirt == 'dirt':
-        
-        # Method used by cleantests  ––––––––––––––––––––––––––––––––––––
-        if method.lower() in ['cleantests','smallfoils', 'cleantest','ct','foils']:
-            (DirtNum,
-             DirtArea,
-             threshed,
-             DirtSizes) = dirtnalysis (img, res, MaskEdges=True, retSizes=True)
-                         
-            poster = fun.makePoster(img)
+    # DIRT RESULTS =============================================================
+    if doDirt:
+        dirtData = results.get('dirtData')
+        if dirtData is None:
+            (MeanSize, 
+            MaxSize, 
+            percOver100) = meas.getDirtSizeData(results['DirtSizes'], res)
             
-        # Method used by bigfoils  –––––––––––––––––––––––––––––––––––––
-        elif method.lower() in ['bigfoils','big','bigscans','no border']:
-            stats, picts = ImgAnalysis(img, mask, res, 
-                                       MoDirt=MoDirt,returnSizes=True)
-            (DirtNum,
-             DirtArea,
-             AreaFoil,
-             Perc,
-             DirtSizes) = stats
-                                     
-            (threshed, poster) = picts
-            
-        # Method Used by Histogram Analysis (newmethod) ––––––––––––––––––––
-        elif method.lower() in ['newmethod', 'histograms', 'histo', 'histogram']:
-            stats, picts = analyzeByHisto (img, res, 
-                                           Mask=mask, verbose=verbose,
-                                           MoDirt=MoDirt, returnPoster=True,
-                                           returnData=False,returnSizes=True)
-            (DirtNum,
-             DirtArea,
-             DirtSizes,
-             AreaFoil) = stats
-            
-            
-            (threshed, poster) = picts
-            
-        # STANDARD ANALYSIS –––––––––––––––––––––––––––––––––––––––––––
-        elif method.lower() in ['standards','standard','std','stds']:
-            poster = fun.posterfy(img)
-            imgName = os.path.splitext(os.path.split(path)[1])[0]
-            DirtMapPath = os.path.join(stdDir, 'all_dirt/')+imgName+'.png'
-            if os.path.exists(DirtMapPath):
-                threshed = fun.loadImg(DirtMapPath)
-                (DirtArea, 
-                DirtNum,
-                DirtSizes,
-                labeled) = meas.calcDirt(threshed,
-                                         res, 
-                                         returnSizes=True,
-                                         returnLabelled=True, 
-                                         getAreaInSquaremm=True) 
-            else:
-                print "Not a standard: " + imgName
-                print "  File path does not Exist: " + DirtMapPath
-                retData = blankDataDict(MoDirt)
-                threshed = blankImg(img.shape)
-                return retData, (threshed, poster)
-                
-        # UNMATCHED METHOD ––––––––––––––––––––––––––––––––––––––––––––
-        else:
-            raise Exception("""The specified method is not available: {0} \n
-                               Method should be one of the following: \n
-                               'cleantests','bigfoils','histogram','standard'.
-                               """.format(str(method)))
-        
-        # Prepare Return Data Dictionary ---------------------------------------
-        (MeanSize, 
-        MaxSize, 
-        percOver100) = meas.getDirtSizeData(DirtSizes, res)
-        
-        retData = {'Dirt Count':DirtNum,
-                    'Dirt Area (mm^2)':round(DirtArea, 5),
-                    'Mean Particle Area (micron^2)':round(MeanSize,1),
-                    'Max Particle Area (micron^2)':round(MaxSize,1),
-                    '% Dirt Particles over 100micron diameter':round(percOver100,3)}
+            dirtData = {'Dirt Count':results['DirtNum'],
+                        'Dirt Area (mm^2)':round(results['DirtArea'], 5),
+                        'Mean Particle Area (micron^2)':round(MeanSize,1),
+                        'Max Particle Area (micron^2)':round(MaxSize,1),
+                        '% Dirt Particles over 100micron diameter':round(percOver100,3)}
+        retData.update(dirtData)
     
     # Return results
-    retPicts = (threshed,poster)
+    if MoDirt == 'mo':
+        retPicts = (results['PtMap'],poster)
+    elif MoDirt == 'dirt':
+        retPicts = (results['DirtMap'],poster)
+    else:
+        retPicts = (results['PtMap'],results['DirtMap'],poster)
         
     return retData, retPicts
       
@@ -371,20 +463,188 @@ def analyzeImage(path, res, method='cleantests', MoDirt='mo',
 
 ################################################################################
 
+# Analysis methods of analyzeImage: every accepted method name (lower case) 
+# maps to the backend that runs it. The backends import their modules the first
+# time they run, so importing nexus does not load cleantests, bigscans and 
+# histomethod, and a worker process only loads the method it uses.
+METHODS = {}
+
+def registerMethod(names, backend):
+    """
+    Makes analyzeImage run 'backend' for each of the method names in 'names'.
+    The backend is called as 
+        backend(img, mask, res, doMo, doDirt, path=..., stdDir=..., verbose=...)
+    and returns a results dictionary and the poster. The results hold PtArea, 
+    FoilArea, MolyArea, MolyMass, PercPt and PtMap if doMo is True, and DirtNum,
+    DirtArea, DirtSizes and DirtMap if doDirt is True. If the backend has no 
+    results for the image, it sets moData or dirtData to the Data Dictionary 
+    to report instead (see blankDataDict).
+    """
+    for name in names:
+        METHODS[name.lower()] = backend
+
+################################################################################
+
+################################################################################
+
+def _cleantestsBackend(img, mask, res, doMo, doDirt, **kwargs):
+    # Method used by cleantests
+    from GenSIP.cleantests.moly import Monalysis
+    from GenSIP.cleantests.dirt import dirtnalysis
+    verbose = kwargs.get('verbose', False)
+    results = {}
+    poster = fun.makePoster(img)
+    blurs = fun.regionBlurs(img)
+    if doMo:
+        (PtArea, 
+        FoilArea, 
+        MolyArea, 
+        MolyMass, 
+        PtMap) = Monalysis(img, res, verbose=verbose, 
+                           poster=poster, blurs=blurs)
+        results.update(PtArea=PtArea, FoilArea=FoilArea, MolyArea=MolyArea,
+                       MolyMass=MolyMass, PercPt=100*PtArea/FoilArea, PtMap=PtMap)
+    if doDirt:
+        (DirtNum,
+         DirtArea,
+         DirtMap,
+         DirtSizes) = dirtnalysis (img, res, MaskEdges=True, retSizes=True,
+                                   poster=poster, blurs=blurs)
+        results.update(DirtNum=DirtNum, DirtArea=DirtArea, DirtSizes=DirtSizes,
+                       DirtMap=DirtMap)
+    return results, poster
+
+def _bigfoilsBackend(img, mask, res, doMo, doDirt, **kwargs):
+    # Method used by bigfoils
+    from GenSIP.bigscans.bigfoils import ImgAnalysis
+    import GenSIP.bigscans.images as images
+    results = {}
+    poster = images.bigPosterfy(images.bigPostPreProc(img))
+    blurs = fun.regionBlurs(img)
+    if doMo:
+        stats, picts = ImgAnalysis(img, mask, res, MoDirt='mo',returnSizes=False,
+                                   poster=poster, blurs=blurs)
+        (PtArea,
+        FoilArea,
+        PercPt) = stats
+        MolyArea = FoilArea-PtArea
+        MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
+        results.update(PtArea=PtArea, FoilArea=FoilArea, MolyArea=MolyArea,
+                       MolyMass=MolyMass, PercPt=PercPt, PtMap=picts[0])
+    if doDirt:
+        stats, picts = ImgAnalysis(img, mask, res, MoDirt='dirt',returnSizes=True,
+                                   poster=poster, blurs=blurs)
+        (DirtNum,
+         DirtArea,
+         AreaFoil,
+         Perc,
+         DirtSizes) = stats
+        results.update(DirtNum=DirtNum, DirtArea=DirtArea, DirtSizes=DirtSizes,
+                       DirtMap=picts[0])
+    return results, poster
+
+def _histogramBackend(img, mask, res, doMo, doDirt, **kwargs):
+    # Method Used by Histogram Analysis (newmethod)
+    from GenSIP.histomethod.mainanalysis import analyzeByHisto
+    verbose = kwargs.get('verbose', False)
+    # analyzeByHisto makes the Pt and the dirt map in the same pass anyway,
+    # so always ask for both.
+    stats, picts = analyzeByHisto (img, res, 
+                                   Mask=mask, verbose=verbose,
+                                   MoDirt='both', returnPoster=True,
+                                   returnData=False,returnSizes=True)
+    (PtArea,
+    PercPt,
+    DirtNum,
+    DirtArea,
+    DirtSizes,
+    FoilArea) = stats
+    
+    MolyArea = FoilArea-PtArea
+    MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
+    
+    (PtMap, DirtMap, poster) = picts
+    results = dict(PtArea=PtArea, FoilArea=FoilArea, MolyArea=MolyArea,
+                   MolyMass=MolyMass, PercPt=PercPt, PtMap=PtMap, 
+                   DirtNum=DirtNum, DirtArea=DirtArea, DirtSizes=DirtSizes,
+                   DirtMap=DirtMap)
+    return results, poster
+
+def _standardsBackend(img, mask, res, doMo, doDirt, **kwargs):
+    # STANDARD ANALYSIS: reads the manually thresholded maps in stdDir
+    path = kwargs.get('path')
+    stdDir = kwargs.get('stdDir', 'standards/')
+    results = {}
+    poster = fun.posterfy(img)
+    imgName = os.path.splitext(os.path.split(path)[1])[0]
+    if doMo:
+        # The standard maps can be in any of the map formats
+        platFolder = os.path.join(stdDir, 'all_plat/')
+        PtMapPath = mapwriter.findMap(platFolder, imgName)
+        if PtMapPath is not None:
+            PtMap = fun.loadImg(PtMapPath)
+            PtArea = meas.calcExposedPt(PtMap, res, getAreaInSquaremm=True)
+            PixFoil = np.sum(mask.astype(np.bool_))
+            FoilArea = round(PixFoil*res*10**-6, 4)
+            MolyArea = FoilArea-PtArea
+            MolyMass = MolyArea*.3*10.2 #moly mass in micrograms
+            if FoilArea == 0:
+                PercPt = 0
+            else:
+                PercPt = round(float(PtArea)/float(FoilArea)*100,2)
+            results.update(PtArea=PtArea, FoilArea=FoilArea, MolyArea=MolyArea,
+                           MolyMass=MolyMass, PercPt=PercPt, PtMap=PtMap)
+        else:
+            print "Not a standard: " + imgName
+            print "  No map of the image in: " + platFolder
+            results.update(moData=blankDataDict('mo'), PtMap=blankImg(img.shape))
+    if doDirt:
+        dirtFolder = os.path.join(stdDir, 'all_dirt/')
+        DirtMapPath = mapwriter.findMap(dirtFolder, imgName)
+        if DirtMapPath is not None:
+            DirtMap = fun.loadImg(DirtMapPath)
+            (DirtArea, 
+            DirtNum,
+            DirtSizes,
+            labeled) = meas.calcDirt(DirtMap,
+                                     res, 
+                                     returnSizes=True,
+                                     returnLabelled=True, 
+                                     getAreaInSquaremm=True) 
+            results.update(DirtNum=DirtNum, DirtArea=DirtArea, DirtSizes=DirtSizes,
+                           DirtMap=DirtMap)
+        else:
+            print "Not a standard: " + imgName
+            print "  No map of the image in: " + dirtFolder
+            results.update(dirtData=blankDataDict('dirt'), DirtMap=blankImg(img.shape))
+    return results, poster
+
+registerMethod(CLEANTESTS, _cleantestsBackend)
+registerMethod(BIGFOILS, _bigfoilsBackend)
+registerMethod(HISTOGRAM, _histogramBackend)
+registerMethod(STANDARDS, _standardsBackend)
+      
+################################################################################
+
+################################################################################
+
 def blankDataDict(MoDirt='mo'):
-    MoDirt = fun.checkMoDirt(MoDirt)
-    if MoDirt=='mo':
-        retData = {'Dirt Count':"'--",
+    MoDirt = fun.checkMoDirt(MoDirt, allowBoth=True)
+    moData = {'Pt Area (mm^2)':"'--",
+              'Foil Area (mm^2)':"'--",
+              'Moly Area (mm^2)':"'--",
+              'Mass Molybdenum (micrograms)':"'--",
+              '% Exposed Pt':"'--"}
+    dirtData = {'Dirt Count':"'--",
                 'Dirt Area (mm^2)':"'--",
                 'Mean Particle Area (micron^2)':"'--",
                 'Max Particle Area (micron^2)':"'--",
                 '% Dirt Particles over 100micron diameter':"'--"}
-    elif MoDirt=='dirt':
-        retData = {'Dirt Count':"'--",
-                    'Dirt Area (mm^2)':"'--",
-                    'Mean Particle Area (micron^2)':"'--",
-                    'Max Particle Area (micron^2)':"'--",
-                    '% Dirt Particles over 100micron diameter':"'--"}
+    retData = {}
+    if MoDirt in ('mo','both'):
+        retData.update(moData)
+    if MoDirt in ('dirt','both'):
+        retData.update(dirtData)
     return retData
 
 ################################################################################
@@ -404,11 +664,11 @@ def compareToStandards(method, res, STDpath='standards/all_stds'):
     platFolder = os.path.join(STDpath,'all_plat')
     dirtPaths = [os.path.join(dirtFolder,dm)
                  for dm in os.listdir(dirtFolder)
-                 if dm.endswith('.png')]
+                 if mapwriter.isMapFile(dm)]
     PtPaths = [os.path.join(platFolder,dm)
               for dm in os.listdir(platFolder)
-              if dm.endswith('.png')]
-    for path in dirtFolder:
+              if mapwriter.isMapFile(dm)]
+    for path in dirtPaths:
         dirtmap = fun.loadImg(path)
         (dirtArea, 
         dirtNum,
@@ -0,0 +1,229 @@
+"""
+Contains the staged pipeline used by the batch loops (nexus.animorf,
+bigfoils.analyzeSubImages and mainanalysis.runOnSubImgs).
+
+Those loops used to decode an image (fun.loadImg), analyze it and write its maps
+with cv2.imwrite one after the other, so the CPU waited for the disk and the disk
+waited for the CPU. runPipeline splits every item into three stages:
+    - decode: load(item) on a background thread, up to 'prefetch' items ahead
+    - compute: compute(item, loaded) on the calling thread
+    - encode: save(item, computed) on a second background thread, with up to
+      'backlog' computed items waiting to be written
+Image decoding and PNG encoding release the GIL in OpenCV, so they run while the
+next image is analyzed. Only one thread runs each stage, so every stage sees the
+items in order and save can also write the rows of a CSV file. The time spent in
+each stage is returned as a PipelineStats. iterPipeline is the same pipeline as
+a generator of what save returns, for callers that want the results as they
+come (nexus.analyzeBatch).
+"""
+import Queue
+import sys
+import threading
+import time
+
+# Marks the end of the items in a queue
+_DONE = object()
+
+###################################################################################
+
+###################################################################################
+
+class StageStats(object):
+    """Number of items and busy time (in seconds) of one pipeline stage"""
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+
+    def rate(self):
+        """Items per second of busy time"""
+        if self.busy == 0:
+            return float('inf')
+        return self.items/self.busy
+
+class PipelineStats(object):
+    """
+    Throughput of a pipeline run. 'stages' holds the StageStats of the decode,
+    compute and encode stages, and 'wall' the total time of the run.
+    """
+    def __init__(self):
+        self.stages = [StageStats('decode'), StageStats('compute'), StageStats('encode')]
+        self.wall = 0.0
+
+    def report(self):
+        """Returns a few lines with the throughput of every stage"""
+        lines = []
+        for stage in self.stages:
+            lines.append("%-8s %5d items %9.2f s busy %9.2f items/s"
+                         % (stage.name, stage.items, stage.busy, stage.rate()))
+        items = self.stages[-1].items
+        rate = items/self.wall if self.wall > 0 else float('inf')
+        lines.append("%-8s %5d items %9.2f s wall %9.2f items/s"
+                     % ('total', items, self.wall, rate))
+        return "\n".join(lines)
+
+###################################################################################
+
+###################################################################################
+
+def _timed(stage, func, *args):
+    t = time.time()
+    ret = func(*args)
+    stage.busy += time.time()-t
+    stage.items += 1
+    return ret
+
+###################################################################################
+
+###################################################################################
+
+def runPipeline(items, load, compute, save, **kwargs):
+    """
+    Runs save(item, compute(item, load(item))) for every item of the list
+    'items', in order, with the decode (load) and encode (save) stages on
+    background threads. Returns a PipelineStats. An exception in any stage
+    stops the pipeline and is raised again here, after the items that were
+    already computed have been saved.
+        Key-word Arguments:
+            prefetch = 2
+                - Number of loaded items waiting for compute
+            backlog = 4
+                - Number of computed items waiting for save
+            threaded = True
+                - False runs the three stages one after the other on the calling
+                thread, like the loops used to.
+    """
+    stats = PipelineStats()
+    for saved in iterPipeline(items, load, compute, save, stats=stats, **kwargs):
+        pass
+    return stats
+
+###################################################################################
+
+###################################################################################
+
+def iterPipeline(items, load, compute, save, **kwargs):
+    """
+    Generator version of runPipeline: yields what save(item, computed) returns
+    for every item of the iterable 'items', in order, as soon as it has been
+    saved. compute runs on the thread that iterates the generator, between the
+    yields. Closing the generator early stops the decode stage and waits for
+    the computed items to be saved.
+        Key-word Arguments:
+            prefetch = 2, backlog = 4, threaded = True
+                - see runPipeline
+            stats = None
+                - PipelineStats to add the time spent in every stage to
+    """
+    prefetch = kwargs.get('prefetch',2) # Loaded items waiting for compute
+    backlog = kwargs.get('backlog',4) # Computed items waiting for save
+    threaded = kwargs.get('threaded',True) # Background decode and encode threads
+    stats = kwargs.get('stats',None) # Filled in as the items go through
+    
+    if stats is None:
+        stats = PipelineStats()
+    decode, calc, encode = stats.stages
+    t0 = time.time()
+    if not threaded:
+        for item in items:
+            loaded = _timed(decode, load, item)
+            computed = _timed(calc, compute, item, loaded)
+            del loaded
+            saved = _timed(encode, save, item, computed)
+            del computed
+            yield saved
+        stats.wall = time.time()-t0
+        return
+
+    stop = threading.Event()
+    loadQueue = Queue.Queue(max(prefetch,1))
+    saveQueue = Queue.Queue(max(backlog,1))
+    doneQueue = Queue.Queue() # What save returned, waiting to be yielded
+    errors = [] # exc_info of the exceptions of the background threads
+
+    def put(q, entry):
+        # Gives up when the pipeline is stopped
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def get(q):
+        # Returns _DONE when the pipeline is stopped
+        while not stop.is_set():
+            try:
+                return q.get(timeout=.1)
+            except Queue.Empty:
+                pass
+        return _DONE
+
+    def loader():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                if not put(loadQueue, (item, _timed(decode, load, item))):
+                    return
+        except Exception:
+            errors.append(sys.exc_info())
+        put(loadQueue, _DONE)
+
+    def saver():
+        failed = False
+        while True:
+            entry = saveQueue.get()
+            if entry is _DONE:
+                return
+            if failed:
+                # Drop the rest after a failed save
+                continue
+            try:
+                doneQueue.put(_timed(encode, save, *entry))
+            except Exception:
+                errors.append(sys.exc_info())
+                failed = True
+                stop.set()
+
+    def finished():
+        # Everything saved so far, without waiting
+        saved = []
+        while True:
+            try:
+                saved.append(doneQueue.get_nowait())
+            except Queue.Empty:
+                return saved
+
+    loadThread = threading.Thread(target=loader, name='pipeline-decode')
+    saveThread = threading.Thread(target=saver, name='pipeline-encode')
+    loadThread.daemon = True
+    saveThread.daemon = True
+    loadThread.start()
+    saveThread.start()
+    try:
+        while True:
+            entry = get(loadQueue)
+            if entry is _DONE:
+                break
+            item, loaded = entry
+            computed = _timed(calc, compute, item, loaded)
+            del entry, loaded
+            if not put(saveQueue, (item, computed)):
+                break
+            del computed
+            for saved in finished():
+                yield saved
+    finally:
+        # Stop decoding, and let the encode thread finish the computed items
+        stop.set()
+        saveQueue.put(_DONE)
+        saveThread.join()
+        loadThread.join()
+    for saved in finished():
+        yield saved
+    stats.wall = time.time()-t0
+    if errors:
+        excType, excValue, excTrace = errors[0]
+        raise excType, excValue, excTrace
@@ -0,0 +1,180 @@
+"""
+Contains the poster cache shared by makePoster (GenSIP.functions), bigPostPreProc
+(GenSIP.bigscans.images) and PosterPreProc (GenSIP.histomethod.mainanalysis).
+
+A poster (Kuwahara + blur + posterize) only depends on the image and on the
+poster parameters, but it used to be rebuilt for the Mo pass, again for the dirt
+pass, and sometimes twice for the same image (nexus.analyzeImage calls
+makePoster after Monalysis already made one). The cache keys every poster by
+    - the SHA-1 hash of the image (and of the mask, if one is used),
+    - the name of the function that made it and its parameters,
+    - CODE_VERSION and the band tables of GenSIP.posterize,
+and keeps it in two tiers:
+    - memory: a least-recently-used dictionary limited to maxMemory megabytes
+    - disk: compressed numpy files (.npz) in cacheDir. The disk tier is off
+      until a folder is set with setCacheDir. animorf sets it to
+      Output/PosterCache/, so a second run over the same folder (with MoDirt
+      switched, for instance) loads the posters instead of filtering again.
+"""
+import numpy as np
+import hashlib
+import os
+from collections import OrderedDict
+from GenSIP.posterize import PRESETS
+
+# Bump this whenever the output of makePoster, bigPostPreProc, PosterPreProc or
+# the Kuwahara filter changes, so that old posters on disk are not reused.
+CODE_VERSION = '2'
+
+###################################################################################
+
+###################################################################################
+
+class PosterCache:
+    """
+    Two tier (memory and disk) cache of posters and poster preprocessing images.
+        Key-word Arguments:
+         - maxMemory = 256 - size limit of the memory tier in megabytes. 0 turns
+            the memory tier off.
+         - cacheDir = None - folder of the disk tier. None turns it off.
+         - enabled = True - False makes every lookup compute the poster.
+    """
+    def __init__(self, maxMemory=256, cacheDir=None, enabled=True):
+        self.maxMemory = maxMemory
+        self.cacheDir = cacheDir
+        self.enabled = enabled
+        self.memory = OrderedDict()
+        self.memBytes = 0
+        self.hits = {'memory':0,'disk':0}
+        self.misses = 0
+
+    def makeKey(self, stage, image, params, mask=None):
+        """
+        Returns the cache key (a hex string) of the output of 'stage' for an
+        image, a dictionary of parameters and an optional mask.
+        """
+        h = hashlib.sha1()
+        h.update(CODE_VERSION)
+        h.update(stage)
+        for name in sorted(PRESETS.keys()):
+            h.update(name)
+            h.update(PRESETS[name]['LUT'].tostring())
+        for arr in (image, mask):
+            if type(arr)==np.ndarray:
+                arr = np.ascontiguousarray(arr)
+                h.update(str(arr.dtype)+str(arr.shape))
+                h.update(arr.data)
+            else:
+                h.update(repr(arr))
+        h.update(repr(sorted(params.items())))
+        return h.hexdigest()
+
+    def get(self, stage, image, params, compute, mask=None):
+        """
+        Returns the cached output of 'stage' for this image, parameters and
+        mask, or calls compute() and caches its output if there is none.
+        The returned array is always a copy, so callers are free to modify it.
+        """
+        if not self.enabled:
+            return compute()
+        key = self.makeKey(stage, image, params, mask=mask)
+
+        # Memory tier
+        if key in self.memory:
+            arr = self.memory.pop(key)
+            self.memory[key] = arr # Move to the most recently used end
+            self.hits['memory'] += 1
+            return arr.copy()
+
+        # Disk tier
+        arr = self._load(key)
+        if arr is not None:
+            self.hits['disk'] += 1
+            self._remember(key, arr)
+            return arr.copy()
+
+        self.misses += 1
+        arr = np.asarray(compute())
+        self._remember(key, arr)
+        self._save(key, arr)
+        return arr.copy()
+
+    def clear(self, disk=False):
+        """
+        Empties the memory tier, and the disk tier too if disk is True.
+        """
+        self.memory = OrderedDict()
+        self.memBytes = 0
+        if disk and self.cacheDir and os.path.isdir(self.cacheDir):
+            for f in os.listdir(self.cacheDir):
+                if f.endswith('.npz'):
+                    os.remove(os.path.join(self.cacheDir,f))
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of memory hits, disk hits, misses,
+        items and megabytes in the memory tier.
+        """
+        return {'memory hits':self.hits['memory'],
+                'disk hits':self.hits['disk'],
+                'misses':self.misses,
+                'items':len(self.memory),
+                'MB':self.memBytes/float(2**20)}
+
+    def _remember(self, key, arr):
+        if arr.nbytes > self.maxMemory*2**20:
+            return
+        arr = arr.copy()
+        arr.flags.writeable = False
+        self.memory[key] = arr
+        self.memBytes += arr.nbytes
+        # Evict the least recently used posters until the tier fits again
+        while self.memBytes > self.maxMemory*2**20:
+            oldKey, old = self.memory.popitem(last=False)
+            self.memBytes -= old.nbytes
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key+'.npz')
+
+    def _load(self, key):
+        if not self.cacheDir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            npz = np.load(self._path(key))
+            arr = npz['poster']
+            npz.close()
+            return arr
+        except Exception:
+            # Broken or half written file; it is rewritten after recomputing
+            return None
+
+    def _save(self, key, arr):
+        if not self.cacheDir:
+            return
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        # Write to a temporary file first, so an interrupted run never leaves a
+        # half written poster under the real name.
+        tmpPath = self._path(key)[:-4]+'.tmp%d.npz' % os.getpid()
+        np.savez_compressed(tmpPath, poster=arr)
+        os.rename(tmpPath, self._path(key))
+
+###################################################################################
+
+###################################################################################
+
+# The cache used by makePoster, bigPostPreProc and PosterPreProc
+POSTER_CACHE = PosterCache()
+
+def setCacheDir(cacheDir):
+    """
+    Sets the folder of the disk tier of the shared poster cache. None turns the
+    disk tier off.
+    """
+    POSTER_CACHE.cacheDir = cacheDir
+
+def cachedPoster(stage, image, params, compute, mask=None):
+    """
+    Looks up the output of 'stage' in the shared poster cache. See PosterCache.get
+    """
+    return POSTER_CACHE.get(stage, image, params, compute, mask=mask)
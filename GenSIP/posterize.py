@@ -0,0 +1,143 @@
+"""
+Contains the lookup table posterization engine used by posterfy (small foils)
+and bigPosterfy (big foil scans).
+
+A poster splits the gray levels of a smoothed image into bands, and every band
+is set to the gray level of the region it stands for. Here the bands are turned
+into 256-entry lookup tables once, so posterizing an image is a single cv2.LUT
+call instead of one comparison mask per band. The same engine also gives a
+region label image (0 to 5, see REGION_NAMES) that callers can use instead of
+rebuilding masks with poster==50, poster==85, etc.
+"""
+import cv2
+import numpy as np
+
+###################################################################################
+
+###################################################################################
+
+# Region names, in label order, and the gray level each region has in a poster.
+# The label of a region is its index in these lists, so label images from every
+# preset can be compared with each other.
+REGION_NAMES = ['blk','pleat','darkMo','Mo','highEx','Plat']
+REGION_GRAYLEVELS = [0,50,85,150,200,255]
+
+# Label of each poster gray level. Gray levels that are not region levels get
+# the label 255.
+GRAY_TO_LABEL = np.zeros((256,), dtype=np.uint8)
+GRAY_TO_LABEL[:] = 255
+GRAY_TO_LABEL[REGION_GRAYLEVELS] = np.arange(len(REGION_GRAYLEVELS))
+
+# Registered band tables. Each band is (lowest gray level, highest gray level,
+# poster gray level).
+PRESETS = {}
+
+###################################################################################
+
+###################################################################################
+
+def registerPreset(name, bands):
+    """
+    Registers a table of bands under a preset name so posterizeLUT can use it.
+        Inputs:
+         - name - name of the preset, i.e. 'smallfoils'
+         - bands - list of (low, high, graylevel) tuples. Together the bands must
+            cover 0 to 255 without overlapping, and every graylevel must be one
+            of REGION_GRAYLEVELS.
+    """
+    covered = np.zeros((256,), dtype=np.int64)
+    for low, high, level in bands:
+        if level not in REGION_GRAYLEVELS:
+            raise Exception("Poster gray level {0} is not one of {1}".format(level, REGION_GRAYLEVELS))
+        covered[low:high+1] += 1
+    if np.any(covered != 1):
+        raise Exception("The bands of preset '{0}' must cover 0 to 255 exactly once.".format(name))
+    PRESETS[name] = {'bands':list(bands), 'LUT':makeLUT(bands)}
+
+###################################################################################
+
+###################################################################################
+
+def makeLUT(bands):
+    """
+    Turns a list of (low, high, graylevel) bands into a 256-entry uint8 lookup
+    table that maps every gray level to its poster gray level.
+    """
+    LUT = np.zeros((256,), dtype=np.uint8)
+    for low, high, level in bands:
+        LUT[low:high+1] = level
+    return LUT
+
+###################################################################################
+
+###################################################################################
+
+def posterizeLUT(image, preset='smallfoils', k_size=0, returnLabels=False):
+    """
+    Posterizes an image with one cv2.LUT call using the band table of a
+    registered preset.
+        Inputs:
+         - image - gray image. Anything that is not uint8 is converted with
+            astype(np.uint8), just like posterfy always did.
+        Key-word Arguments:
+         - preset = 'smallfoils' - name of a registered band table, or a list of
+            (low, high, graylevel) bands.
+         - k_size = 0 - size of the kernel of the morphological opening applied
+            to the poster. 0 skips the opening.
+         - returnLabels = False - also return the region label image, where each
+            pixel is the index of its region in REGION_NAMES.
+    Returns the poster, or the tuple (poster, labels) if returnLabels is True.
+    """
+    if type(preset) in (list, tuple):
+        LUT = makeLUT(preset)
+    elif preset in PRESETS:
+        LUT = PRESETS[preset]['LUT']
+    else:
+        raise Exception("Unknown poster preset: {0}. Registered presets: {1}".format(
+                        preset, sorted(PRESETS.keys())))
+
+    img = np.asarray(image)
+    if img.dtype != np.uint8:
+        img = img.astype(np.uint8)
+    poster = cv2.LUT(img, LUT)
+
+    if k_size:
+        #Do a morphological opening step to eliminate the rough edges
+        kernel = np.ones((k_size,k_size))
+        poster = cv2.morphologyEx(poster, cv2.MORPH_OPEN, kernel)
+
+    if returnLabels:
+        return poster, posterLabels(poster)
+    else:
+        return poster
+
+###################################################################################
+
+###################################################################################
+
+def posterLabels(poster):
+    """
+    Returns the region label image of a poster (one cv2.LUT call). Pixels whose
+    gray level is not a region level are labelled 255.
+    """
+    return cv2.LUT(np.asarray(poster).astype(np.uint8), GRAY_TO_LABEL)
+
+###################################################################################
+
+###################################################################################
+
+# Band table used by functions.posterfy for the small (cleaning test) foils
+registerPreset('smallfoils', [(0,4,0),
+                              (5,75,50),
+                              (76,110,85),
+                              (111,199,150),
+                              (200,255,255)])
+
+# Band table used by bigscans.images.bigPosterfy for the big foil scans. It has
+# the extra 'highEx' (high exposure) band.
+registerPreset('bigfoils', [(0,4,0),
+                            (5,40,50),
+                            (41,139,85),
+                            (140,195,150),
+                            (196,215,200),
+                            (216,255,255)])
@@ -0,0 +1,170 @@
+"""
+Contains the fused region thresholding kernel used by functions.regionalThresh
+and bigscans.bigfoils.bigRegionalThresh.
+
+Both functions threshold each region of a poster (pleat, dark Mo, Mo, ...) of a
+Gaussian blurred image at its own level. They used to blur the whole image once
+per region, make a masked copy of the blurred image per region, threshold every
+copy and add them up. Here every distinct blur kernel size is blurred once, the
+poster is turned into a per-pixel threshold map with a lookup table, and the
+thresholded image comes out of one comparison per kernel size (one in total for
+the usual gaussBlur=5, two otherwise).
+"""
+import cv2
+import numpy as np
+
+###################################################################################
+
+###################################################################################
+
+def blurImage(image, sizes, blurs=None):
+    """
+    Returns a dictionary of the Gaussian blurs of an image, keyed by kernel size,
+    for all kernel sizes in 'sizes'. Blurs already in the 'blurs' dictionary are
+    reused and not made again.
+    """
+    ret = {}
+    if blurs is not None:
+        ret.update(blurs)
+    Image = None
+    for k in sizes:
+        if not k in ret:
+            if Image is None:
+                Image = np.asarray(image).astype(np.uint8)
+            ret[k] = cv2.GaussianBlur(Image, (k,k), 0)
+    return ret
+
+###################################################################################
+
+###################################################################################
+
+def regionThreshold(image, poster, regions, threshType=0L, blurs=None, out=None):
+    """
+    Thresholds every region of a poster at its own threshold level, on the
+    Gaussian blurred image. Gives exactly the same image as masking a blurred
+    image to each region, running cv2.threshold on each masked image and adding
+    the results with np.add (the way regionalThresh used to do it), for every
+    cv2 threshold type.
+        Inputs:
+         - image - gray image to be thresholded
+         - poster - poster of the image (same shape)
+         - regions - dictionary {poster gray level: (threshold, blur kernel size)}
+            i.e. {50:(p,5), 85:(d,5), 150:(m,3), 255:(pt,3)}. Pixels whose poster
+            level is not in 'regions' are not in any region.
+        Key-word Arguments:
+         - threshType = 0 - cv2 threshold type (cv2.THRESH_BINARY, ...)
+         - blurs = None - dictionary of blurred images keyed by kernel size, as
+            made by blurImage or functions.regionBlurs. Missing sizes are blurred
+            here.
+         - out = None - uint8 array of the image's shape to write the result to.
+    Returns the uint8 thresholded image (out, if it was given).
+    """
+    if poster.shape != image.shape:
+        raise Exception("The poster is not the same shape as the original image.")
+    gPoster = np.asarray(poster)
+    if gPoster.dtype != np.uint8:
+        gPoster = gPoster.astype(np.uint8)
+    if out is None:
+        out = np.empty(gPoster.shape, dtype=np.uint8)
+    elif out.shape != gPoster.shape or out.dtype != np.uint8:
+        raise Exception("'out' must be a uint8 array of the same shape as the image.")
+
+    # cv2.threshold rounds the threshold down for 8-bit images
+    levels = sorted(regions.keys())
+    thresh = dict([(g, int(np.floor(regions[g][0]))) for g in levels])
+    sizes = sorted(set([regions[g][1] for g in levels]))
+    blurs = blurImage(image, sizes, blurs)
+
+    if threshType in (0L, cv2.THRESH_BINARY) and min(thresh.values()) >= 0:
+        # Fast path: a pixel is 255 if its blurred value is above the threshold
+        # of its region. Pixels outside of the regions get the threshold 255,
+        # which no uint8 value is above.
+        tmp = None
+        for i,k in enumerate(sizes):
+            LUT = np.zeros((256,), dtype=np.uint8)
+            LUT[:] = 255
+            for g in levels:
+                if regions[g][1]==k:
+                    LUT[g] = min(thresh[g], 255)
+            threshMap = cv2.LUT(gPoster, LUT)
+            if i==0:
+                cv2.compare(blurs[k], threshMap, cv2.CMP_GT, out)
+            else:
+                tmp = cv2.compare(blurs[k], threshMap, cv2.CMP_GT, tmp)
+                cv2.bitwise_or(out, tmp, out)
+        return out
+
+    # General path, for the other threshold types and negative thresholds.
+    # Outside of its own region a pixel has the value 0 in each masked image, so
+    # every other region adds the constant f(0,t) to it. Each pixel is then
+    # f(value, t of its region) + C - f(0, t of its region), where C is the sum of
+    # f(0,t) over all regions, and pixels outside of the regions are C.
+    threshLUT = np.zeros((256,), dtype=np.int16)
+    zeroLUT = np.zeros((256,), dtype=np.int16)
+    inRegion = np.zeros((256,), dtype=np.bool_)
+    C = 0
+    for g in levels:
+        threshLUT[g] = thresh[g]
+        zeroLUT[g] = _threshValue(np.zeros((1,), dtype=np.int16), thresh[g], threshType)[0]
+        inRegion[g] = True
+        C += zeroLUT[g]
+    value = np.zeros(gPoster.shape, dtype=np.int16)
+    for k in sizes:
+        sel = np.zeros((256,), dtype=np.bool_)
+        for g in levels:
+            if regions[g][1]==k:
+                sel[g] = True
+        sel = sel[gPoster]
+        value[sel] = blurs[k][sel]
+    T = threshLUT[gPoster]
+    ret = _threshValue(value, T, threshType) + C - zeroLUT[gPoster]
+    ret[~inRegion[gPoster]] = C
+    out[:] = ret % 256
+    return out
+
+###################################################################################
+
+###################################################################################
+
+def _threshValue(value, t, threshType, maxval=255):
+    """
+    Applies a cv2 threshold type to integer values with integer thresholds t
+    (a number or an array), the way cv2.threshold does it on uint8 images.
+    """
+    above = value > t
+    if threshType == cv2.THRESH_BINARY:
+        return np.where(above, maxval, 0)
+    elif threshType == cv2.THRESH_BINARY_INV:
+        return np.where(above, 0, maxval)
+    elif threshType == cv2.THRESH_TRUNC:
+        # cv2 gives 0 for negative thresholds
+        return np.where(above, np.maximum(t,0), value)
+    elif threshType == cv2.THRESH_TOZERO:
+        return np.where(above, value, 0)
+    elif threshType == cv2.THRESH_TOZERO_INV:
+        return np.where(above, 0, value)
+    else:
+        raise Exception("Unsupported threshold type: {0}".format(threshType))
+
+###################################################################################
+
+###################################################################################
+
+def regionThresholdLoop(image, poster, regions, threshType=0L):
+    """
+    The way regionalThresh and bigRegionalThresh used to threshold the regions:
+    one blur, one masked copy and one cv2.threshold per region, added up with
+    np.add. Kept as the reference for regionThreshold in the tests and in
+    GenSIP.benchmarks.bench_regionthresh.
+    """
+    Image = np.asarray(image).astype(np.uint8)
+    gPoster = np.asarray(poster).astype(np.uint8)
+    threshedImage = np.zeros((Image.shape),dtype=np.uint8)
+    for g in sorted(regions.keys()):
+        t, k = regions[g]
+        region = gPoster.copy()
+        region[region!=g] = 0
+        masked = (region/g)*cv2.GaussianBlur(Image, (k,k), 0)
+        ret, threshed = cv2.threshold(masked, t, 255, threshType)
+        threshedImage = np.add(threshedImage, threshed)
+    return threshedImage
@@ -0,0 +1,63 @@
+"""
+Checks the flooding engine of GenSIP.histomethod.binaryops: floodBySeed and
+floodByThresh flood the same pixels as repeating FloodStep over the whole seed,
+with the same stopping rules.
+"""
+
+import numpy as np
+import GenSIP.histomethod.binaryops as binops
+import unittest
+import nose
+
+
+def floodBySteps(img, seed, d, upBound, lowBound, growthMin, growthMax, maxSteps):
+    # The flooding loop of FloodStep steps, the slow way
+    ret = seed.copy()
+    growth = growthMin+1
+    step = 0
+    while (growthMin<growth<growthMax) and step<maxSteps:
+        ret, growth = binops.FloodStep(img, ret, d, upBound, lowBound)
+        step += 1
+    return ret
+
+class Test_Flood (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(12)
+        # Smooth rows, so that the floods go a long way
+        self.img = (np.cumsum(rand.randint(-3,4,(50,70)),1)%256).astype(np.uint8)
+        self.noise = (rand.rand(50,70)*255).astype(np.uint8)
+        self.seed = rand.rand(50,70) > .99
+
+    def test_flood_by_seed(self):
+        for img in (self.img, self.noise):
+            for d, upBound, lowBound, growthMin, growthMax in ((0,255,0,0,10000),
+                    (3,200,40,0,10000), (10,255,0,2,10000), (20,255,0,0,60)):
+                expected = floodBySteps(img, self.seed, d, upBound, lowBound,
+                                        growthMin, growthMax, 999)
+                flooded = binops.floodBySeed(img, self.seed, d, upBound, lowBound,
+                                             growthMin=growthMin, growthMax=growthMax)
+                nose.tools.assert_true(np.array_equal(flooded, expected))
+
+    def test_flood_by_thresh(self):
+        seed = binops.threshold(self.img, 100, 110, Binary=True, Bool=True)
+        expected = floodBySteps(self.img, seed, 2, 255, 0, 0, 10000, 99)
+        flooded = binops.floodByThresh(self.img, 100, 110, 2, 255, 0)
+        nose.tools.assert_true(np.array_equal(flooded, expected))
+
+    def test_fill_background(self):
+        # The background filling of bigMaskEdges: from the border, over the 0s
+        img = np.ones((60,60), np.uint8)
+        img[:,:5] = 0
+        img[20:30,20:30] = 0
+        seed = np.logical_not(img.astype(np.bool_))
+        seed[1:-1,1:-1] = False
+        flooded = binops.floodBySeed(img, seed, 0, 1, 0, growthMin=0, growthMax=100000)
+        nose.tools.assert_equal(np.count_nonzero(flooded), 60*5)
+        # Nothing to do
+        nose.tools.assert_true(binops.floodBySeed(img, seed, 0, 1, 0, growthMax=1) is not seed)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
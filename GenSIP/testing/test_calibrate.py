@@ -0,0 +1,55 @@
+"""
+Checks the histogram threshold sweep of GenSIP.cleantests.calibrate against the
+single point functions CalMoComp and CaldirtComp.
+"""
+
+import numpy as np
+import GenSIP.cleantests.calibrate as cal
+import GenSIP.functions as fun
+import GenSIP.regionthresh as RT
+import os
+import unittest
+import nose
+
+
+class Test_ThreshSweep (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.split(__file__)[0]
+        STDFolder = os.path.join(self.DIRNAME,'..','..','standards','all_stds')
+        names = sorted([f for f in os.listdir(STDFolder) if f.endswith('.tif')])
+        self.before = os.path.join(STDFolder,names[0])
+        self.after = os.path.join(STDFolder,names[3])
+
+    def test_sweepCounts_matches_thresholded_image(self):
+        rand = np.random.RandomState(0)
+        img = rand.randint(0,256,(60,70)).astype(np.uint8)
+        poster = rand.choice([0,50,85,150,255],(60,70)).astype(np.uint8)
+        hists = cal.regionHistograms(img, poster, gaussBlur=3)
+        ths = rand.randint(-2,258,(4,10))
+        counts = cal.sweepCounts(hists, dict(zip((50,85,150,255),ths)))
+        for i in range(10):
+            regions = {50:(ths[0,i],5), 85:(ths[1,i],5), 150:(ths[2,i],3), 255:(ths[3,i],3)}
+            threshed = RT.regionThreshold(img, poster, regions)
+            nose.tools.assert_equal(counts[i], np.sum(threshed!=0))
+
+    def test_sweepMoComp_matches_CalMoComp(self):
+        P, D, M, Pt = [np.array([s, s+40, s+80]) for s in (90,120,180,180)]
+        sweep = cal.sweepMoComp(fun.loadImg(self.before), fun.loadImg(self.after),
+                                P=P, D=D, M=M, Pt=Pt)
+        for i in range(3):
+            single = cal.CalMoComp(self.before, self.after, P=P[i], D=D[i], M=M[i], Pt=Pt[i])
+            nose.tools.assert_equal(tuple(s[i] for s in sweep), single)
+
+    def test_sweepDirtComp_matches_CaldirtComp(self):
+        P, D, M, Pt = [np.array([s, s+30]) for s in (8,28,55,60)]
+        sweep = cal.sweepDirtComp(fun.loadImg(self.before), fun.loadImg(self.after),
+                                  P=P, D=D, M=M, Pt=Pt)
+        for i in range(2):
+            single = cal.CaldirtComp(self.before, self.after, P=P[i], D=D[i], M=M[i], Pt=Pt[i])
+            nose.tools.assert_equal(tuple(s[i] for s in sweep), single)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
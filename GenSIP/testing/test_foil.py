@@ -0,0 +1,68 @@
+"""
+Checks the foil segmentation of GenSIP.functions: foilSegmentation finds the foil
+of a synthetic image on the shrunk image, maskEdge blacks out a band along its
+outline, and getFoilArea counts the pixels of the same mask.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import cv2
+import unittest
+import nose
+
+
+class Test_Foil_Segmentation (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(13)
+        rows, cols = np.mgrid[:800,:900]
+        self.foil = ((rows-400)**2+(cols-430)**2) < 300**2
+        self.img = np.where(self.foil, 150, 10).astype(np.uint8)
+        # Dirt on the foil is still foil
+        self.img[rand.rand(800,900) > .995] = 0
+
+    def test_foil_mask(self):
+        mask, outercnt = fun.foilSegmentation(self.img)
+        nose.tools.assert_equal(mask.shape, self.img.shape)
+        nose.tools.assert_equal(sorted(np.unique(mask)), [0,255])
+        # The full size blur, the slow way. Only the pixels along the outline 
+        # may differ.
+        blur = cv2.blur(cv2.morphologyEx(self.img, cv2.MORPH_CLOSE, np.ones((3,3))), (100,100))
+        nose.tools.assert_true(np.mean((mask!=0)!=(blur>50)) < .01)
+        nose.tools.assert_equal(fun.getFoilArea(self.img, 4), np.count_nonzero(mask)*4)
+        # The outline of the foil, in the pixels of the full image
+        x, y, w, h = boundingRect(outercnt)
+        rows, cols = np.nonzero(mask)
+        nose.tools.assert_true(abs(x-cols.min()) <= 4 and abs(w-np.ptp(cols)-1) <= 8)
+        nose.tools.assert_true(abs(y-rows.min()) <= 4 and abs(h-np.ptp(rows)-1) <= 8)
+        # The cached foil is the same as a fresh one
+        again, cnt = fun.foilSegmentation(self.img, useCache=False)
+        nose.tools.assert_true(np.array_equal(mask, again))
+        nose.tools.assert_true(np.array_equal(outercnt, cnt))
+
+    def test_mask_edge(self):
+        masked, mask = fun.maskEdge(self.img, thickness=20)
+        foil, outercnt = fun.foilSegmentation(self.img)
+        rows, cols = np.mgrid[:800,:900]
+        dist = np.sqrt((rows-400)**2+(cols-430)**2)
+        radius = np.sqrt(np.count_nonzero(foil)/np.pi)
+        # The band along the outline is blacked out, the middle is left alone
+        nose.tools.assert_true((mask[dist>radius-12]==0).all())
+        nose.tools.assert_true((mask[dist<radius-30]!=0).all())
+        nose.tools.assert_true(np.array_equal(masked[dist<radius-30], self.img[dist<radius-30]))
+        nose.tools.assert_true((masked[(dist>radius-12)&(dist<radius+12)]==0).all())
+        # No foil, no outline
+        mask, outercnt = fun.foilSegmentation(np.zeros((50,50), np.uint8))
+        nose.tools.assert_equal(outercnt, None)
+        nose.tools.assert_false(mask.any())
+
+def boundingRect(contour):
+    # Bounding box (x, y, width, height) of a contour of (N,1,2) points
+    pts = contour.reshape(-1,2)
+    return (pts[:,0].min(), pts[:,1].min(),
+            pts[:,0].max()-pts[:,0].min()+1, pts[:,1].max()-pts[:,1].min()+1)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
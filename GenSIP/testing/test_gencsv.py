@@ -0,0 +1,91 @@
+"""
+Checks the streaming mode of GenSIP.gencsv.DataToCSV: streamed rows give the same
+CSV file as writeDataFromDict, and a resumed file keeps its finished rows and
+drops whatever was written after the last one.
+"""
+
+import GenSIP.gencsv as gencsv
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_Streaming_CSV (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir,'data.csv')
+        self.colHeads = ['Foil','Area','Count','Note']
+        self.Data = {'sub_000_000':{'Area':0.1+0.2,'Count':3,'Note':'ok'},
+                     'sub_000_001':{'Area':1e-7,'Count':0},
+                     'sub_001_000':{'Area':12.5,'Count':-4,'Note':'x'}}
+        self.totals = {'TOTALS':{'Area':12.6000001}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def rows(self, path):
+        # Everything after the title and info rows, which hold the date
+        with open(path,'rb') as f:
+            return f.read().split('\n')[5:]
+
+    def stream(self, names, resume=False):
+        CSV = gencsv.DataToCSV(self.path, 'Test', resume=resume)
+        CSV.startStream(self.colHeads)
+        for name in names:
+            if not CSV.isDone(name):
+                CSV.writeRow(name, self.Data[name])
+        return CSV
+
+    def test_stream_matches_batch(self):
+        batchPath = os.path.join(self.tmpDir,'batch.csv')
+        CSV = gencsv.DataToCSV(batchPath, 'Test')
+        data = dict(self.Data)
+        data.update(self.totals)
+        CSV.writeDataFromDict(data, colHeads=self.colHeads)
+        CSV.closeCSVFile()
+        CSV = self.stream(sorted(self.Data))
+        CSV.writeFooter(self.totals)
+        CSV.closeCSVFile()
+        nose.tools.assert_equal(self.rows(self.path), self.rows(batchPath))
+
+    def test_resume(self):
+        names = sorted(self.Data)
+        CSV = self.stream(names[:2])
+        CSV.writeFooter(self.totals)
+        CSV.closeCSVFile()
+        # A half written row after the footer
+        with open(self.path,'ab') as f:
+            f.write("'sub_001_000,12.")
+        CSV = self.stream([], resume=True)
+        nose.tools.assert_equal(CSV.DoneData, dict([(n,self.Data[n]) for n in names[:2]]))
+        nose.tools.assert_true(CSV.isDone(names[0]))
+        nose.tools.assert_false(CSV.isDone(names[2]))
+        CSV.writeRow(names[2], self.Data[names[2]])
+        CSV.writeFooter(self.totals)
+        CSV.closeCSVFile()
+        resumed = self.rows(self.path)
+        CSV = self.stream(names)
+        CSV.writeFooter(self.totals)
+        CSV.closeCSVFile()
+        nose.tools.assert_equal(resumed, self.rows(self.path))
+
+    def test_resume_checks_columns(self):
+        self.stream(sorted(self.Data)).closeCSVFile()
+        CSV = gencsv.DataToCSV(self.path, 'Test', resume=True)
+        nose.tools.assert_raises(Exception, CSV.startStream, ['Foil','Area'])
+        CSV.closeCSVFile()
+
+    def test_no_resume_starts_over(self):
+        self.stream(sorted(self.Data)).closeCSVFile()
+        CSV = self.stream([])
+        nose.tools.assert_equal(CSV.DoneData, {})
+        nose.tools.assert_false(CSV.isDone('sub_000_000'))
+        CSV.closeCSVFile()
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
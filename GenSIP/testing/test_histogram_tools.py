@@ -0,0 +1,192 @@
+"""
+Checks the histogram engine of GenSIP.histomethod.histogram_tools: the region
+histograms of one bincount pass are the np.histogram of every region, and the
+max, min, mean and Mo peak read from a histogram are the ones of the pixels.
+"""
+
+import numpy as np
+from math import copysign
+import GenSIP.histomethod.histogram_tools as hist
+import GenSIP.histomethod.datatools as dat
+import GenSIP.histomethod.mainanalysis as ma
+import unittest
+import nose
+
+
+# The feature finding of datatools one histogram at a time, as it was before
+# histFeatures, to check that the features are still the same
+
+def loopZeroes(a):
+    x = []
+    for i in range(a[0:-1].size):
+        if a[i] == 0:
+            x.append(i)
+        elif copysign(a[i],a[i+1])!=a[i]:
+            x.append(i)
+    return x
+
+def loopFeatures(a, smoonum):
+    smoo = a.copy()
+    for i in range(smoonum):
+        smoo = dat.smoothed(smoo)
+    grad = np.gradient(smoo)
+    concav = np.gradient(grad)
+    Zx = loopZeroes(grad)
+    peaks = [x for x in Zx if concav[x]<0]
+    valleys = [x for x in Zx if concav[x]>0]
+    concav = 10*np.gradient(np.gradient(smoo))
+    aberr = np.gradient(concav)
+    Zx = loopZeroes(concav)
+    negInfl = [x for x in Zx if aberr[x]<0]
+    posInfl = [x for x in Zx if aberr[x]>0]
+    return peaks, valleys, negInfl, posInfl, smoo
+
+def loopFWHM(histo, peakVal):
+    HalfMax = histo[peakVal]/2
+    colors = np.arange(0,histo.size,1)
+    for i in colors[::-1][histo.size-peakVal:]:
+        if histo[i]<HalfMax:
+            HM1 = i
+            break
+    else:
+        HM1 = None
+    for i in colors[peakVal:]:
+        if histo[i]<HalfMax:
+            HM2 = i
+            break
+    else:
+        HM2 = None
+    return (HM1,HM2)
+
+class Test_Histogram_Engine (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(7)
+        self.img = (rand.rand(120,90)*255).astype(np.uint8)
+        self.poster = np.array(hist.REGION_LEVELS+[100])[rand.randint(0,7,(120,90))]
+        self.poster = self.poster.astype(np.uint8)
+        # No pixel of the poster is in the darkMo region
+        self.poster[self.poster==85] = 50
+        self.mask = (rand.rand(120,90) > .3).astype(np.uint8)
+
+    def test_region_histograms(self):
+        histos, fullHistos = hist.posterHistograms(self.img, self.poster, self.mask)
+        for i, level in enumerate(hist.REGION_LEVELS):
+            region = self.poster==level
+            expected = np.histogram(self.img[region&(self.mask!=0)],256,(0,255))[0]
+            nose.tools.assert_true(np.array_equal(histos[i], expected))
+            expected = np.histogram(self.img[region],256,(0,255))[0]
+            nose.tools.assert_true(np.array_equal(fullHistos[i], expected))
+        nose.tools.assert_true(np.array_equal(hist.coarseHistogram(fullHistos[3]),
+                               np.histogram(self.img[self.poster==150],32,(0,255))[0]))
+
+    def test_stats_from_histogram(self):
+        for level in (0,150,255):
+            pixels = self.img[self.poster==level]
+            histo = hist.imageHistogram(pixels)
+            nose.tools.assert_equal(hist.histStats(histo),
+                                    (pixels.max(), pixels.min(), int(np.mean(pixels))))
+        nose.tools.assert_equal(hist.histStats(np.zeros(256, int)), None)
+        # A float image goes through np.histogram, and finds the same peak
+        img = self.img[self.img<200]
+        nose.tools.assert_equal(hist.findMoPeakByImg(img),
+                                hist.findMoPeakByImg(img.astype(np.float64)))
+
+    def test_make_regions(self):
+        Data = ma.MakeRegions(self.img, self.poster, Mask=self.mask)
+        nose.tools.assert_equal(Data['darkMo'], 'Null')
+        pixels = self.img[self.poster==150]
+        nose.tools.assert_equal(Data['Mo']['Max'], pixels.max())
+        nose.tools.assert_equal(Data['Mo']['Mean'], int(np.mean(pixels)))
+        nose.tools.assert_equal(Data['Mo']['MoPeak'], hist.findMoPeakByImg(pixels))
+        nose.tools.assert_equal(Data['Mo']['Histogram'].sum(),
+                                np.count_nonzero((self.poster==150)&(self.mask!=0)))
+
+class Test_Batch_Features (unittest.TestCase):
+
+    def setUp(self):
+        colors = np.arange(256)
+        # Two peaks
+        self.histos = np.array([np.round(1000*np.exp(-(colors-c1)**2/400.)+
+                                         400*np.exp(-(colors-c2)**2/600.)).astype(int)
+                                for c1, c2 in ((90,160),(60,130),(120,190))])
+
+    def test_features_of_every_row(self):
+        # Noisy histograms too, with flat parts and many features
+        rand = np.random.RandomState(8)
+        histos = np.vstack([self.histos, rand.poisson(self.histos[::-1]/8.),
+                            rand.randint(0,3,(4,256))])
+        for smoonum in (4,7):
+            feats = dat.histFeatures(histos, smoonum=smoonum)
+            for i, histo in enumerate(histos):
+                peaks, valleys, negInfl, posInfl, smoo = loopFeatures(histo, smoonum)
+                nose.tools.assert_equal(feats['Peaks'][i].tolist(), peaks)
+                nose.tools.assert_equal(feats['Valleys'][i].tolist(), valleys)
+                nose.tools.assert_equal(feats['NegInfl'][i].tolist(), negInfl)
+                nose.tools.assert_equal(feats['PosInfl'][i].tolist(), posInfl)
+                nose.tools.assert_true(np.array_equal(feats['Smoothed'][i], smoo))
+        # The two peaks are found, and the valley between them
+        feats = dat.histFeatures(self.histos, smoonum=7)
+        nose.tools.assert_equal(feats['Peaks'][0].tolist(), [90,160])
+        nose.tools.assert_equal(len([v for v in feats['Valleys'][0] if 90<v<160]), 1)
+        peakVals = [90,60,120,100,70,150]
+        HM1, HM2 = dat.fwhmBounds(histos[:6], peakVals)
+        nose.tools.assert_equal([(h1, h2) for h1, h2 in zip(HM1, HM2)],
+                                [loopFWHM(h, p) for h, p in zip(histos[:6],peakVals)])
+        nose.tools.assert_equal(dat.atFWHM(np.ones(256), 10), (None, None))
+
+    def test_batch_thresholds(self):
+        rand = np.random.RandomState(9)
+        imgs, posters = [], []
+        for n in range(3):
+            poster = np.zeros((100,100), np.uint8)+150
+            poster[:,70:] = 255
+            img = np.clip(rand.normal(100,10,(100,100)), 0, 255).astype(np.uint8)
+            img[:,70:] = np.clip(rand.normal(220,8,(100,30)), 0, 255).astype(np.uint8)
+            imgs.append(img)
+            posters.append(poster)
+        batch = ma.batchRegionThresh(imgs, posters)
+        for img, poster, Data in zip(imgs, posters, batch):
+            expected = ma.NewRegThresh(img, ma.MakeRegions(img, poster), returnData=True)[2]
+            nose.tools.assert_equal(sorted(Data), sorted(expected))
+            for reg in Data:
+                nose.tools.assert_equal(Data[reg]['PtThresh'], expected[reg]['PtThresh'])
+                nose.tools.assert_equal(Data[reg]['DirtThresh'], expected[reg]['DirtThresh'])
+
+class Test_Region_Thresholds (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(11)
+        self.img = (rand.rand(90,110)*255).astype(np.uint8)
+        # Blocks of regions, so the dirt openings meet at the borders
+        blocks = np.array(hist.REGION_LEVELS+[100])[rand.randint(0,7,(9,11))]
+        self.poster = np.kron(blocks, np.ones((10,10))).astype(np.uint8)
+        self.mask = (rand.rand(90,110) > .1).astype(np.uint8)
+
+    def test_maps_of_every_region(self):
+        Data = ma.MakeRegions(self.img, self.poster, Mask=self.mask)
+        Data = dict((reg, Data[reg]) for reg in Data if Data[reg] != 'Null')
+        for i, reg in enumerate(sorted(Data)):
+            Data[reg]['PtThresh'] = 150+10*i
+            Data[reg]['DirtThresh'] = 60+10*i
+        PtMap, DirtMap, counts = ma.regionThreshMaps(self.img, Data, Mask=self.mask)
+        masks = ma.getMasksFromPoster(self.poster)
+        ExpectedPt = np.zeros(self.img.shape, np.uint8)
+        ExpectedDirt = np.zeros(self.img.shape, np.uint8)
+        for reg in Data:
+            regionMask = masks[hist.REGION_NAMES.index(reg)]
+            nose.tools.assert_equal(Data[reg]['RegArea'], regionMask.sum())
+            Pt = ma.applyPtThresh(self.img, Data[reg]['PtThresh'], regionMask, self.mask)
+            Dirt = ma.applyDirtThresh(self.img, Data[reg]['DirtThresh'], regionMask, self.mask)
+            Moly = ma.getMolyMap(Dirt, Pt, regionMask, self.mask)
+            nose.tools.assert_equal(counts[reg], (np.count_nonzero(Pt),
+                                    np.count_nonzero(Dirt), np.count_nonzero(Moly)))
+            ExpectedPt += Pt!=0
+            ExpectedDirt += Dirt!=0
+        nose.tools.assert_true(np.array_equal(PtMap, ExpectedPt))
+        nose.tools.assert_true(np.array_equal(DirtMap, ExpectedDirt))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,145 @@
+"""
+Checks the summed-area table Kuwahara filter against a brute force version of
+the filter and against the original convolution version (KuwaharaConv) on the
+standards tiles, and that the analysis of the standards gives the same numbers
+as with KuwaharaConv.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import GenSIP.kuwahara as K
+from scipy import misc
+import GenSIP.histomethod.mainanalysis as ma
+import os
+import unittest
+import nose
+
+
+def bruteQuadrants(img, winsize):
+    """
+    Returns the exact sums and n*variance keys of the four subwindows of every
+    pixel, in the order used by Kuwahara: south-east, south-west, north-east,
+    north-west. Pixels outside of the image count as zeros.
+    """
+    c = (winsize-1)/2
+    n = (c+1)**2
+    padded = np.zeros((img.shape[0]+2*c, img.shape[1]+2*c), dtype=np.int64)
+    padded[c:c+img.shape[0], c:c+img.shape[1]] = img
+    sums = np.zeros((4,)+img.shape, dtype=np.int64)
+    keys = np.zeros((4,)+img.shape, dtype=np.int64)
+    for k,(dr,dc) in enumerate(((c,c),(c,0),(0,c),(0,0))):
+        for row in range(img.shape[0]):
+            for col in range(img.shape[1]):
+                win = padded[row+dr:row+dr+c+1, col+dc:col+dc+c+1]
+                sums[k,row,col] = win.sum()
+                keys[k,row,col] = n*(win**2).sum()-win.sum()**2
+    return sums, keys, n
+
+
+class Test_Kuwahara (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.split(__file__)[0]
+        self.STDFolder = os.path.join(self.DIRNAME,'..','..','standards','all_stds')
+        self.rand = np.random.RandomState(0).randint(0,256,(23,29)).astype(np.uint8)
+
+    def test_Kuwahara_matches_brute_force(self):
+        """
+        Like KuwaharaConv, Kuwahara only strays from the exact result where the 
+        rounded floating point arithmetic does: ties in variance, and whole 
+        means that are truncated one gray level low.
+        """
+        for w in (5,9,13):
+            sums, keys, n = bruteQuadrants(self.rand, w)
+            fast = K.Kuwahara(self.rand,w)
+            minKey = keys.min(0)
+            rows,cols = np.where(fast!=np.choose(keys.argmin(0), sums)//n)
+            for row,col in zip(rows,cols):
+                ties = keys[:,row,col]==minKey[row,col]
+                allowed = sums[ties,row,col]//n
+                allowed = np.concatenate((allowed, allowed-1))
+                nose.tools.assert_true(fast[row,col] in allowed,
+                    msg="winsize {0}: pixel {1} is {2} instead of one of {3}".format(
+                        w, (row,col), fast[row,col], allowed))
+
+    def test_Kuwahara_rejects_bad_winsize(self):
+        nose.tools.assert_raises(Exception, K.Kuwahara, self.rand, 7)
+
+    def test_Kuwahara_float_input(self):
+        # Float images of whole numbers should give the same result as uint8
+        nose.tools.assert_true(np.array_equal(K.Kuwahara(self.rand.astype(np.float64),9),
+                                              K.Kuwahara(self.rand,9)))
+
+    def test_Kuwahara_tiled_matches_untiled(self):
+        # Tiny memory limits force thin strips, so there are many seams
+        img = np.random.RandomState(1).randint(0,256,(157,61)).astype(np.uint8)
+        for w in (5,17,33):
+            whole = K.Kuwahara(img,w)
+            for maxMemory in (.05,1,4):
+                for workers in (1,3):
+                    tiled = K.Kuwahara(img,w,tiled=True,maxMemory=maxMemory,workers=workers)
+                    nose.tools.assert_true(np.array_equal(whole,tiled),
+                        msg="Tiled Kuwahara has seams: winsize {0}, {1} MB, {2} workers".format(
+                            w,maxMemory,workers))
+
+    def test_strip_plan(self):
+        # Many threads at the default memory limit: the strips keep their height
+        # and fewer threads are used, all within maxMemory
+        for W, w, workers in ((4000,17,32), (3807,17,64), (4000,33,32), (1269,17,8), (61,5,3)):
+            halo = (w-1)//2
+            stripRows, threads = K._stripPlan(W, w, 256, workers)
+            nose.tools.assert_true(stripRows >= K._MIN_STRIP_HALOS*halo)
+            nose.tools.assert_true(1 <= threads <= workers)
+            nose.tools.assert_true(threads*(stripRows+2*halo)*(W+2*halo)*K._BYTES_PER_PIXEL
+                                   <= 256*2**20)
+        # Plenty of memory for a few threads: tall strips, every thread used
+        stripRows, threads = K._stripPlan(1269, 17, 256, 4)
+        nose.tools.assert_equal(threads, 4)
+        nose.tools.assert_true(stripRows > 100)
+        # Not even one strip fits: one thread, smallest strips
+        nose.tools.assert_equal(K._stripPlan(4000, 17, .1, 32), (K._MIN_STRIP_HALOS*8, 1))
+
+    def test_Kuwahara_matches_KuwaharaConv_on_standards(self):
+        """
+        Kuwahara gives exactly the output of KuwaharaConv, ties in variance and
+        truncated means included, on the shrunk standards that PosterPreProc 
+        filters, and at full size.
+        """
+        names = sorted(f for f in os.listdir(self.STDFolder) if f.endswith('.tif'))
+        for name in names:
+            img = fun.loadImg(os.path.join(self.STDFolder,name))
+            small = misc.imresize(img, 0.1)
+            nose.tools.assert_true(np.array_equal(K.Kuwahara(small,17,tiled=True),
+                                                  K.KuwaharaConv(small,17)),
+                                   msg="Kuwahara differs from KuwaharaConv on "+name)
+        img = img[:300,:300].copy()
+        for w in (5,17,33):
+            nose.tools.assert_true(np.array_equal(K.Kuwahara(img,w), K.KuwaharaConv(img,w)),
+                                   msg="Kuwahara differs from KuwaharaConv, winsize %s" % w)
+        # Float images that are not whole numbers are done the floating point way
+        noisy = np.random.RandomState(2).rand(40,50)*255
+        nose.tools.assert_true(np.array_equal(K.Kuwahara(noisy,9), K.KuwaharaConv(noisy,9)))
+        
+    def test_analyzeByHisto_on_standards(self):
+        """
+        The results of the analysis of the standards (PtArea, PercPt, dirtNum, 
+        dirtArea, FoilArea) are the ones of the KuwaharaConv posters.
+        """
+        MaskFolder = os.path.join(self.DIRNAME,'..','..','standards','all_masks')
+        expected = {('sub_008_001.tif',False):(5.43336, 20.17, 110, 0.069168, 26.943408),
+                    ('sub_012_010.tif',False):(1.997776, 7.41, 146, 0.086608, 26.943408),
+                    ('sub_012_010.tif',True):(1.95008, 7.24, 135, 0.077424, 26.943408),
+                    ('sub_005_010.tif',True):(1.033152, 0.02, 57, 0.03928, 6858.62912)}
+        for (name, useMask), values in sorted(expected.items()):
+            img = fun.loadImg(os.path.join(self.STDFolder,name))
+            mask = fun.loadImg(os.path.join(MaskFolder,name)) if useMask else 0
+            stats, picts = ma.analyzeByHisto(img, 16, Mask=mask, verbose=False, MoDirt='both',
+                                             returnSizes=False)
+            for got, value in zip(stats, values):
+                nose.tools.assert_almost_equal(got, value, places=6,
+                    msg="{0}, mask {1}: {2} instead of {3}".format(name, useMask, stats, values))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
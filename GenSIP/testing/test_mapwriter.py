@@ -0,0 +1,74 @@
+"""
+Checks the map formats of GenSIP.mapwriter: every format reads back through
+fun.loadImg as the map that was written, posters survive the binary formats,
+and the packed rows of the bits format can be read from a memory map.
+"""
+
+import numpy as np
+import GenSIP.mapwriter as mapwriter
+import GenSIP.functions as fun
+import GenSIP.nexus as nx
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_Map_Formats (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        np.random.seed(3)
+        # Odd number of columns, so the packed rows end with a partial byte
+        self.map = (np.random.rand(61,45) > .8).astype(np.uint8)*255
+        self.poster = (np.random.rand(61,45)*4).astype(np.uint8)*60
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_round_trip(self):
+        for fmt in ('png','fastpng','png1','bits'):
+            path = mapwriter.writeMap(self.tmpDir, 'map_'+fmt, self.map, fmt)
+            nose.tools.assert_equal(os.path.splitext(path)[1], mapwriter.formatExt(fmt))
+            nose.tools.assert_true(np.array_equal(fun.loadImg(path), self.map))
+            path = mapwriter.writeMap(self.tmpDir, 'poster_'+fmt, self.poster, fmt,
+                                      binary=False)
+            nose.tools.assert_true(np.array_equal(fun.loadImg(path), self.poster))
+        nose.tools.assert_equal(mapwriter.writeMap(self.tmpDir, 'map', self.map, 'none'),
+                                None)
+        nose.tools.assert_raises(Exception, mapwriter.writeMap, self.tmpDir, 'map',
+                                 self.map, 'jpeg')
+
+    def test_packed_rows(self):
+        path = mapwriter.writeMap(self.tmpDir, 'sub_000_000', self.map, 'bits')
+        packed, shape = mapwriter.packedMap(path)
+        nose.tools.assert_true(isinstance(packed, np.memmap))
+        nose.tools.assert_equal(shape, self.map.shape)
+        rows = np.unpackbits(packed[10:20], axis=1)[:,:shape[1]]
+        nose.tools.assert_true(np.array_equal(rows*255, self.map[10:20]))
+        nose.tools.assert_equal(mapwriter.findMap(self.tmpDir, 'sub_000_000'), path)
+        nose.tools.assert_equal(mapwriter.findMap(self.tmpDir, 'sub_000_001'), None)
+
+    def test_standards_in_any_format(self):
+        # The standards method reads the standard maps whatever their format
+        DIRNAME = os.path.split(__file__)[0]
+        STDDir = os.path.join(DIRNAME,'..','..','standards')
+        name = sorted([f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                       if f.endswith('.tif')])[0]
+        path = os.path.join(STDDir,'all_stds',name)
+        imgName = os.path.splitext(name)[0]
+        for folder in ('all_plat','all_dirt'):
+            os.makedirs(os.path.join(self.tmpDir,folder))
+            stdMap = fun.loadImg(os.path.join(STDDir,folder,imgName+'.png'))
+            mapwriter.writeMap(os.path.join(self.tmpDir,folder), imgName, stdMap, 'bits')
+        expected = nx.analyzeImage(path, 16, method='standards', MoDirt='both',
+                                   stdDir=STDDir)[0]
+        data = nx.analyzeImage(path, 16, method='standards', MoDirt='both',
+                               stdDir=self.tmpDir)[0]
+        nose.tools.assert_equal(data, expected)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
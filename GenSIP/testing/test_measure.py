@@ -7,6 +7,8 @@ import numpy as np
 import GenSIP.functions as fun
 import GenSIP.measure as meas
 import os
+import shutil
+import tempfile
 import mahotas as mh
 import unittest
 import nose
@@ -207,8 +209,109 @@ class Test_Measure_With_Small_images (unittest.TestCase):
                 """.format(img, 
                     self.Exp_Res_Sm_Imgs[img]['whitePxCount'], 
                     Pt_areas[img]*1000000))
-        
-    
+
+
+"""
+_________________________________
+PARTICLE STATISTICS\____________________________________________________________
+
+"""
+class Test_Particle_Stats (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.imgs = [((rand.rand(40,50)<p)*255).astype(np.uint8) for p in (.05,.2,.4)]
+        self.cross = np.array([[0,1,0],[1,1,1],[0,1,0]])
+
+    def test_particleStats_matches_mahotas_label(self):
+        for img in self.imgs:
+            for Bc in (np.ones((3,3)), self.cross):
+                labeled, num = mh.label(img, Bc=Bc)
+                parts, labelled = meas.particleStats(img, BoundConds=Bc, returnLabelled=True)
+                nose.tools.assert_true(np.array_equal(labelled, labeled))
+                nose.tools.assert_equal(parts.size, num)
+                nose.tools.assert_true(np.array_equal(parts['area'],
+                                       mh.labeled.labeled_size(labeled)[1:]))
+                for p in parts:
+                    ys, xs = np.nonzero(labeled==p['label'])
+                    nose.tools.assert_equal((p['top'],p['left'],p['bottom'],p['right']),
+                                            (ys.min(),xs.min(),ys.max()+1,xs.max()+1))
+                    nose.tools.assert_almost_equal(p['cy'], ys.mean())
+                    nose.tools.assert_almost_equal(p['cx'], xs.mean())
+
+    def test_particleStats_backends_agree(self):
+        for img in self.imgs:
+            for Bc in (np.ones((3,3)), self.cross):
+                cvParts = meas.particleStats(img, BoundConds=Bc, backend='cv2')
+                mhParts = meas.particleStats(img, BoundConds=Bc, backend='mahotas')
+                for field in meas.PARTICLE_DTYPE.names:
+                    nose.tools.assert_true(np.allclose(cvParts[field], mhParts[field]), msg=field)
+
+    def test_particleStats_perimeter_and_minPartArea(self):
+        img = np.zeros((12,12), dtype=np.uint8)
+        img[1:6,1:6] = 255 # 5x5 square: 16 edge pixels
+        img[8,8] = 255     # single pixel
+        parts = meas.particleStats(img)
+        nose.tools.assert_equal(list(parts['perimeter']), [16,1])
+        parts = meas.particleStats(img, res=4, minPartArea=8)
+        nose.tools.assert_equal(list(parts['area']), [25])
+
+    def test_calcDirt_excludes_background_by_label(self):
+        # The particle is larger than the background
+        img = np.zeros((10,10), dtype=np.uint8)
+        img[:,:7] = 255
+        area, num = meas.calcDirt(img, 1)
+        nose.tools.assert_equal((area, num), (70, 1))
+        nose.tools.assert_raises(Exception, meas.calcDirt, img*0+np.arange(10).astype(np.uint8), 1)
+
+
+"""
+_________________________________
+SIZE ACCUMULATOR\_______________________________________________________________
+
+"""
+class Test_Size_Accumulator (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.tiles = [rand.randint(1,5000,n) for n in (0,40,300,7)]
+        self.all = np.concatenate(self.tiles)
+
+    def test_sizeData_matches_all_sizes(self):
+        acc = meas.SizeAccumulator(4)
+        for sizes in self.tiles:
+            acc.update(sizes)
+        all4 = self.all*4
+        MeanSize, MaxSize, percAreaOver100 = acc.sizeData()
+        nose.tools.assert_equal(MeanSize, round(all4.mean(),1))
+        nose.tools.assert_equal(MaxSize, all4.max())
+        nose.tools.assert_equal(percAreaOver100,
+                                round(100*float(all4[all4>7850].sum())/all4.sum(),2))
+        nose.tools.assert_equal(acc.counts.sum(), self.all.size)
+        nose.tools.assert_almost_equal(acc.areas.sum(), all4.sum())
+        nose.tools.assert_equal(meas.SizeAccumulator(4).sizeData(), ("'--","'--","'--"))
+
+    def test_merge_and_save(self):
+        first, second = meas.SizeAccumulator(4), meas.SizeAccumulator(4)
+        for sizes in self.tiles[:2]:
+            first.update(sizes)
+        for sizes in self.tiles[2:]:
+            second.update(sizes)
+        merged = first.merge(second)
+        whole = meas.SizeAccumulator(4).update(self.all)
+        nose.tools.assert_equal(merged.sizeData(), whole.sizeData())
+        nose.tools.assert_true(np.array_equal(merged.counts, whole.counts))
+        tmpDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpDir,'sizes.npz')
+            whole.save(path)
+            loaded = meas.SizeAccumulator.load(path)
+        finally:
+            shutil.rmtree(tmpDir)
+        nose.tools.assert_equal(loaded.sizeData(), whole.sizeData())
+        nose.tools.assert_true(np.array_equal(loaded.counts, whole.counts))
+        nose.tools.assert_raises(Exception, whole.merge, meas.SizeAccumulator(4, binsPerDecade=5))
+
 if __name__=='__main__':
     import sys
     print os.getcwd()
@@ -0,0 +1,189 @@
+"""
+Tests that the combined (MoDirt='both') mode of nexus.analyzeImage gives the same
+results as separate Mo and dirt runs, that animorf writes the same CSV file
+and maps with a pool of workers as it does serially, that analyzeBatch gives the
+same results for images in memory as analyzeImage does for their paths, and that
+the analysis backends are only imported when they are used.
+"""
+
+import numpy as np
+import GenSIP.nexus as nx
+import GenSIP.functions as fun
+import GenSIP.benchmarks.bench_import as bench
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_AnalyzeImage_Both (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.split(__file__)[0]
+        self.STDDir = os.path.join(self.DIRNAME,'..','..','standards')
+        names = sorted([f for f in os.listdir(os.path.join(self.STDDir,'all_stds'))
+                        if f.endswith('.tif')])
+        self.path = os.path.join(self.STDDir,'all_stds',names[0])
+
+    def check_both(self, method):
+        moData, moPicts = nx.analyzeImage(self.path, 16, method=method, MoDirt='mo',
+                                          stdDir=self.STDDir)
+        dirtData, dirtPicts = nx.analyzeImage(self.path, 16, method=method, MoDirt='dirt',
+                                              stdDir=self.STDDir)
+        bothData, bothPicts = nx.analyzeImage(self.path, 16, method=method, MoDirt='both',
+                                              stdDir=self.STDDir)
+        expected = dict(moData)
+        expected.update(dirtData)
+        nose.tools.assert_equal(bothData, expected)
+        nose.tools.assert_equal(len(bothPicts), 3)
+        nose.tools.assert_true(np.array_equal(bothPicts[0], moPicts[0]))
+        nose.tools.assert_true(np.array_equal(bothPicts[1], dirtPicts[0]))
+        nose.tools.assert_true(np.array_equal(bothPicts[2], moPicts[1]))
+
+    def test_both_bigfoils(self):
+        self.check_both('bigfoils')
+
+    def test_both_cleantests(self):
+        self.check_both('cleantests')
+
+    def test_both_standards(self):
+        self.check_both('standards')
+
+class Test_Animorf_Workers (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.abspath(os.path.split(__file__)[0])
+        self.folder = os.path.join(self.DIRNAME,'..','..','standards','all_stds')
+        self.cwd = os.getcwd()
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpDir)
+
+    def runAnimorf(self, workers):
+        runDir = os.path.join(self.tmpDir,str(workers))
+        os.makedirs(runDir)
+        os.chdir(runDir)
+        nx.animorf(self.folder, 16, method='cleantests', MoDirt='both', 
+                   posterCache=None, workers=workers)
+        os.chdir(self.cwd)
+        return os.path.join(runDir,'Output','Output_all_stds_cleantests')
+
+    def test_workers_match_serial(self):
+        serial = self.runAnimorf(1)
+        pooled = self.runAnimorf(2)
+        csvName = 'Both_ouput_all_stds.csv'
+        nose.tools.assert_true(filecmp.cmp(os.path.join(serial,csvName),
+                                           os.path.join(pooled,csvName), shallow=False))
+        for folder in ('PtMaps','DirtMaps'):
+            names = sorted(os.listdir(os.path.join(serial,folder)))
+            nose.tools.assert_equal(names, sorted(os.listdir(os.path.join(pooled,folder))))
+            match, mismatch, errors = filecmp.cmpfiles(os.path.join(serial,folder),
+                                                       os.path.join(pooled,folder),
+                                                       names, shallow=False)
+            nose.tools.assert_equal(mismatch+errors, [])
+
+class Test_Analyze_Batch (unittest.TestCase):
+
+    def setUp(self):
+        DIRNAME = os.path.split(__file__)[0]
+        folder = os.path.join(DIRNAME,'..','..','standards','all_stds')
+        files = sorted([f for f in os.listdir(folder) if f.endswith('.tif')])[:3]
+        self.paths = [os.path.join(folder,f) for f in files]
+        self.names = [os.path.splitext(f)[0] for f in files]
+        self.imgs = [fun.loadImg(p) for p in self.paths]
+        # A different mask for every image, so a wrong pairing shows
+        self.masks = {}
+        for i, name in enumerate(self.names):
+            mask = np.ones(self.imgs[i].shape, np.uint8)*255
+            mask[:,:200*(i+1)] = 0
+            self.masks[name] = mask
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def check(self, results, imgs, masks):
+        # Same results as analyzeImage on every image
+        results = list(results)
+        nose.tools.assert_equal([r[0] for r in results], self.names)
+        for i, (name, data, picts) in enumerate(results):
+            expData, expPicts = nx.analyzeImage(self.paths[i], 16, method='bigfoils', 
+                                                MoDirt='both', Mask=masks[i],
+                                                img=imgs[i])
+            nose.tools.assert_equal(data, expData)
+            for pict, expPict in zip(picts, expPicts):
+                nose.tools.assert_true(np.array_equal(pict, expPict))
+
+    def test_arrays_match_paths(self):
+        items = zip(self.names, self.imgs)
+        self.check(nx.analyzeBatch(items, 16, method='bigfoils', MoDirt='both'), 
+                   self.imgs, [0]*3)
+        masks = [self.masks[n] for n in self.names]
+        items = zip(self.names, self.paths, masks)
+        self.check(nx.analyzeBatch(iter(items), 16, method='bigfoils', 
+                                   MoDirt='both', pipeline=False), self.imgs, masks)
+
+    def test_stack_masks_by_name(self):
+        # The images are not all the same size
+        imgs = [img[:1000,:1000] for img in self.imgs]
+        masks = dict([(n,m[:1000,:1000]) for n,m in self.masks.items()])
+        stack = np.array(imgs)
+        self.check(nx.analyzeBatch(stack, 16, method='bigfoils', MoDirt='both', 
+                                   names=self.names, Masks=masks),
+                   imgs, [masks[n] for n in self.names])
+        maskStack = np.array([masks[n] for n in self.names])
+        self.check(nx.analyzeBatch(stack, 16, method='bigfoils', MoDirt='both', 
+                                   names=self.names, Masks=maskStack),
+                   imgs, maskStack)
+        # Without names, the images have no masks in the dictionary
+        results = nx.analyzeBatch(stack, 16, method='bigfoils', Masks=masks)
+        nose.tools.assert_raises(Exception, list, results)
+
+    def test_map_folders(self):
+        mapFolder = self.tmpDir+'/'
+        results = list(nx.analyzeBatch(zip(self.names, self.imgs), 16, 
+                                       method='bigfoils', mapFolders=[mapFolder]))
+        nose.tools.assert_equal([r[2] for r in results], [None]*3)
+        nose.tools.assert_equal(sorted(os.listdir(mapFolder)), 
+                                [n+'.png' for n in self.names])
+
+class Test_Method_Registry (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.split(__file__)[0]
+        STDDir = os.path.join(self.DIRNAME,'..','..','standards')
+        names = sorted([f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                        if f.endswith('.tif')])
+        self.path = os.path.join(STDDir,'all_stds',names[0])
+
+    def tearDown(self):
+        nx.METHODS.pop('fake', None)
+
+    def test_import_is_lazy(self):
+        seconds, heavy = bench.coldImport('GenSIP.nexus', repeats=1)
+        nose.tools.assert_equal(heavy, [])
+
+    def test_unknown_method(self):
+        nose.tools.assert_raises(Exception, nx.analyzeImage, self.path, 16, 
+                                 method='no such method')
+
+    def test_registered_backend(self):
+        def fake(img, mask, res, doMo, doDirt, **kwargs):
+            results = {'moData':nx.blankDataDict('mo'), 'PtMap':img<100,
+                       'DirtNum':2, 'DirtArea':.5, 'DirtSizes':np.array([4,8]),
+                       'DirtMap':img<50}
+            return results, img
+        nx.registerMethod(['Fake'], fake)
+        data, picts = nx.analyzeImage(self.path, 16, method='FAKE', MoDirt='both')
+        nose.tools.assert_equal(data['Pt Area (mm^2)'], "'--")
+        nose.tools.assert_equal(data['Dirt Count'], 2)
+        nose.tools.assert_equal(len(picts), 3)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,128 @@
+"""
+Checks GenSIP.pipeline.runPipeline: every item goes through the three stages in
+order, the stage statistics count the items, and an exception in any stage is
+raised after the items that were already computed have been saved. 
+mainanalysis.runOnSubImgs gives the results of analyzeByHisto on every sub image
+through the pipeline.
+"""
+
+import numpy as np
+import GenSIP.pipeline as pipe
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+import GenSIP.histomethod.mainanalysis as ma
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import nose
+
+DIRNAME = os.path.split(__file__)[0]
+STDDir = os.path.abspath(os.path.join(DIRNAME,'..','..','standards'))
+
+
+class Test_Pipeline (unittest.TestCase):
+
+    def setUp(self):
+        self.saved = []
+        self.threads = set()
+
+    def load(self, item):
+        self.threads.add(('load',threading.current_thread().name))
+        time.sleep(.001*(item%3))
+        return item*10
+
+    def compute(self, item, loaded):
+        self.threads.add(('compute',threading.current_thread().name))
+        return loaded+1
+
+    def save(self, item, computed):
+        self.threads.add(('save',threading.current_thread().name))
+        self.saved.append((item, computed))
+
+    def test_order_and_stats(self):
+        for threaded in (True, False):
+            self.saved = []
+            stats = pipe.runPipeline(range(20), self.load, self.compute, self.save,
+                                     threaded=threaded, prefetch=1, backlog=1)
+            nose.tools.assert_equal(self.saved, [(i,i*10+1) for i in range(20)])
+            for stage in stats.stages:
+                nose.tools.assert_equal(stage.items, 20)
+            nose.tools.assert_true(stats.wall > 0)
+            nose.tools.assert_equal(len(stats.report().split('\n')), 4)
+
+    def test_stages_on_their_own_threads(self):
+        pipe.runPipeline(range(5), self.load, self.compute, self.save)
+        main = threading.current_thread().name
+        names = dict(self.threads)
+        nose.tools.assert_equal(len(self.threads), 3)
+        nose.tools.assert_equal(names['compute'], main)
+        nose.tools.assert_not_equal(names['load'], main)
+        nose.tools.assert_not_equal(names['save'], main)
+
+    def test_compute_error(self):
+        def compute(item, loaded):
+            if item == 7:
+                raise ValueError("bad item")
+            return loaded+1
+        nose.tools.assert_raises(ValueError, pipe.runPipeline, range(20),
+                                 self.load, compute, self.save)
+        # Everything computed before the error is saved
+        nose.tools.assert_equal(self.saved, [(i,i*10+1) for i in range(7)])
+
+    def test_load_and_save_errors(self):
+        def load(item):
+            if item == 3:
+                raise IOError("unreadable")
+            return item
+        nose.tools.assert_raises(IOError, pipe.runPipeline, range(10),
+                                 load, self.compute, self.save)
+        nose.tools.assert_equal([i for i,c in self.saved], [0,1,2])
+        def save(item, computed):
+            if item == 2:
+                raise IOError("disk full")
+        nose.tools.assert_raises(IOError, pipe.runPipeline, range(50),
+                                 self.load, self.compute, save)
+        nose.tools.assert_equal(threading.active_count(), 1)
+
+class Test_Run_On_Sub_Images (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpDir)
+        name = sorted(f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                      if f.endswith('.tif'))[0]
+        pan = fun.loadImg(os.path.join(STDDir,'all_stds',name),0)
+        mask = fun.loadImg(os.path.join(STDDir,'all_masks',name),0)
+        images.splitImage(pan, 4, path='in', name='pan')
+        images.splitImage(mask, 4, path='in', name='mask')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpDir)
+
+    def test_results_of_every_sub_image(self):
+        for pipeline in (True, False):
+            run = 'run'+str(pipeline)
+            Results = ma.runOnSubImgs('in/sub_imgs_pan', 'in/sub_imgs_mask', 16, run,
+                                      verbose=False, pipeline=pipeline)
+            nose.tools.assert_equal(sorted(Results), ['sub_000_000','sub_000_001',
+                                                      'sub_001_000','sub_001_001'])
+            for sub in Results:
+                img = fun.loadImg('in/sub_imgs_pan/'+sub+'.tif')
+                mask = fun.loadImg('in/sub_imgs_mask/'+sub+'.tif')
+                stats, picts = ma.analyzeByHisto(img, 16, Mask=mask, verbose=False,
+                                                 MoDirt='both')
+                nose.tools.assert_equal(Results[sub], {'PtArea':stats[0],
+                                        'dirtNum':stats[2], 'dirtArea':stats[3]})
+                PtMap = fun.loadImg('Output/'+run+'/PtMaps/'+sub+'.png')
+                nose.tools.assert_true(np.array_equal(PtMap!=0, picts[0]!=0))
+            nose.tools.assert_true(os.path.exists('Output/'+run+'/DirtMaps/montage.png'))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
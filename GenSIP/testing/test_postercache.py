@@ -0,0 +1,82 @@
+"""
+Tests the memory and disk tiers of the poster cache in GenSIP.postercache, and
+that makePoster and PosterPreProc give the same posters with and without it.
+"""
+
+import numpy as np
+import GenSIP.postercache as pc
+import GenSIP.functions as fun
+import GenSIP.histomethod.mainanalysis as ma
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_PosterCache (unittest.TestCase):
+
+    def setUp(self):
+        self.img = np.random.RandomState(0).randint(0,256,(200,300)).astype(np.uint8)
+        self.calls = []
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def compute(self):
+        self.calls.append(1)
+        return self.img//2
+
+    def test_memory_tier(self):
+        cache = pc.PosterCache()
+        first = cache.get('stage', self.img, {'a':1}, self.compute)
+        second = cache.get('stage', self.img, {'a':1}, self.compute)
+        nose.tools.assert_equal(len(self.calls), 1)
+        nose.tools.assert_true(np.array_equal(first, second))
+        # Returned posters are copies, so changing one does not change the cache
+        second[:] = 0
+        nose.tools.assert_true(np.array_equal(cache.get('stage', self.img, {'a':1}, self.compute), first))
+
+    def test_key_changes(self):
+        cache = pc.PosterCache()
+        cache.get('stage', self.img, {'a':1}, self.compute)
+        cache.get('stage', self.img, {'a':2}, self.compute)
+        cache.get('other', self.img, {'a':1}, self.compute)
+        cache.get('stage', self.img, {'a':1}, self.compute, mask=self.img>10)
+        changed = self.img.copy()
+        changed[0,0] += 1
+        cache.get('stage', changed, {'a':1}, self.compute)
+        nose.tools.assert_equal(len(self.calls), 5)
+
+    def test_disk_tier(self):
+        cache = pc.PosterCache(cacheDir=self.tmpDir)
+        first = cache.get('stage', self.img, {'a':1}, self.compute)
+        # A new cache with an empty memory tier, as in a new run
+        cache = pc.PosterCache(cacheDir=self.tmpDir)
+        second = cache.get('stage', self.img, {'a':1}, self.compute)
+        nose.tools.assert_equal(len(self.calls), 1)
+        nose.tools.assert_equal(cache.stats()['disk hits'], 1)
+        nose.tools.assert_true(np.array_equal(first, second))
+
+    def test_lru_eviction(self):
+        # Room for two 60000 byte posters only
+        cache = pc.PosterCache(maxMemory=.12)
+        for a in (1,2,3):
+            cache.get('stage', self.img, {'a':a}, self.compute)
+        nose.tools.assert_equal(cache.stats()['items'], 2)
+        cache.get('stage', self.img, {'a':3}, self.compute)
+        nose.tools.assert_equal(len(self.calls), 3)
+        cache.get('stage', self.img, {'a':1}, self.compute)
+        nose.tools.assert_equal(len(self.calls), 4)
+
+    def test_posters_match_uncached(self):
+        img = self.img
+        nose.tools.assert_true(np.array_equal(fun.makePoster(img),
+                                              fun.makePoster(img,useCache=False)))
+        nose.tools.assert_true(np.array_equal(ma.PosterPreProc(img,ExcludePt=True),
+                                              ma.PosterPreProc(img,ExcludePt=True,useCache=False)))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,56 @@
+"""
+Tests the lookup table posterization engine in GenSIP.posterize against the band
+tables that posterfy and bigPosterfy used to apply with chained comparisons.
+"""
+
+import numpy as np
+import GenSIP.posterize as post
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+import unittest
+import nose
+
+
+class Test_Posterize (unittest.TestCase):
+
+    def setUp(self):
+        # Every gray level, repeated over a few rows
+        self.ramp = np.tile(np.arange(256, dtype=np.uint8), (4,1))
+
+    def test_smallfoils_bands(self):
+        img = self.ramp
+        expected = np.zeros(img.shape, dtype=np.uint8)
+        expected[(5<=img)&(img<=75)] = 50
+        expected[(76<=img)&(img<=110)] = 85
+        expected[(111<=img)&(img<=199)] = 150
+        expected[200<=img] = 255
+        poster = post.posterizeLUT(img, 'smallfoils')
+        nose.tools.assert_true(np.array_equal(poster, expected))
+
+    def test_bigfoils_bands_and_bigPosterfy(self):
+        img = self.ramp
+        expected = np.zeros(img.shape, dtype=np.uint8)
+        expected[(5<=img)&(img<=40)] = 50
+        expected[(41<=img)&(img<=139)] = 85
+        expected[(140<=img)&(img<=195)] = 150
+        expected[(196<=img)&(img<=215)] = 200
+        expected[216<=img] = 255
+        nose.tools.assert_true(np.array_equal(images.bigPosterfy(img), expected))
+
+    def test_labels_match_poster(self):
+        poster, labels = fun.posterfy(self.ramp, returnLabels=True)
+        for label, level in enumerate(post.REGION_GRAYLEVELS):
+            nose.tools.assert_true(np.array_equal(labels==label, poster==level),
+                                   msg="Label {0} does not match gray level {1}".format(label, level))
+
+    def test_registerPreset_rejects_gaps(self):
+        nose.tools.assert_raises(Exception, post.registerPreset, 'gappy',
+                                 [(0,4,0),(6,255,150)])
+
+    def test_unknown_preset(self):
+        nose.tools.assert_raises(Exception, post.posterizeLUT, self.ramp, 'nonexistent')
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,87 @@
+"""
+Checks the montage pyramid of GenSIP.bigscans.pyramid: every level is the area
+average of the montage, whatever the strips it was written in, regions read from
+the tiles match the whole level, and level 0 reads the sub-images back.
+"""
+
+import numpy as np
+import GenSIP.bigscans.images as images
+import GenSIP.bigscans.pyramid as pyr
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+def blockMeans(img, k):
+    # Rounded mean of every 2**k by 2**k block, the slow way
+    n = 2**k
+    rows, cols = -(-img.shape[0]//n), -(-img.shape[1]//n)
+    out = np.zeros((rows, cols)+img.shape[2:], np.uint8)
+    for r in range(rows):
+        for c in range(cols):
+            block = img[r*n:(r+1)*n, c*n:(c+1)*n].astype(np.float64)
+            out[r,c] = np.floor(block.mean(axis=(0,1))+.5)
+    return out
+
+class Test_Pyramid (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        rand = np.random.RandomState(4)
+        self.pan = (rand.rand(157,203)*255).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_levels_are_area_averages(self):
+        folder = os.path.join(self.tmpDir,'pyramid')
+        writer = pyr.PyramidWriter(folder, self.pan.shape, tileSize=16, screenSize=30)
+        # Strips that do not line up with the blocks of any level
+        for top in range(0, self.pan.shape[0], 11):
+            writer.write(self.pan[top:top+11])
+        index = writer.close()
+        nose.tools.assert_equal(len(index['levels']), pyr.pyramidLevels(self.pan.shape, 30))
+        p = pyr.openPyramid(folder)
+        for level in range(1, p.numLevels()):
+            expected = blockMeans(self.pan, level)
+            nose.tools.assert_equal(p.levelShape(level), expected.shape)
+            nose.tools.assert_true(np.array_equal(p.read(level), expected), msg=level)
+            nose.tools.assert_true(np.array_equal(p.read(level, 3, 5, 9, 20),
+                                                  expected[3:12,5:25]))
+        nose.tools.assert_true(max(p.levelShape(p.numLevels()-1)) <= 30)
+        nose.tools.assert_equal(p.levelFor(60), 2)
+
+    def test_stitched_map(self):
+        mapPan = (self.pan > 180).astype(np.uint8)*255
+        images.splitImage(mapPan, 9, path=self.tmpDir, name='map')
+        folder = os.path.join(self.tmpDir,'sub_imgs_map')
+        images.stitchImage(folder, imgType='.tif', tileSize=32, screenSize=40)
+        p = pyr.openPyramid(os.path.join(folder,'montage_pyramid'))
+        nose.tools.assert_true(p.coverage)
+        # Coverage fraction of the blocks of level 2
+        fraction = p.read(2)/255.
+        expected = blockMeans(mapPan, 2)/255.
+        nose.tools.assert_true(np.allclose(fraction, expected))
+        # Level 0 comes from the sub-images
+        nose.tools.assert_true(np.array_equal(p.read(0), mapPan))
+        nose.tools.assert_true(np.array_equal(p.read(0, 40, 50, 70, 90),
+                                              mapPan[40:110,50:140]))
+
+    def test_color(self):
+        rand = np.random.RandomState(5)
+        color = (rand.rand(70,50,3)*255).astype(np.uint8)
+        images.splitImage(color, 4, path=self.tmpDir, name='color')
+        folder = os.path.join(self.tmpDir,'sub_imgs_color')
+        images.stitchImage(folder, imgType='.tif', color=1, tileSize=16, screenSize=20)
+        p = pyr.openPyramid(os.path.join(folder,'montage_pyramid'))
+        nose.tools.assert_false(p.coverage)
+        # BGR, like the sub-images
+        nose.tools.assert_true(np.array_equal(p.read(1), blockMeans(color, 1)))
+        nose.tools.assert_true(np.array_equal(p.read(0), color))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
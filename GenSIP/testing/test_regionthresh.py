@@ -0,0 +1,57 @@
+"""
+Checks the fused region thresholding kernel (GenSIP.regionthresh) against the
+per-region version (regionThresholdLoop) that regionalThresh and
+bigRegionalThresh used before.
+"""
+
+import numpy as np
+import GenSIP.regionthresh as RT
+import unittest
+import nose
+
+
+class Test_RegionThreshold (unittest.TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.img = rand.randint(0,256,(64,80)).astype(np.uint8)
+        # Posters with every big foil region level, plus some levels that are
+        # in no region
+        self.poster = rand.choice([0,50,85,150,200,255,17],(64,80)).astype(np.uint8)
+        self.regions = {50:(8,5), 85:(28,5), 150:(55,3), 200:(60,3), 255:(70,3)}
+
+    def test_binary_matches_loop(self):
+        for gaussBlur in (3,5,7):
+            regions = dict([(g,(t,5 if g in (50,85) else gaussBlur))
+                            for g,(t,k) in self.regions.items()])
+            nose.tools.assert_true(np.array_equal(
+                RT.regionThreshold(self.img, self.poster, regions),
+                RT.regionThresholdLoop(self.img, self.poster, regions)))
+
+    def test_all_threshold_types_match_loop(self):
+        rand = np.random.RandomState(1)
+        for threshType in range(5):
+            for i in range(5):
+                # Thresholds outside of 0-255 and non-integer thresholds too
+                ths = rand.uniform(-5,265,5)
+                regions = dict(zip(sorted(self.regions),
+                                   [(t,self.regions[g][1]) for g,t in zip(sorted(self.regions),ths)]))
+                nose.tools.assert_true(np.array_equal(
+                    RT.regionThreshold(self.img, self.poster, regions, threshType),
+                    RT.regionThresholdLoop(self.img, self.poster, regions, threshType)),
+                    msg="threshType {0}, thresholds {1}".format(threshType, ths))
+
+    def test_out_buffer_and_blurs(self):
+        out = np.zeros(self.img.shape, dtype=np.uint8)
+        blurs = RT.blurImage(self.img, (3,5))
+        ret = RT.regionThreshold(self.img, self.poster, self.regions, blurs=blurs, out=out)
+        nose.tools.assert_true(ret is out)
+        nose.tools.assert_true(np.array_equal(out,
+            RT.regionThresholdLoop(self.img, self.poster, self.regions)))
+        nose.tools.assert_raises(Exception, RT.regionThreshold, self.img, self.poster,
+                                 self.regions, out=np.zeros((3,3), dtype=np.uint8))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,77 @@
+"""
+Checks the streaming montage stitcher of GenSIP.bigscans.images: stitchImage
+gives back the panorama that splitImage cut up, for TIFF tiles, PNG tiles and
+packed map tiles, and the tile sizes read from the file headers are the sizes
+of the decoded tiles.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import GenSIP.mapwriter as mapwriter
+import GenSIP.bigscans.images as images
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_Stitch (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        rand = np.random.RandomState(1)
+        # A panorama size that does not divide evenly into the tiles
+        self.pan = (rand.rand(203,171)*255).astype(np.uint8)
+        images.splitImage(self.pan, 16, path=self.tmpDir, name='pan')
+        self.folder = os.path.join(self.tmpDir,'sub_imgs_pan')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_stitch_tiff(self):
+        # Strips that do not line up with the tiles
+        path = images.stitchImage(self.folder, imgType='.tif', stripRows=7)
+        nose.tools.assert_true(np.array_equal(fun.loadImg(path), self.pan))
+        # Only the montage and its pyramid are left behind
+        left = [f for f in os.listdir(self.folder) if not f.startswith('sub_')]
+        nose.tools.assert_equal(sorted(left), ['montage.png','montage_pyramid'])
+
+    def test_stitch_map_formats(self):
+        mapPan = (self.pan > 200).astype(np.uint8)*255
+        for fmt in ('png1','bits'):
+            folder = os.path.join(self.tmpDir, fmt)
+            os.makedirs(folder)
+            for name in os.listdir(self.folder):
+                tile = fun.loadImg(os.path.join(self.folder,name)) > 200
+                mapwriter.writeMap(folder, os.path.splitext(name)[0],
+                                   tile.astype(np.uint8)*255, fmt)
+            path = images.stitchImage(folder, imgType=mapwriter.formatExt(fmt))
+            nose.tools.assert_true(np.array_equal(fun.loadImg(path), mapPan))
+
+    def test_stitch_color(self):
+        rand = np.random.RandomState(2)
+        color = (rand.rand(40,30,3)*255).astype(np.uint8)
+        images.splitImage(color, 4, path=self.tmpDir, name='color')
+        path = images.stitchImage(os.path.join(self.tmpDir,'sub_imgs_color'),
+                                  imgType='.tif', color=1)
+        # The montage is RGB, and loads as BGR like the tiles
+        nose.tools.assert_true(np.array_equal(fun.loadImg(path, 1), color))
+
+    def test_shapes_from_headers(self):
+        grid, rowHeights, colWidths = images.tileLayout(self.folder, '.tif')
+        for r, row in enumerate(grid):
+            for c, name in enumerate(row):
+                path = os.path.join(self.folder,name)
+                shape = fun.loadImg(path).shape
+                nose.tools.assert_equal(images.imageShape(path), shape)
+                nose.tools.assert_equal((rowHeights[r],colWidths[c]), shape)
+        path = mapwriter.writeMap(self.tmpDir, 'map', self.pan, 'png')
+        nose.tools.assert_equal(images.imageShape(path), self.pan.shape)
+        path = mapwriter.writeMap(self.tmpDir, 'map', self.pan, 'bits')
+        nose.tools.assert_equal(images.imageShape(path), self.pan.shape)
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
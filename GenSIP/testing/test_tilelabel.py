@@ -0,0 +1,62 @@
+"""
+Checks that splitImage covers the whole panorama, and that the seam-aware tiled
+labelling of GenSIP.bigscans.tilelabel gives the same particles as labelling the
+whole panorama with measure.particleStats.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import GenSIP.measure as meas
+import GenSIP.bigscans.images as images
+import GenSIP.bigscans.tilelabel as tl
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_TiledLabelling (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        rand = np.random.RandomState(0)
+        # Random dirt with particles on every seam, and a panorama size that
+        # does not divide evenly into the tiles
+        self.pan = ((rand.rand(103,91)<.35)*255).astype(np.uint8)
+        images.splitImage(self.pan, 16, path=self.tmpDir, name='pan')
+        self.folder = os.path.join(self.tmpDir,'sub_imgs_pan')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_splitImage_keeps_every_pixel(self):
+        names, nRows, nCols = tl.listTileGrid(self.folder, '.tif')
+        rows = []
+        for r in range(nRows):
+            rows.append(np.hstack([fun.loadImg(os.path.join(self.folder,n),0)
+                                   for n in names[r*nCols:(r+1)*nCols]]))
+        nose.tools.assert_true(np.array_equal(np.vstack(rows), self.pan))
+
+    def test_tiled_matches_panorama(self):
+        cross = np.array([[0,1,0],[1,1,1],[0,1,0]])
+        for Bc in (np.ones((3,3)), cross):
+            full = meas.particleStats(self.pan, BoundConds=Bc)
+            tiled = tl.tiledParticleStats(self.folder, imgType='.tif', BoundConds=Bc)
+            nose.tools.assert_equal(full.size, tiled.size)
+            full = full[np.lexsort((full['cx'],full['cy']))]
+            tiled = tiled[np.lexsort((tiled['cx'],tiled['cy']))]
+            for field in ('area','top','left','bottom','right','perimeter'):
+                nose.tools.assert_true(np.array_equal(full[field], tiled[field]), msg=field)
+            nose.tools.assert_true(np.allclose(full['cy'], tiled['cy']))
+            nose.tools.assert_true(np.allclose(full['cx'], tiled['cx']))
+
+    def test_minPartArea_after_merging(self):
+        full = meas.particleStats(self.pan, res=4, minPartArea=40)
+        tiled = tl.tiledParticleStats(self.folder, res=4, imgType='.tif', minPartArea=40)
+        nose.tools.assert_equal(sorted(full['area']), sorted(tiled['area']))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
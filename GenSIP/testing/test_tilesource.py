@@ -0,0 +1,167 @@
+"""
+Checks the virtual sub-images of GenSIP.bigscans.tilesource: a TileSource serves
+the same sub-images that splitImage writes, from panoramas that are memory
+mapped or read a strip at a time, and analyzeSubImages and runOnSubImgs give
+the same results on a TileSource as on the folders of sub-images.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+import GenSIP.bigscans.bigfoils as bf
+import GenSIP.bigscans.tilesource as tilesource
+import GenSIP.histomethod.mainanalysis as ma
+import cv2
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import nose
+
+DIRNAME = os.path.split(__file__)[0]
+STDDir = os.path.join(DIRNAME,'..','..','standards')
+
+def writeStripTiff(path, img, rowsPerStrip, gap=0):
+    # Uncompressed 8 bit grayscale TIFF, with gap bytes between the strips
+    rows, cols = img.shape
+    starts = range(0, rows, rowsPerStrip)
+    counts = [min(rowsPerStrip, rows-s)*cols for s in starts]
+    entries = 9
+    arrays = 8+2+12*entries+4
+    offsets, pos = [], arrays+8*len(starts)
+    for count in counts:
+        offsets.append(pos)
+        pos += count+gap
+    def entry(tag, fieldType, count, value):
+        return struct.pack('<HHII', tag, fieldType, count, value)
+    with open(path,'wb') as f:
+        f.write('II*\x00'+struct.pack('<I', 8)+struct.pack('<H', entries))
+        f.write(entry(256, 4, 1, cols) + entry(257, 4, 1, rows) + entry(258, 3, 1, 8) +
+                entry(259, 3, 1, 1) + entry(262, 3, 1, 1) +
+                entry(273, 4, len(starts), arrays) + entry(277, 3, 1, 1) +
+                entry(278, 4, 1, rowsPerStrip) +
+                entry(279, 4, len(starts), arrays+4*len(starts)))
+        f.write(struct.pack('<I', 0))
+        f.write(struct.pack('<%dI' % len(starts), *offsets))
+        f.write(struct.pack('<%dI' % len(starts), *counts))
+        for s in starts:
+            f.write(img[s:s+rowsPerStrip].tostring()+'\x00'*gap)
+
+class Test_Tile_Source (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        rand = np.random.RandomState(6)
+        self.pan = (rand.rand(203,171)*255).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_grid_of_splitImage(self):
+        images.splitImage(self.pan, 16, path=self.tmpDir, name='pan')
+        folder = os.path.join(self.tmpDir,'sub_imgs_pan')
+        tiles = tilesource.TileSource(self.pan, self.pan, numParts=16)
+        files = sorted(os.listdir(folder))
+        nose.tools.assert_equal(tiles.names(), [os.path.splitext(f)[0] for f in files])
+        for name in tiles.names():
+            img, mask = tiles.tile(name)
+            nose.tools.assert_true(np.array_equal(img,
+                                   fun.loadImg(os.path.join(folder,name+'.tif'))))
+        # No pixel is lost at the seams
+        nose.tools.assert_equal(sum(b-a for a, b in tilesource.gridBounds(203,4)), 203)
+
+    def test_panorama_files(self):
+        npyPath = os.path.join(self.tmpDir,'pan.npy')
+        np.save(npyPath, self.pan)
+        rawPath = os.path.join(self.tmpDir,'pan.raw')
+        self.pan.tofile(rawPath)
+        tifPath = os.path.join(self.tmpDir,'pan.tif')
+        writeStripTiff(tifPath, self.pan, 10)
+        gapPath = os.path.join(self.tmpDir,'gaps.tif')
+        writeStripTiff(gapPath, self.pan, 7, gap=3)
+        lzwPath = os.path.join(self.tmpDir,'lzw.tif')
+        cv2.imwrite(lzwPath, self.pan)
+        pans = [tilesource.openPanorama(npyPath),
+                tilesource.openPanorama(rawPath, self.pan.shape),
+                tilesource.openPanorama(tifPath),
+                tilesource.openPanorama(gapPath),
+                tilesource.openPanorama(lzwPath)]
+        for pan in pans[:3]:
+            nose.tools.assert_true(isinstance(pan, np.memmap))
+        nose.tools.assert_true(isinstance(pans[3], tilesource.TiffStrips))
+        for pan in pans:
+            nose.tools.assert_equal(tuple(pan.shape), self.pan.shape)
+            nose.tools.assert_true(np.array_equal(pan[13:50,20:90], self.pan[13:50,20:90]))
+            nose.tools.assert_true(np.array_equal(pan[0:203,:], self.pan))
+
+    def test_halo(self):
+        tiles = tilesource.TileSource(self.pan, None, numParts=9, halo=5)
+        for name in tiles.names():
+            top, bottom, left, right = tiles.bounds(name)
+            img, mask = tiles.tile(name)
+            nose.tools.assert_true(np.array_equal(img[tiles.core(name)],
+                                                  self.pan[top:bottom,left:right]))
+            nose.tools.assert_true((mask==255).all())
+        nose.tools.assert_equal(tiles.window('sub_000_000'), (0, 72, 0, 62))
+        nose.tools.assert_equal(tiles.window('sub_001_001'), (62, 139, 52, 119))
+
+    def test_analyze_virtual(self):
+        name = sorted(f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                      if f.endswith('.tif'))[0]
+        pan = fun.loadImg(os.path.join(STDDir,'all_stds',name),0)
+        mask = fun.loadImg(os.path.join(STDDir,'all_masks',name),0)
+        cwd = os.getcwd()
+        os.chdir(self.tmpDir)
+        try:
+            images.splitImage(pan, 4, path='in', name='pan')
+            images.splitImage(mask, 4, path='in', name='mask')
+            bf.analyzeSubImages('in/sub_imgs_pan', 'in/sub_imgs_mask', 16, 'files',
+                                'Q1', 'dirt', pipeline=False)
+            np.save('pan.npy', pan)
+            np.save('mask.npy', mask)
+            tiles = tilesource.TileSource('pan.npy', 'mask.npy', numParts=4)
+            bf.analyzeSubImages(tiles, None, 16, 'virtual', 'Q1', 'dirt', pipeline=False)
+            tiles = tilesource.TileSource('pan.npy', 'mask.npy', numParts=4, halo=16)
+            bf.analyzeSubImages(tiles, None, 16, 'halo', 'Q1', 'dirt', pipeline=False)
+            out = {}
+            for run in ('files','virtual','halo'):
+                folder = 'Output/Output_'+run+'/Q1/'
+                rows = open(folder+'Q1_dirtData.csv').read().split('\n')[5:]
+                out[run] = rows, fun.loadImg(folder+'DirtMaps/montage.png')
+        finally:
+            os.chdir(cwd)
+        nose.tools.assert_equal(out['virtual'][0], out['files'][0])
+        nose.tools.assert_true(np.array_equal(out['virtual'][1], out['files'][1]))
+        # The halo only changes the sub-images near the seams
+        nose.tools.assert_equal(out['halo'][1].shape, pan.shape)
+
+    def test_run_on_virtual(self):
+        name = sorted(f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                      if f.endswith('.tif'))[0]
+        pan = fun.loadImg(os.path.join(STDDir,'all_stds',name),0)
+        mask = fun.loadImg(os.path.join(STDDir,'all_masks',name),0)
+        cwd = os.getcwd()
+        os.chdir(self.tmpDir)
+        try:
+            images.splitImage(pan, 4, path='in', name='pan')
+            images.splitImage(mask, 4, path='in', name='mask')
+            files = ma.runOnSubImgs('in/sub_imgs_pan', 'in/sub_imgs_mask', 16, 'files',
+                                    verbose=False, pipeline=False)
+            tiles = tilesource.TileSource(pan, mask, numParts=4)
+            virtual = ma.runOnSubImgs(tiles, None, 16, 'virtual', verbose=False,
+                                      pipeline=False)
+            maps = [fun.loadImg('Output/'+run+'/DirtMaps/montage.png')
+                    for run in ('files','virtual')]
+            tiles = tilesource.TileSource(pan, mask, numParts=4, halo=8)
+            nose.tools.assert_raises(Exception, ma.runOnSubImgs, tiles, None, 16,
+                                     'halo', verbose=False)
+        finally:
+            os.chdir(cwd)
+        nose.tools.assert_equal(virtual, files)
+        nose.tools.assert_true(np.array_equal(maps[0], maps[1]))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])
@@ -0,0 +1,77 @@
+"""
+Checks the preprocessed tile store of GenSIP.bigscans.tilestore: stored tiles
+threshold the same as bigfoils.bigRegionalThresh on the decoded tiles, and the
+store is rebuilt when a tile or the poster parameters change.
+"""
+
+import numpy as np
+import GenSIP.functions as fun
+import GenSIP.bigscans.images as images
+import GenSIP.bigscans.bigfoils as bf
+import GenSIP.bigscans.tilestore as ts
+import cv2
+import os
+import shutil
+import tempfile
+import unittest
+import nose
+
+
+class Test_TileStore (unittest.TestCase):
+
+    def setUp(self):
+        self.DIRNAME = os.path.split(__file__)[0]
+        STDDir = os.path.join(self.DIRNAME,'..','..','standards')
+        self.tmpDir = tempfile.mkdtemp()
+        self.panFolder = os.path.join(self.tmpDir,'subs')
+        self.maskFolder = os.path.join(self.tmpDir,'masks')
+        self.storeDir = os.path.join(self.tmpDir,'store')
+        os.makedirs(self.panFolder)
+        os.makedirs(self.maskFolder)
+        names = sorted([f for f in os.listdir(os.path.join(STDDir,'all_stds'))
+                        if f.endswith('.tif')])[:3]
+        for name in names:
+            shutil.copy(os.path.join(STDDir,'all_stds',name), self.panFolder)
+            shutil.copy(os.path.join(STDDir,'all_masks',name), self.maskFolder)
+        self.names = names
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_stored_tiles_match_bigRegionalThresh(self):
+        store = ts.openTileStore(self.panFolder, self.maskFolder, self.storeDir)
+        nose.tools.assert_equal(store.names(), self.names)
+        for tile in store:
+            subImage = fun.loadImg(os.path.join(self.panFolder,tile['name']),0)
+            subMask = fun.loadImg(os.path.join(self.maskFolder,tile['name']),0)
+            poster = images.bigPosterfy(images.bigPostPreProc(subImage))
+            nose.tools.assert_equal(np.sum(tile['mask']), np.sum(subMask.astype(np.bool_)))
+            for MoDirt in ('Mo','dirt'):
+                ref = bf.bigRegionalThresh(subImage,poster,Mask=subMask,p=120,d=150,
+                                           m=190,hE=230,pt=240,MoDirt=MoDirt)
+                nose.tools.assert_true(np.array_equal(ref.astype(np.bool_),
+                    ts.threshTile(tile,p=120,d=150,m=190,hE=230,pt=240,MoDirt=MoDirt)))
+
+    def test_store_is_reused_and_invalidated(self):
+        store = ts.openTileStore(self.panFolder, self.maskFolder, self.storeDir)
+        manifest = store.manifest
+        # Nothing changed: the same store is opened
+        nose.tools.assert_equal(
+            ts.openTileStore(self.panFolder, self.maskFolder, self.storeDir).manifest, manifest)
+        # Different poster parameters
+        store = ts.openTileStore(self.panFolder, self.maskFolder, self.storeDir, KuSize=13)
+        nose.tools.assert_equal(dict(store.manifest['params']['poster'])['KuSize'], 13)
+        # A tile written again
+        path = os.path.join(self.panFolder,self.names[0])
+        img = fun.loadImg(path,0)
+        img[:10,:10] = 0
+        cv2.imwrite(path,img)
+        os.utime(path,(0,0))
+        store = ts.openTileStore(self.panFolder, self.maskFolder, self.storeDir, KuSize=13)
+        nose.tools.assert_true(np.array_equal(store.tile(0)['blurs'][5][20:,20:],
+                                              cv2.GaussianBlur(img,(5,5),0)[20:,20:]))
+
+if __name__=='__main__':
+    import sys
+    module_name = sys.modules[__name__].__file__
+    nose.run(argv=[sys.argv[0],module_name,'-v'])